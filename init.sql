@@ -1,12 +1,16 @@
 CREATE DATABASE RFChain;
 CREATE TABLE RFChain.TagDB (  
   `id` int(10) NOT NULL AUTO_INCREMENT,
-  `tagID` VARCHAR(64) NOT NULL,  
-  `b` VARCHAR(256) NOT NULL,
+  `tagID` BINARY(16) NOT NULL,  
+  `b` VARBINARY(64) NOT NULL,
   `reader` int(10) NOT NULL,
   `timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,
-  CONSTRAINT UC_TagDB UNIQUE (id, tagID)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `UC_TagDB_tagID` (`tagID`)
 );
 CREATE USER 'user'@'%' IDENTIFIED BY 'password';
 GRANT ALL PRIVILEGES ON RFChain.TagDB TO 'user'@'%';
-FLUSH PRIVILEGES;
\ No newline at end of file
+-- migrate_tagdb.py builds TagDB_v2 next to TagDB and keeps the old table as TagDB_hex
+GRANT SELECT, INSERT, CREATE, DROP, ALTER ON RFChain.TagDB_v2 TO 'user'@'%';
+GRANT SELECT, INSERT, CREATE, DROP, ALTER ON RFChain.TagDB_hex TO 'user'@'%';
+FLUSH PRIVILEGES;
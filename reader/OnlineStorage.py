@@ -0,0 +1,111 @@
+import time
+
+from bisect import bisect_left, insort
+
+'''
+Online storage of a tag: messages (dicts with a "timestamp" and a "reader") stored under an ID
+An ID can get more than one message, they are kept in the order they were added
+Besides the messages per ID there are two indexes, so no query scans all messages:
+ * by reader   : positions (k, index) of the messages of every reader
+ * by timestamp: sorted (timestamp, position) of all messages, searched with bisect
+The indexes only hold positions, the messages themselves are stored once
+'''
+class OnlineStorage:
+    __slots__ = ("entries", "readers", "timestamps", "count")
+
+    def __init__(self, entries: dict = None):
+        self.entries = {}
+        self.readers = {}
+        self.timestamps = []
+        # messages added so far, orders messages with the same timestamp
+        self.count = 0
+        for (k, v) in (entries or {}).items():
+            for message in v:
+                self.insert(k, message)
+
+    '''
+    adds a new message of reader under ID k, sets its timestamp and reader
+    '''
+    def add(self, reader: int, k: str, v: dict) -> dict:
+        v["timestamp"] = time.time()
+        v["reader"] = reader
+        self.insert(k, v)
+        return v
+
+    '''
+    adds a message that already has a timestamp and reader (e.g. read from the tag store)
+    '''
+    def insert(self, k: str, v: dict):
+        messages = self.entries.setdefault(k, [])
+        position = (k, len(messages))
+        messages.append(v)
+        self.readers.setdefault(v.get("reader"), []).append(position)
+        record = (v.get("timestamp", 0.0), self.count, position)
+        # messages normally arrive in time order, then this is an append
+        if len(self.timestamps) == 0 or self.timestamps[-1] <= record:
+            self.timestamps.append(record)
+        else:
+            insort(self.timestamps, record)
+        self.count += 1
+
+    '''
+    returns message index of ID k (negative indices count from the newest message), None if there is none
+    '''
+    def get(self, k: str, index: int = 0) -> dict:
+        messages = self.entries.get(k)
+        if messages is None or index >= len(messages) or index < -len(messages):
+            return None
+        return messages[index]
+
+    '''
+    returns the newest message of ID k, None if there is none
+    '''
+    def latest(self, k: str) -> dict:
+        return self.get(k, -1)
+
+    '''
+    returns all messages of a reader as (k, message) in the order they were added
+    '''
+    def by_reader(self, reader: int) -> list:
+        return [(k, self.entries[k][i]) for (k, i) in self.readers.get(reader, [])]
+
+    '''
+    returns the messages with a timestamp of at least timestamp (until: before until) as (k, message), oldest first
+    '''
+    def since(self, timestamp: float, until: float = None) -> list:
+        first = bisect_left(self.timestamps, (timestamp,))
+        last = len(self.timestamps) if until is None else bisect_left(self.timestamps, (until,))
+        return [(k, self.entries[k][i]) for (_, _, (k, i)) in self.timestamps[first:last]]
+
+    '''
+    the dict interface of the old online storage: ID -> list of messages
+    '''
+    def __contains__(self, k: str) -> bool:
+        return k in self.entries
+
+    def __getitem__(self, k: str) -> list:
+        return self.entries[k]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def items(self):
+        return self.entries.items()
+
+    def values(self):
+        return self.entries.values()
+
+    '''
+    only the messages are pickled, the indexes are rebuilt when the tag is loaded
+    '''
+    def __getstate__(self):
+        return self.entries
+
+    def __setstate__(self, state):
+        self.__init__(state)
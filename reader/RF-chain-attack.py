@@ -1,8 +1,7 @@
-import pickle
-import json
-
 from Tag import Tag
+from TagStore import TagStore
 from pprint import pprint
+from protocols.KeyRegistry import KeyRegistry
 from protocols.RFChain import RFChain
 from Crypto.Hash import SHA256
 from Crypto.Cipher import AES
@@ -14,39 +13,40 @@ Shows that the attack can work
 
 # read the tag
 tagID = int(input("Specify tag ID: "))
-with open("%d.tag" % tagID, 'rb') as tagfile:    
-    tag = pickle.load(tagfile)
-    
-    # attacker needs to know two things, an ID, and the content of the blockchain
-    # ID can be found on the tag
-    # content of blockchain is public
-    ID = tag.content[:4]
-    a = tag.content[130:194]
-
-    # now the attacker has to wait for an update since this a value is new
-    data = json.load(open("out/keyfile.json"))
-    RFChain.update_tag(1, tag, data)
-    
-
-    B = tag.onlineStorage["storage"]
-    print("Found identifier: %s" % ID.hex())
-
-    path = []
-
-    # check values
-    for IDx, val in B.items():
-        try:
-            hx = int.from_bytes(a, "big") ^ val[0]["b"]
-            hx = hx.to_bytes(64, "big")
-            hx = hx[32:]
-            print(hx.hex())
-            #kx = SHA256.new(hx).digest() 
-            cipher = AES.new(hx, AES.MODE_ECB)
-            IDx2 = cipher.encrypt(pad(ID, 16))
-            if IDx == IDx2.hex():
-                print("Found match for ID: %s with b value: %d" % (IDx2.hex(), val[0]["b"]))
-                path.append(IDx2.hex())
-                a = val[0]["b"]
-                break
-        except:
-            None
+data = KeyRegistry.load("out/keyfile.json")
+tag = TagStore.of(data).get(tagID, full=True)
+
+# attacker needs to know two things, an ID, and the content of the blockchain
+# ID can be found on the tag
+# content of blockchain is public
+ID = tag.content[:4]
+a = tag.content[130:194]
+
+# now the attacker has to wait for an update since this a value is new
+RFChain.update_tag(1, tag, data)
+
+
+B = tag.storage
+print("Found identifier: %s" % ID.hex())
+
+path = []
+
+# check values
+for IDx in B:
+    try:
+        # b is stored as hex string
+        b = bytes.fromhex(B.get(IDx)["b"])
+        hx = int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+        hx = hx.to_bytes(64, "big")
+        hx = hx[32:]
+        print(hx.hex())
+        #kx = SHA256.new(hx).digest() 
+        cipher = AES.new(hx, AES.MODE_ECB)
+        IDx2 = cipher.encrypt(pad(ID, 16))
+        if IDx == IDx2.hex():
+            print("Found match for ID: %s with b value: %s" % (IDx2.hex(), b.hex()))
+            path.append(IDx2.hex())
+            a = b
+            break
+    except:
+        None
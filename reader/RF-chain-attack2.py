@@ -1,12 +1,12 @@
-import pickle
-import json
 import os
 import shutil
 import mysql.connector
 import traceback
 
 from Tag import Tag
+from TagStore import TagStore
 from pprint import pprint
+from protocols.KeyRegistry import KeyRegistry
 from protocols.RFChain import RFChain
 from Crypto.Hash import SHA256
 from Crypto.Cipher import AES
@@ -51,61 +51,59 @@ if os.path.exists(dir):
     shutil.rmtree(dir)
 os.mkdir(dir)
 RFChain.generate_reader_configs(10, None, dir)
-data = json.load(open("%s/keyfile.json" % (dir)))
+data = KeyRegistry.load("%s/keyfile.json" % (dir))
 RFChain.generate_tag_secret(1, 1, data)
 RFChain.generate_tag_secret(1, 2, data)
 
-with open("1.tag", 'rb') as tagfile:    
-    with open("2.tag", 'rb') as tagfile2:    
-        tag = pickle.load(tagfile)   
-        tag2 = pickle.load(tagfile2)
+tag = TagStore.of(data).get(1, full=True)
+tag2 = TagStore.of(data).get(2, full=True)
 
-        # do some updates
-        RFChain.update_tag(1, tag, data)
-        RFChain.update_tag(3, tag, data)
-        #RFChain.update_tag(5, tag, data)
-        #RFChain.update_tag(7, tag, data)
-        #RFChain.update_tag(6, tag2, data)
-        #RFChain.update_tag(4, tag2, data)
-        #RFChain.update_tag(2, tag2, data)
+# do some updates
+RFChain.update_tag(1, tag, data)
+RFChain.update_tag(3, tag, data)
+#RFChain.update_tag(5, tag, data)
+#RFChain.update_tag(7, tag, data)
+#RFChain.update_tag(6, tag2, data)
+#RFChain.update_tag(4, tag2, data)
+#RFChain.update_tag(2, tag2, data)
 
-        # get all data
-        mydb = mysql.connector.connect(
-            host="10.229.105.235",
-            user="user",
-            password="pass",
-            #auth_plugin="mysql_native_password"
-        )
-        cursor = mydb.cursor()
-        query = ("SELECT * FROM RFChain.TagDB")
-        cursor.execute(query)
-        B = cursor.fetchall()
-        cursor.close()
-        mydb.close()
+# get all data
+mydb = mysql.connector.connect(
+    host="10.229.105.235",
+    user="user",
+    password="pass",
+    #auth_plugin="mysql_native_password"
+)
+cursor = mydb.cursor()
+query = ("SELECT * FROM RFChain.TagDB")
+cursor.execute(query)
+B = cursor.fetchall()
+cursor.close()
+mydb.close()
 
 
-        # get all X and Y variables 
-        X = []
-        Y = []
-        print(len(B))
-        for val in B:
-            #print(val)
-            IDx = val[1]
-            bx = int(val[2], 16)
-            reader = val[3]
-            try:
-                bit_length = bx.bit_length()
-                if bit_length <= 256:
-                    None # what to do?
-                else:
-                    bx_bytes = bx.to_bytes(64, "big")
-                    x = bx_bytes[:32]
-                    y1 = curve.y_recover(int.from_bytes(x))
-                    y2 = curve.y_recover(int.from_bytes(x), sign=1)
-                    print("x: %s" % x.hex())
-                    print("y1: %s" % hex(y1)[2:])
-                    print("y2: %s" % hex(y2)[2:])
-                    X.append(x)
-            except Exception as e:
-                print(e)
-                traceback.print_exc()
+# get all X and Y variables 
+X = []
+Y = []
+print(len(B))
+for val in B:
+    #print(val)
+    IDx = val[1]
+    bx = int.from_bytes(val[2], "big")
+    reader = val[3]
+    try:
+        bit_length = bx.bit_length()
+        if bit_length <= 256:
+            None # what to do?
+        else:
+            bx_bytes = bx.to_bytes(64, "big")
+            x = bx_bytes[:32]
+            y1 = curve.y_recover(int.from_bytes(x))
+            y2 = curve.y_recover(int.from_bytes(x), sign=1)
+            print("x: %s" % x.hex())
+            print("y1: %s" % hex(y1)[2:])
+            print("y2: %s" % hex(y2)[2:])
+            X.append(x)
+    except Exception as e:
+        print(e)
+        traceback.print_exc()
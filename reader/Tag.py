@@ -1,20 +1,184 @@
-import pickle
+import re
 import time
 
+from array import array
+from collections import deque
+from OnlineStorage import OnlineStorage
+
+'''
+Events of a tag in a ring buffer of fixed-width records: reader, type, timestamp and key (online storage events)
+Only the last size events are kept, total counts all events so far
+An event that is not in the tag store yet (sequence number >= persisted) is never dropped, the buffer grows
+until the store has it (see trim)
+The messages of the old event dicts are only formatted when an event is read
+'''
+class EventLog:
+    __slots__ = ("tag", "size", "total", "persisted", "head", "readers", "types", "timestamps", "keys")
+
+    READ = 0
+    UPDATE = 1
+    STORAGE = 2
+    TYPES = ["read", "update", "storage"]
+
+    def __init__(self, tag: int, size: int):
+        self.tag = tag
+        self.size = size
+        self.total = 0
+        # number of events that are in the tag store
+        self.persisted = 0
+        # buffer position of the oldest event
+        self.head = 0
+        self.readers = array("i")
+        self.types = array("B")
+        self.timestamps = array("d")
+        # the keys are references to the keys of the online storage, not copies
+        self.keys = []
+
+    def append(self, reader: int, type: int, key: str = None, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.time()
+        # the oldest event can only be overwritten if the store has it
+        if len(self.types) < self.size or self.total - len(self.types) >= self.persisted:
+            self.linearize()
+            self.readers.append(reader)
+            self.types.append(type)
+            self.timestamps.append(timestamp)
+            self.keys.append(key)
+        else:
+            i = self.head
+            self.readers[i] = reader
+            self.types[i] = type
+            self.timestamps[i] = timestamp
+            self.keys[i] = key
+            self.head = (self.head + 1) % len(self.types)
+        self.total += 1
+
+    '''
+    moves the oldest event to the start of the buffer
+    '''
+    def linearize(self):
+        if self.head == 0:
+            return
+        h = self.head
+        self.readers = self.readers[h:] + self.readers[:h]
+        self.types = self.types[h:] + self.types[:h]
+        self.timestamps = self.timestamps[h:] + self.timestamps[:h]
+        self.keys = self.keys[h:] + self.keys[:h]
+        self.head = 0
+
+    '''
+    the store has the first persisted events, only the last size events are kept from now on
+    '''
+    def trim(self, persisted: int):
+        self.persisted = persisted
+        if len(self.types) > self.size:
+            self.linearize()
+            drop = min(len(self.types) - self.size, max(0, persisted - (self.total - len(self.types))))
+            del self.readers[:drop]
+            del self.types[:drop]
+            del self.timestamps[:drop]
+            del self.keys[:drop]
+
+    '''
+    adds an event dict of an old tag, the timestamp and key are parsed from the message
+    '''
+    def append_legacy(self, event: dict):
+        match = re.search(r" at ([0-9.]+)(?: with ID (\w+))?$", event["msg"])
+        type = EventLog.UPDATE if event["type"] == "update" else EventLog.READ
+        if match is not None and match.group(2) is not None:
+            type = EventLog.STORAGE
+        self.append(event["reader"], type, match.group(2) if match else None, float(match.group(1)) if match else 0.0)
+
+    def __len__(self) -> int:
+        return len(self.types)
+
+    '''
+    buffer position of the i-th kept event (oldest first)
+    '''
+    def position(self, i: int) -> int:
+        return (self.head + i) % len(self.types)
+
+    '''
+    kept events with a sequence number (index in all events so far) of at least seq: (seq, reader, type, timestamp, key)
+    '''
+    def since(self, seq: int) -> list:
+        first = self.total - len(self.types)
+        records = []
+        for i in range(max(0, seq - first), len(self.types)):
+            j = self.position(i)
+            records.append((first + i, self.readers[j], self.types[j], self.timestamps[j], self.keys[j]))
+        return records
+
+    '''
+    the event as dict with the message of the old event log
+    '''
+    def render(self, i: int) -> dict:
+        j = self.position(i)
+        (reader, type, timestamp, key) = (self.readers[j], self.types[j], self.timestamps[j], self.keys[j])
+        if type == EventLog.UPDATE:
+            msg = "reader %d updated tag %d at %f" % (reader, self.tag, timestamp)
+        elif type == EventLog.STORAGE:
+            msg = "reader %d updated online storage for tag %d at %f with ID %s" % (reader, self.tag, timestamp, key)
+        else:
+            msg = "reader %d read tag %d at %f" % (reader, self.tag, timestamp)
+        return {"reader": reader, "type": EventLog.TYPES[type], "msg": msg}
+
+    def __getitem__(self, i: int) -> dict:
+        if i < 0:
+            i += len(self.types)
+        if i < 0 or i >= len(self.types):
+            raise IndexError("event index out of range")
+        return self.render(i)
+
+    def __iter__(self):
+        for i in range(len(self.types)):
+            yield self.render(i)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in EventLog.__slots__}
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        # event logs pickled before head and persisted existed: a full buffer started at total % size
+        if "head" not in state:
+            self.head = self.total % self.size if len(self.types) == self.size else 0
+            self.persisted = self.total
+
+
 '''
 Tag represents a physical RFID tag
 '''
-class Tag:  
-    def __init__(self, id, content: bytearray, mode):  
+class Tag:
+    __slots__ = ("id", "content", "mode", "history", "updates", "events", "storage", "stored")
+
+    # old contents and events that are kept in memory once they are in the tag store, the store keeps all of them
+    _history_size = 16
+    _events_size = 64
+
+    def __init__(self, id, content: bytearray, mode):
         if(isinstance(content, (bytes, bytearray))):
-            self.id = id 
+            self.id = id
             self.content = content
-            self.history = []
-            self.onlineStorage = {"events": [], "storage": {}}
+            # the contents that are not in the tag store yet are always kept (see trim)
+            self.history = deque()
+            # number of contents that were replaced so far
+            self.updates = 0
+            self.events = EventLog(id, Tag._events_size)
+            self.storage = OnlineStorage()
             self.mode = mode
+            # bookkeeping of the tag store
+            self.stored = None
         else:
             print("Content should be a byte array!")
 
+    '''
+    events and online storage in the layout of the old tag objects
+    '''
+    @property
+    def onlineStorage(self) -> dict:
+        return {"events": self.events, "storage": self.storage}
+
     '''
     updates the tag content
     overwrites current value
@@ -22,31 +186,59 @@ class Tag:
     '''
     def updateTagContent(self, reader, content: bytearray):
         if(isinstance(content, (bytes, bytearray))):
-            self.onlineStorage["events"].append({"reader": reader, "type": "update", "msg": "reader %d updated tag %d at %f" % (reader, self.id, time.time())})
+            self.events.append(reader, EventLog.UPDATE)
             self.history.append(self.content)
+            self.updates += 1
             self.content = content
         else:
             print("Content should be a byte array!")
 
     def readTag(self, reader):
-        self.onlineStorage["events"].append({"reader": reader, "type": "read", "msg": "reader %d read tag %d at %f" % (reader, self.id, time.time())})
+        self.events.append(reader, EventLog.READ)
 
     '''
     adds a new message to the storage
     '''
     def updateOnlineStorage(self, reader, k, v):
-        if k not in self.onlineStorage["storage"]:
-            self.onlineStorage["storage"][k] = []
-        v["timestamp"] = time.time()
-        v["reader"] = reader
-        self.onlineStorage["storage"][k].append(v)
-        self.onlineStorage["events"].append({"reader": reader, "type": "read", "msg": "reader %d updated online storage for tag %d at %f with ID %s" % (reader, self.id, time.time(), k)})
+        self.storage.add(reader, k, v)
+        self.events.append(reader, EventLog.STORAGE, k, v["timestamp"])
 
     '''
-    read message from storage
+    read message index of ID k from storage (-1: newest), None if the message does not exist
     '''
     def getOnlineStorageMsg(self, k, index=0):
-        if k not in self.onlineStorage["storage"]:
-            print("key %s does not exist!" % k)
-        else:
-            return self.onlineStorage["storage"][k][0]
\ No newline at end of file
+        return self.storage.get(k, index)
+
+    '''
+    called after the tag was written to the store: drops the old contents and events the store has
+    '''
+    def trim(self):
+        while len(self.history) > Tag._history_size:
+            self.history.popleft()
+        self.events.trim(self.events.total)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in Tag.__slots__}
+
+    '''
+    also restores tags that were pickled before the event log (history list, events as list of dicts)
+    '''
+    def __setstate__(self, state):
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **(state[1] or {}))
+        if "onlineStorage" in state:
+            self.id = state["id"]
+            self.content = state["content"]
+            self.mode = state["mode"]
+            self.history = deque(state["history"])
+            self.updates = len(state["history"])
+            self.events = EventLog(self.id, Tag._events_size)
+            for event in state["onlineStorage"]["events"]:
+                self.events.append_legacy(event)
+            self.storage = OnlineStorage(state["onlineStorage"]["storage"])
+            self.stored = state.get("stored")
+            return
+        for (name, value) in state.items():
+            setattr(self, name, value)
+        if isinstance(self.storage, dict):
+            self.storage = OnlineStorage(self.storage)
@@ -0,0 +1,179 @@
+import json
+import os
+import pickle
+import sqlite3
+
+from Tag import Tag, EventLog
+from protocols.KeyRegistry import KeyRegistry
+
+'''
+Stores all virtual tags of a keyfile directory in one SQLite file (default <dir>/tags.db, "tagstore" in the keyfile)
+ * tags   : current content of every tag, looked up by its primary key (the tag ID)
+ * history: old contents, events and online storage entries are append-only tables
+put only appends what was added to a tag since it was read, the history is never rewritten
+A tag object only keeps its last contents and events (see Tag), the store keeps all of them
+Reads go through a memory map of the database file (mmap_size), WAL mode lets readers and one writer work at the same time
+
+Tags that still exist as <dir>/<id>.tag pickle file are read from that file, after the next put the store takes precedence
+'''
+class TagStore:
+
+    # bytes of the database file that are memory mapped
+    _mmap_size=1 << 30
+
+    _create_tables = ["CREATE TABLE IF NOT EXISTS tags ("
+                      "id INTEGER PRIMARY KEY,"
+                      "mode TEXT NOT NULL,"
+                      "content BLOB NOT NULL,"
+                      "history INTEGER NOT NULL DEFAULT 0,"
+                      "events INTEGER NOT NULL DEFAULT 0"
+                      ")",
+                      "CREATE TABLE IF NOT EXISTS history ("
+                      "tag INTEGER NOT NULL,"
+                      "seq INTEGER NOT NULL,"
+                      "content BLOB NOT NULL,"
+                      "PRIMARY KEY (tag, seq)"
+                      ") WITHOUT ROWID",
+                      "CREATE TABLE IF NOT EXISTS events ("
+                      "tag INTEGER NOT NULL,"
+                      "seq INTEGER NOT NULL,"
+                      "event TEXT NOT NULL,"
+                      "PRIMARY KEY (tag, seq)"
+                      ") WITHOUT ROWID",
+                      "CREATE TABLE IF NOT EXISTS storage ("
+                      "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                      "tag INTEGER NOT NULL,"
+                      "k TEXT NOT NULL,"
+                      "v TEXT NOT NULL"
+                      ")",
+                      "CREATE INDEX IF NOT EXISTS storage_tag ON storage (tag)"]
+
+    def __init__(self, path: str, dir: str = None):
+        self.path = path
+        # directory of the legacy tag files
+        self.dir = dir
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # WAL is consistent after a crash with synchronous=NORMAL, only the last transactions may be lost
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA mmap_size=%d" % TagStore._mmap_size)
+        with self.db:
+            for create_table in TagStore._create_tables:
+                self.db.execute(create_table)
+
+    '''
+    returns the tag store of a keyfile, opened once per keyfile dict
+    '''
+    @staticmethod
+    def of(data: dict) -> "TagStore":
+        return KeyRegistry.of(data).memo("tag store", lambda: TagStore.open(data))
+
+    @staticmethod
+    def open(data: dict) -> "TagStore":
+        path = data.get("tagstore", "tags.db")
+        if not os.path.isabs(path):
+            path = os.path.join(data["dir"], path)
+        return TagStore(path, data["dir"])
+
+    '''
+    returns the tag with ID id
+    only the current content is read, unless full is set: then also the history, events and online storage
+    throws a FileNotFoundError if the tag does not exist
+    '''
+    def get(self, id: int, full: bool = False) -> Tag:
+        row = self.db.execute("SELECT mode, content, history, events FROM tags WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            return self.get_legacy(id)
+        (mode, content, nr_history, nr_events) = row
+        tag = Tag(id, bytes(content), mode)
+        if full:
+            # the last contents and events, as many as the tag keeps
+            for (content,) in self.db.execute("SELECT content FROM (SELECT seq, content FROM history WHERE tag = ? ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+                                              (id, Tag._history_size)):
+                tag.history.append(bytes(content))
+            for (event,) in self.db.execute("SELECT event FROM (SELECT seq, event FROM events WHERE tag = ? ORDER BY seq DESC LIMIT ?) ORDER BY seq",
+                                            (id, tag.events.size)):
+                TagStore.append_event(tag.events, json.loads(event))
+            for (k, v) in self.db.execute("SELECT k, v FROM storage WHERE tag = ? ORDER BY id", (id,)):
+                tag.storage.insert(k, json.loads(v))
+        # the counters continue where the stored tag stopped
+        tag.updates = nr_history
+        tag.events.total = nr_events
+        tag.events.persisted = nr_events
+        tag.stored = {"history": nr_history, "events": nr_events, "storage": {k: len(v) for (k, v) in tag.storage.items()}}
+        return tag
+
+    '''
+    events are stored as compact records, tags stored before the event log have the old event dicts
+    '''
+    @staticmethod
+    def append_event(events: EventLog, event: dict):
+        if "msg" in event:
+            events.append_legacy(event)
+        else:
+            events.append(event["reader"], event["type"], event["key"], event["timestamp"])
+
+    '''
+    tag from a <dir>/<id>.tag pickle file (written before the tag store existed)
+    '''
+    def get_legacy(self, id: int) -> Tag:
+        if self.dir is None:
+            raise FileNotFoundError("Tag %d is not in the tag store %s" % (id, self.path))
+        try:
+            with open("%s/%d.tag" % (self.dir, id), "rb") as f:
+                tag = pickle.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError("Tag %d is not in the tag store %s" % (id, self.path))
+        tag.stored = None
+        return tag
+
+    '''
+    writes the tag, only the history, events and online storage entries that were added since get are appended
+    a tag that was not read from the store replaces the stored tag with the same ID
+    '''
+    def put(self, tag: Tag):
+        with self.db:
+            self.write(tag)
+
+    '''
+    writes many tags in a single transaction (bulk issuance)
+    '''
+    def put_many(self, tags: list):
+        with self.db:
+            for tag in tags:
+                self.write(tag)
+
+    def write(self, tag: Tag):
+        stored = tag.stored
+        if stored is None:
+            # new tag (or a legacy one), everything is written
+            for table in ["history", "events", "storage"]:
+                self.db.execute("DELETE FROM %s WHERE tag = ?" % table, (tag.id,))
+            stored = {"history": 0, "events": 0, "storage": {}}
+
+        # the tag keeps the last len(history) contents, the ones that replaced more than that are lost
+        first = tag.updates - len(tag.history)
+        self.db.executemany("INSERT INTO history (tag, seq, content) VALUES (?, ?, ?)",
+                            [(tag.id, first + i, bytes(content)) for (i, content) in enumerate(tag.history) if first + i >= stored["history"]])
+        self.db.executemany("INSERT INTO events (tag, seq, event) VALUES (?, ?, ?)",
+                            [(tag.id, seq, json.dumps({"reader": reader, "type": type, "timestamp": timestamp, "key": key}))
+                             for (seq, reader, type, timestamp, key) in tag.events.since(stored["events"])])
+        entries = []
+        for (k, v) in tag.storage.items():
+            for value in v[stored["storage"].get(k, 0):]:
+                entries.append((tag.id, k, json.dumps(value)))
+        self.db.executemany("INSERT INTO storage (tag, k, v) VALUES (?, ?, ?)", entries)
+        self.db.execute("INSERT OR REPLACE INTO tags (id, mode, content, history, events) VALUES (?, ?, ?, ?, ?)",
+                        (tag.id, tag.mode, bytes(tag.content), tag.updates, tag.events.total))
+
+        tag.stored = {"history": tag.updates, "events": tag.events.total, "storage": {k: len(v) for (k, v) in tag.storage.items()}}
+        tag.trim()
+
+    '''
+    IDs of all tags in the store (not the legacy tag files)
+    '''
+    def ids(self) -> list:
+        return [id for (id,) in self.db.execute("SELECT id FROM tags ORDER BY id")]
+
+    def close(self):
+        self.db.close()
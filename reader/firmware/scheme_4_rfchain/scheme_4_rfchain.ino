@@ -310,7 +310,7 @@ bool update(uint8_t *data, const uint16_t dataLen, uint8_t *EPC, uint16_t EPCLen
     bool success = true;
     // write new secret to mysql
     char query[256];
-    snprintf(query, sizeof(query), "INSERT INTO RFChain.TagDB (tagID, b, reader) VALUES ('%s', '%s', %d)", IDiHex, bHex, readerId);
+    snprintf(query, sizeof(query), "INSERT INTO RFChain.TagDB (tagID, b, reader) VALUES (UNHEX('%s'), UNHEX('%s'), %d)", IDiHex, bHex, readerId);
     printSerial(query);
     sendToMQTT(query);
     if(conn.connect(server_addr, 3306, user, password))
@@ -427,7 +427,7 @@ bool verify(const uint8_t *data, const uint16_t dataLen, uint8_t *plaintext, uin
                     uint16_t lastReader;
 
                     // use the hex value
-                    snprintf(query, sizeof(query), "SELECT reader, b FROM RFChain.TagDB WHERE tagID = '%s' LIMIT 1", IDiHex);
+                    snprintf(query, sizeof(query), "SELECT reader, HEX(b) FROM RFChain.TagDB WHERE tagID = UNHEX('%s') LIMIT 1", IDiHex);
                     printSerial(query);
                     sendToMQTT(query);
                     if(conn.connect(server_addr, 3306, user, password))
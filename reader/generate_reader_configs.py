@@ -1,9 +1,16 @@
 '''
-python generate_reader_configs.py [-n curveSizeBytesber of readers] [-m mode] [-d dir] [-p pathfile]
+python generate_reader_configs.py [-n curveSizeBytesber of readers] [-m mode] [-d dir] [-p pathfile] [--storage engine] [--clear-storage]
+                                  [-g graphfile] [--min-len l] [--max-len l] [-j workers] [--encoding encoding] [-v]
 generates n configuration files and headers according to mode m
+storage selects where RF-Chain keeps the online secrets: mysql (default), sqlite (file in dir) or memory
+existing online secrets are only deleted with --clear-storage
 pathfile describes the set of valid paths:
 * 1 valid path per line
 * using indices [0..n>
+graphfile describes the valid paths of tracker as a reader graph, every walk of min-len..max-len readers is valid:
+* 1 reader per line, followed by the readers that can come next (e.g. "0: 1 2")
+* the paths are compiled by j processes to valid_paths.jsonl in dir
+encoding selects the tracker tag content format: raw (x || y, default) or compressed (02/03 || x, 126 instead of 240 bytes)
 
 TODO: 
 1) Better checks for valid paths
@@ -15,6 +22,7 @@ import os
 import shutil
 import re
 
+from protocols.Log import Log
 from protocols.Tracker import Tracker
 from protocols.StepAuth import StepAuth
 from protocols.Baseline import Baseline
@@ -29,8 +37,26 @@ parser.add_argument('-d', dest='dir', type=str, nargs=1,
                     help='Output directory', required=True)
 parser.add_argument('-p', dest='pathfile', type=str, nargs=1,
                     help='Pathfile with valid paths', required=False)
+parser.add_argument('--storage', dest='storage', type=str, nargs=1, default=[None],
+                    help='Online storage of RF-Chain', choices=["mysql", "sqlite", "memory"], required=False)
+parser.add_argument('--clear-storage', dest='clear_storage', action='store_true',
+                    help='RF-Chain: delete the online secrets that are already stored', required=False)
+parser.add_argument('-g', dest='graphfile', type=str, nargs=1,
+                    help='Tracker: reader graph of the valid paths', required=False)
+parser.add_argument('--min-len', dest='min_len', type=int, nargs=1, default=[1],
+                    help='Tracker: minimum number of readers of a path of the reader graph', required=False)
+parser.add_argument('--max-len', dest='max_len', type=int, nargs=1,
+                    help='Tracker: maximum number of readers of a path of the reader graph (default: number of readers)', required=False)
+parser.add_argument('-j', dest='workers', type=int, nargs=1, default=[None],
+                    help='Tracker: number of processes that compile the reader graph', required=False)
+parser.add_argument('--encoding', dest='encoding', type=str, nargs=1, default=["raw"],
+                    help='Tracker: format of the tag content', choices=["raw", "compressed"], required=False)
+
+parser.add_argument('-v', dest='verbose', action='count', default=0,
+                    help='Print the debug output of the protocol (keys are never printed)', required=False)
 
 args = parser.parse_args()
+Log.configure(args.verbose)
 nr_readers = args.nr_readers[0]
 scheme  = args.scheme[0]
 dir = args.dir[0]
@@ -48,10 +74,26 @@ try:
                 path.append(int(reader))
             valid_paths.append(path)
 except Exception as e:
-    if scheme == "tracker":
+    if scheme == "tracker" and args.graphfile is None:
         print("A path file is required for tracker! Error: %s\nExiting." % e)
         exit()
 
+# determine the reader graph, if available
+graph = None
+if args.graphfile is not None:
+    edges = {}
+    with open(args.graphfile[0]) as file:
+        for line in file:
+            readers = [int(reader) for reader in re.findall(r'\d+', line)]
+            if len(readers) == 0:
+                continue
+            for reader in readers:
+                if reader < 0 or reader >= nr_readers:
+                    raise ValueError("The reader graph can only use readers in range 0..nr_readers")
+            edges.setdefault(readers[0], []).extend(readers[1:])
+    max_len = args.max_len[0] if args.max_len is not None else nr_readers
+    graph = (edges, args.min_len[0], max_len, args.workers[0])
+
 try:
     if os.path.exists(dir):
         shutil.rmtree(dir)
@@ -65,10 +107,11 @@ try:
         Baseline.generate_reader_configs(nr_readers, valid_paths, dir)
     # Tracker
     elif scheme == "tracker":
-        Tracker.generate_reader_configs(nr_readers, valid_paths, dir)
+        Tracker.generate_reader_configs(nr_readers, valid_paths, dir, graph, args.encoding[0])
     # RF-chain
     elif scheme == "rfchain":
-        RFChain.generate_reader_configs(nr_readers, valid_paths, dir)
+        storage = {"engine": args.storage[0]} if args.storage[0] else None
+        RFChain.generate_reader_configs(nr_readers, valid_paths, dir, storage, args.clear_storage)
     else:
         raise(ValueError('Mode not supported!'))
 except FileExistsError:
@@ -1,73 +1,205 @@
 '''
-python generate_tag_secret.py [-f "keyfile"] [-m mode] [-p path]
+python generate_tag_secret.py [-f "keyfile"] [-m mode] [-p path] [-t tag] [--range first last] [--csv file] [-j workers] [-o output] [-v]
 generates n configuration files and headers according to mode m
+
+Bulk issuance: --range (can be repeated) and --csv issue many tags in one run
+ * csv lines: tag, followed by the path of the tag (e.g. "17, 0 1 2"), RF-Chain is initialized by the first reader
+ * tags without a path in the csv file use -p and -r
+ * the tag secrets are created by j worker processes (default: number of cores) that load the keyfile once
+ * the tags are written to the tag store by the main process, -o also streams every tag as a JSON line (tag, scheme, content)
+ * the online secrets of RF-Chain are inserted in batches
 '''
 import argparse
 import json
+import os
+import re
+import time
 import traceback
 
+from concurrent.futures import ProcessPoolExecutor
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
 from protocols.Tracker import Tracker
 from protocols.StepAuth import StepAuth
 from protocols.Baseline import Baseline
-from protocols.RFChain import RFChain\
-
-
-parser = argparse.ArgumentParser(description='Generates a tag secret')
-parser.add_argument('-f', dest='keyfile', type=str, nargs=1,
-                    help='Keyfile', required=True)
-parser.add_argument('-s', dest='scheme', type=str, nargs=1,
-                    help='Select scheme', choices=["tracker", "baseline", "stepauth", "rfchain"], required=True)
-parser.add_argument('-p', dest='path', type=int, nargs="+",
-                    help='Specify a path', required=False)
-parser.add_argument('-t', dest='tag', type=int, nargs=1,
-                    help='Tag identifier', required=True)
-parser.add_argument('-r', dest='reader', type=int, nargs=1,
-                    help='Specify a reader', required=False)
+from protocols.RFChain import RFChain
 
-args = parser.parse_args()
-keyfile = args.keyfile[0]
-scheme = args.scheme[0]
-path = args.path
-tag = args.tag[0]
+# tags (and online secrets of RF-Chain) that are stored together
+BATCH = 1000
 
-try:
-    data = json.load(open(keyfile))
+# state of a worker process, set by init_worker
+worker = {}
 
-    # check if a path is provided
-    if path:
-        for reader in path:
-            if reader >= len(data["readers"]) or reader < 0:
-                print("Reader %d does not exist! Only specify numbers between 0 and %d!\nExiting." % (reader, len(data["readers"])))
-                exit(0)
-        print("Generating secret for path %s using keyfile %s in scheme %s" % (path, keyfile, scheme))
-    elif scheme == "stepauth":
-        print("StepAuth needs a path!\nExiting.")
-        exit()
-    else:
-        print("Generating secret using keyfile %s in scheme %s" % (keyfile, scheme))
+'''
+loads the keyfile once per worker process
+'''
+def init_worker(keyfile: str, scheme: str, verbosity: int = 0):
+    worker["data"] = KeyRegistry.load(keyfile)
+    worker["scheme"] = scheme
+    Log.configure(verbosity)
 
-    # StepAuth
+'''
+creates the secret of a single tag, runs in a worker process
+returns the tag object and for RF-Chain the online secret and verified state (see RFChain.create_tag_secret)
+'''
+def create_tag(task: tuple) -> tuple:
+    (tag, path, reader) = task
+    data = worker["data"]
+    scheme = worker["scheme"]
     if scheme == "stepauth":
-        StepAuth.generate_tag_secret(tag, path, data)
-    # AES encrypted tag secret baseline
+        return (StepAuth.create_tag_secret(tag, path, data), None, None)
     elif scheme == "baseline":
-        Baseline.generate_tag_secret(tag, data)
-    # Tracker
+        return (Baseline.create_tag_secret(tag, data), None, None)
     elif scheme == "tracker":
-        Tracker.generate_tag_secret(tag, data)
-    # RF-chain
+        return (Tracker.create_tag_secret(tag, data), None, None)
     elif scheme == "rfchain":
-        try:
-            reader = args.reader[0]
-        except Exception as e:
-            print("RF-Chain needs a reader ID to initialize the tag: %s" % (e))
-        RFChain.generate_tag_secret(reader, tag, data)
+        return RFChain.create_tag_secret(reader, tag, data)
+    raise(ValueError('Mode not supported!'))
+
+'''
+issues the tags of all tasks (tag, path, reader) and writes them in order
+'''
+def issue(keyfile: str, scheme: str, data: dict, tasks: list, workers: int, output: str, verbosity: int = 0):
+    start = time.time()
+    pool = None
+    if workers == 1:
+        init_worker(keyfile, scheme, verbosity)
+        results = map(create_tag, tasks)
     else:
-        raise(ValueError('Mode not supported!'))
-except FileNotFoundError as e:
-    print("File not found! Make sure that the parent directory exists: %s" % (e))
-except json.JSONDecodeError as e:
-    print("File is not in JSON format! Error: %s" % e)
-except Exception as e:
-    print("Unknown exception: %s" % (e))
-    traceback.print_exc()
\ No newline at end of file
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(keyfile, scheme, verbosity))
+        chunksize = max(1, min(64, len(tasks) // (4 * (workers or os.cpu_count() or 1))))
+        results = pool.map(create_tag, tasks, chunksize=chunksize)
+
+    tagObjs = []
+    online = []
+    verified = []
+    count = 0
+    out = open(output, "w") if output is not None else None
+    try:
+        for (tagObj, secret, state) in results:
+            tagObjs.append(tagObj)
+            if out is not None:
+                out.write(json.dumps({"tag": tagObj.id, "scheme": scheme, "content": tagObj.content.hex()}) + "\n")
+            if secret is not None:
+                online.append(secret)
+                verified.append(state)
+            count += 1
+            if len(tagObjs) >= BATCH or count == len(tasks):
+                TagStore.of(data).put_many(tagObjs)
+                if len(online) > 0:
+                    RFChain.storage(data).insert_many(online)
+                    RFChain.checkpoint_many(data, verified)
+                tagObjs = []
+                online = []
+                verified = []
+                print("Issued %d of %d tags" % (count, len(tasks)))
+    finally:
+        if out is not None:
+            out.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    print("Issued %d tags in %.1f s" % (count, time.time() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generates a tag secret')
+    parser.add_argument('-f', dest='keyfile', type=str, nargs=1,
+                        help='Keyfile', required=True)
+    parser.add_argument('-s', dest='scheme', type=str, nargs=1,
+                        help='Select scheme', choices=["tracker", "baseline", "stepauth", "rfchain"], required=True)
+    parser.add_argument('-p', dest='path', type=int, nargs="+",
+                        help='Specify a path', required=False)
+    parser.add_argument('-t', dest='tag', type=int, nargs=1,
+                        help='Tag identifier', required=False)
+    parser.add_argument('--range', dest='ranges', type=int, nargs=2, action='append',
+                        help='Bulk: issue the tags first..last (inclusive)', required=False)
+    parser.add_argument('--csv', dest='csv', type=str, nargs=1,
+                        help='Bulk: issue the tags of a csv file (tag, path)', required=False)
+    parser.add_argument('-j', dest='workers', type=int, nargs=1, default=[None],
+                        help='Bulk: number of worker processes (default: number of cores)', required=False)
+    parser.add_argument('-o', dest='output', type=str, nargs=1, default=[None],
+                        help='Bulk: also write all tags to this file (JSON lines)', required=False)
+    parser.add_argument('-r', dest='reader', type=int, nargs=1,
+                        help='Specify a reader', required=False)
+    parser.add_argument('-v', dest='verbose', action='count', default=0,
+                        help='Print the debug output of the protocol (keys are never printed)', required=False)
+
+    args = parser.parse_args()
+    Log.configure(args.verbose)
+    keyfile = args.keyfile[0]
+    scheme = args.scheme[0]
+    path = args.path
+    if (args.tag is None) == (args.ranges is None and args.csv is None):
+        print("Specify either a tag (-t) or the tags of a bulk issuance (--range, --csv)!\nExiting.")
+        exit()
+
+    try:
+        data = KeyRegistry.load(keyfile)
+
+        # check if a path is provided
+        if path:
+            for reader in path:
+                if reader >= len(data["readers"]) or reader < 0:
+                    print("Reader %d does not exist! Only specify numbers between 0 and %d!\nExiting." % (reader, len(data["readers"])))
+                    exit(0)
+            print("Generating secret for path %s using keyfile %s in scheme %s" % (path, keyfile, scheme))
+        elif scheme == "stepauth" and args.csv is None:
+            print("StepAuth needs a path!\nExiting.")
+            exit()
+        else:
+            print("Generating secret using keyfile %s in scheme %s" % (keyfile, scheme))
+        reader = args.reader[0] if args.reader is not None else None
+
+        # bulk issuance
+        if args.tag is None:
+            tasks = []
+            for (first, last) in args.ranges or []:
+                for tag in range(first, last + 1):
+                    tasks.append((tag, path, reader))
+            if args.csv is not None:
+                with open(args.csv[0]) as file:
+                    for line in file:
+                        numbers = [int(number) for number in re.findall(r'\d+', line)]
+                        if len(numbers) == 0:
+                            continue
+                        tag_path = numbers[1:] if len(numbers) > 1 else path
+                        for tag_reader in tag_path or []:
+                            if "readers" in data and tag_reader >= len(data["readers"]):
+                                raise ValueError("Tag %d: paths can only use readers in range 0..nr_readers" % numbers[0])
+                        tasks.append((numbers[0], tag_path, tag_path[0] if len(numbers) > 1 else reader))
+            for (tag, tag_path, tag_reader) in tasks:
+                if scheme == "stepauth" and not tag_path:
+                    raise ValueError("StepAuth needs a path for tag %d" % tag)
+                if scheme == "rfchain" and tag_reader is None:
+                    raise ValueError("RF-Chain needs a reader ID to initialize tag %d" % tag)
+            print("Issuing %d tags" % len(tasks))
+            issue(keyfile, scheme, data, tasks, args.workers[0], args.output[0], args.verbose)
+            exit()
+
+        tag = args.tag[0]
+        # StepAuth
+        if scheme == "stepauth":
+            StepAuth.generate_tag_secret(tag, path, data)
+        # AES encrypted tag secret baseline
+        elif scheme == "baseline":
+            Baseline.generate_tag_secret(tag, data)
+        # Tracker
+        elif scheme == "tracker":
+            Tracker.generate_tag_secret(tag, data)
+        # RF-chain
+        elif scheme == "rfchain":
+            try:
+                reader = args.reader[0]
+            except Exception as e:
+                print("RF-Chain needs a reader ID to initialize the tag: %s" % (e))
+            RFChain.generate_tag_secret(reader, tag, data)
+        else:
+            raise(ValueError('Mode not supported!'))
+    except FileNotFoundError as e:
+        print("File not found! Make sure that the parent directory exists: %s" % (e))
+    except json.JSONDecodeError as e:
+        print("File is not in JSON format! Error: %s" % e)
+    except Exception as e:
+        print("Unknown exception: %s" % (e))
+        traceback.print_exc()
@@ -0,0 +1,80 @@
+'''
+python migrate_tagdb.py [-h] [-f KEYFILE] [-n BATCH] [--drop]
+Migrates the RF-Chain online storage (RFChain.TagDB) from schema version 1 to version 2:
+ version 1: tagID and b as hex VARCHARs, UNIQUE (id, tagID) (useless for lookups by tagID)
+ version 2: tagID BINARY(16), b VARBINARY(64), UNIQUE (tagID)
+
+The rows are copied in batches into a new table, which then atomically replaces the old one.
+The old table is kept as TagDB_hex unless --drop is given.
+If an ID occurs more than once, the first row (lowest id) is kept, like the LIMIT 1 lookup did.
+'''
+
+import argparse
+import json
+import traceback
+import mysql.connector
+
+from protocols.StorageBackend import MySQLBackend
+
+parser = argparse.ArgumentParser(description='Migrates RFChain.TagDB to binary columns with an index on tagID')
+parser.add_argument('-f', dest='keyfile', type=str, nargs=1,
+                    help='Keyfile with the mysql settings (default: settings of the testbed)', required=False)
+parser.add_argument('-n', dest='batch', type=int, nargs=1, default=[10000],
+                    help='Number of rows copied per batch', required=False)
+parser.add_argument('--drop', dest='drop', action='store_true',
+                    help='Drop the old table after the migration', required=False)
+
+args = parser.parse_args()
+batch = args.batch[0]
+
+'''
+converts a hex encoded b value (leading zeros were stripped) to bytes
+the first hop stores a 32 byte value, the others 64 bytes
+'''
+def b_to_bytes(b: str) -> bytes:
+    return int(b, 16).to_bytes(32 if len(b) <= 64 else 64, "big")
+
+try:
+    config = {}
+    if args.keyfile:
+        config = json.load(open(args.keyfile[0])).get("storage", {})
+        if config.get("engine", "mysql") != "mysql":
+            raise ValueError("The keyfile does not use the mysql storage")
+    mydb = MySQLBackend(config).connect()
+    cursor = mydb.cursor()
+    cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = 'RFChain' AND TABLE_NAME = 'TagDB' AND COLUMN_NAME = 'tagID'")
+    row = cursor.fetchone()
+    if row is None:
+        print("RFChain.TagDB does not exist, nothing to migrate.")
+    elif row[0].lower() == "binary":
+        print("RFChain.TagDB already uses schema version 2.")
+    else:
+        cursor.execute("DROP TABLE IF EXISTS RFChain.TagDB_v2")
+        cursor.execute(MySQLBackend._create_table.replace("RFChain.TagDB", "RFChain.TagDB_v2", 1))
+        insert = ("INSERT IGNORE INTO RFChain.TagDB_v2 (id, tagID, b, reader, timestamp) "
+                  "VALUES (%s, %s, %s, %s, %s)")
+        last = -1
+        copied = 0
+        while True:
+            cursor.execute("SELECT id, tagID, b, reader, timestamp FROM RFChain.TagDB WHERE id > %s ORDER BY id LIMIT %s", (last, batch))
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            cursor.executemany(insert, [(id, bytes.fromhex(tagID), b_to_bytes(b), reader, timestamp) for (id, tagID, b, reader, timestamp) in rows])
+            mydb.commit()
+            last = rows[-1][0]
+            copied += len(rows)
+            print("Copied %d rows" % copied)
+        cursor.execute("RENAME TABLE RFChain.TagDB TO RFChain.TagDB_hex, RFChain.TagDB_v2 TO RFChain.TagDB")
+        if args.drop:
+            cursor.execute("DROP TABLE RFChain.TagDB_hex")
+        mydb.commit()
+        print("Migrated %d rows to schema version 2%s" % (copied, "" if args.drop else ", old table kept as RFChain.TagDB_hex"))
+    cursor.close()
+    mydb.close()
+except mysql.connector.Error as e:
+    print("Database error: %s" % (e))
+except Exception as e:
+    print("Unknown exception: %s" % (e))
+    traceback.print_exc()
@@ -1,13 +1,18 @@
 import secrets
 import random
 import json
+import logging
 import os
-import pickle
 import struct
 
 from Crypto.Random import get_random_bytes
 from Crypto.Cipher import AES
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
+
+log = logging.getLogger(__name__)
 
 '''
 The baseline uses a simple tag secret based on a shared key.
@@ -72,18 +77,24 @@ class Baseline:
     '''
     @staticmethod
     def generate_tag_secret(tag: int, data: dict):
+        tagObj = Baseline.create_tag_secret(tag, data)
+        TagStore.of(data).put(tagObj)
+
+    '''
+    same as generate_tag_secret, but returns the tag object instead of storing it (bulk issuance)
+    '''
+    @staticmethod
+    def create_tag_secret(tag: int, data: dict) -> Tag:
         message = tag.to_bytes(data["reader_id_size"], 'big')
-        print("Plaintext message: %s" % message.hex())
-        cipher = AES.new(bytes.fromhex(data["key"]), AES.MODE_GCM)
+        log.debug("Plaintext message: %s", Log.hex(message))
+        cipher = AES.new(KeyRegistry.of(data).shared_key("key"), AES.MODE_GCM)
         c, ctag = cipher.encrypt_and_digest(message)
         cryptogram = cipher.nonce + ctag + c
 
         # create tag object
         cryptogram = len(cryptogram).to_bytes(2, 'big') + cryptogram
-        print("ciphertext length: %d (nonce %d, tag %d)\nciphertext: %s" % (len(cryptogram), len(cipher.nonce), len(ctag), cryptogram.hex()))
-        tagObj = Tag(tag, cryptogram, "baseline")
-        with open("%s/%d.tag" % (data["dir"], tag), "wb") as f:
-            pickle.dump(tagObj, f)
+        log.debug("ciphertext length: %d (nonce %d, tag %d)\nciphertext: %s", len(cryptogram), len(cipher.nonce), len(ctag), Log.hex(cryptogram))
+        return Tag(tag, cryptogram, "baseline")
 
 
     '''
@@ -98,17 +109,16 @@ class Baseline:
         if success:
             reader_bytes = reader.to_bytes(data["reader_id_size"], "big")
             message = struct.pack(">%ds%ds" % (len(m), data["reader_id_size"]), m, reader_bytes)
-            print("New plaintext message: %s" % message.hex())
-            cipher = AES.new(bytes.fromhex(data["key"]), AES.MODE_GCM)
+            log.debug("New plaintext message: %s", Log.hex(message))
+            cipher = AES.new(KeyRegistry.of(data).shared_key("key"), AES.MODE_GCM)
             c, ctag = cipher.encrypt_and_digest(message)
             cryptogram = cipher.nonce + ctag + c
 
             # create tag object
             cryptogram = len(cryptogram).to_bytes(2, 'big') + cryptogram
-            print("ciphertext length: %d (nonce %d, tag %d)\nciphertext: %s" % (len(cryptogram), len(cipher.nonce), len(ctag), cryptogram.hex()))
+            log.debug("ciphertext length: %d (nonce %d, tag %d)\nciphertext: %s", len(cryptogram), len(cipher.nonce), len(ctag), Log.hex(cryptogram))
             tag.updateTagContent(reader, cryptogram)
-            with open("%s/%d.tag" % (data["dir"], tag.id), "wb") as f:
-                pickle.dump(tag, f)
+            TagStore.of(data).put(tag)
 
     '''
     Decrypts message and returns the path that has been followed
@@ -123,15 +133,16 @@ class Baseline:
         nonce = tag.content[2:18]
         ctag = tag.content[18:34]
         ciphertext = tag.content[34:]
-        cipher = AES.new(bytes.fromhex(data["key"]), AES.MODE_GCM, nonce=nonce)
+        cipher = AES.new(KeyRegistry.of(data).shared_key("key"), AES.MODE_GCM, nonce=nonce)
         plaintext = cipher.decrypt(ciphertext)
         try:
             cipher.verify(ctag)
-            print("nonce: %s\ntag: %s\nc: %s\nkey: %s" % (nonce.hex(), ctag.hex(), ciphertext.hex(), data["key"]))
-            print("The message (%s) is authentic: %s" % (tag.content.hex(), plaintext.hex()))
+            log.debug("nonce: %s\ntag: %s\nc: %s", Log.hex(nonce), Log.hex(ctag), Log.hex(ciphertext))
+            log.info("The message of tag %d is authentic", tag.id)
+            log.debug("plaintext: %s", Log.hex(plaintext))
             return (True, plaintext)
             # check if every 4 bytes is a valid reader
 
         except ValueError as e:
-            print("Key incorrect or message corrupted. Error message: %s" % (e))
+            log.warning("Key incorrect or message corrupted. Error message: %s", e)
             return (False, None)
\ No newline at end of file
@@ -0,0 +1,297 @@
+'''
+Elliptic curve arithmetic on plain integer tuples for short Weierstrass curves (y^2 = x^3 + ax + b mod p)
+A point is a tuple (x, y), the point at infinity is None
+The ecc package works on Point objects in affine coordinates, which is slow for repeated multiplications
+with the same base; these helpers are used for the hot paths of Tracker
+
+The j* functions work in Jacobian coordinates: (X, Y, Z) is the affine point (X / Z^2, Y / Z^3)
+They need no modular inversion, normalize_many converts a list of results back to affine with a single one
+Affine tuples can be used wherever a Jacobian point is expected (Z = 1)
+'''
+class ECMath:
+
+    def __init__(self, a: int, p: int, n: int, b: int = None):
+        self.a = a
+        self.b = b
+        self.p = p
+        self.n = n
+
+    def on_curve(self, P) -> bool:
+        (x, y) = P
+        return 0 <= x < self.p and 0 <= y < self.p and (y * y - x * x * x - self.a * x - self.b) % self.p == 0
+
+    '''
+    the point with x coordinate x whose y has the parity odd (point decompression)
+    the square root is a single exponentiation for p = 3 mod 4 (e.g. secp160r1): y = (y^2)^((p + 1) / 4)
+    '''
+    def decompress(self, x: int, odd: int):
+        p = self.p
+        if p % 4 != 3:
+            raise ValueError("point decompression needs a curve with p = 3 mod 4")
+        if x >= p:
+            raise ValueError("x is not a coordinate of the curve")
+        yy = (x * x * x + self.a * x + self.b) % p
+        y = pow(yy, (p + 1) // 4, p)
+        if y * y % p != yy:
+            raise ValueError("x is not the x coordinate of a point on the curve")
+        if y % 2 != odd:
+            y = -y % p
+        return (x, y)
+
+    def neg(self, P):
+        if P is None:
+            return None
+        return (P[0], -P[1] % self.p)
+
+    def double(self, P):
+        if P is None or P[1] == 0:
+            return None
+        (x, y) = P
+        p = self.p
+        l = (3 * x * x + self.a) * pow(2 * y, -1, p) % p
+        x3 = (l * l - 2 * x) % p
+        return (x3, (l * (x - x3) - y) % p)
+
+    def add(self, P, Q):
+        if P is None:
+            return Q
+        if Q is None:
+            return P
+        (x1, y1) = P
+        (x2, y2) = Q
+        p = self.p
+        if x1 == x2:
+            if (y1 + y2) % p == 0:
+                return None
+            return self.double(P)
+        l = (y2 - y1) * pow(x2 - x1, -1, p) % p
+        x3 = (l * l - x1 - x2) % p
+        return (x3, (l * (x1 - x3) - y1) % p)
+
+    '''
+    k * P for any point P (double and add)
+    '''
+    def multiply(self, k: int, P):
+        k %= self.n
+        R = None
+        for bit in bin(k)[2:]:
+            R = self.double(R)
+            if bit == "1":
+                R = self.add(R, P)
+        return R
+
+    def jneg(self, P):
+        if P is None:
+            return None
+        return (P[0], -P[1] % self.p) + tuple(P[2:])
+
+    def jdouble(self, P):
+        if P is None or P[1] == 0:
+            return None
+        (X, Y) = P[:2]
+        Z = P[2] if len(P) == 3 else 1
+        p = self.p
+        YY = Y * Y % p
+        S = 4 * X * YY % p
+        ZZ = Z * Z % p
+        M = (3 * X * X + self.a * ZZ * ZZ) % p
+        X3 = (M * M - 2 * S) % p
+        Y3 = (M * (S - X3) - 8 * YY * YY) % p
+        return (X3, Y3, 2 * Y * Z % p)
+
+    def jadd(self, P, Q):
+        if P is None:
+            return Q
+        if Q is None:
+            return P
+        p = self.p
+        (X1, Y1) = P[:2]
+        (X2, Y2) = Q[:2]
+        Z1 = P[2] if len(P) == 3 else 1
+        Z2 = Q[2] if len(Q) == 3 else 1
+        # U = X * Z'^2, S = Y * Z'^3 bring both points to the same denominator
+        if Z2 == 1:
+            U1 = X1
+            S1 = Y1
+        else:
+            Z2Z2 = Z2 * Z2 % p
+            U1 = X1 * Z2Z2 % p
+            S1 = Y1 * Z2Z2 * Z2 % p
+        if Z1 == 1:
+            U2 = X2
+            S2 = Y2
+        else:
+            Z1Z1 = Z1 * Z1 % p
+            U2 = X2 * Z1Z1 % p
+            S2 = Y2 * Z1Z1 * Z1 % p
+        H = (U2 - U1) % p
+        R = (S2 - S1) % p
+        if H == 0:
+            if R == 0:
+                return self.jdouble(P)
+            return None
+        HH = H * H % p
+        HHH = H * HH % p
+        V = U1 * HH % p
+        X3 = (R * R - HHH - 2 * V) % p
+        Y3 = (R * (V - X3) - S1 * HHH) % p
+        return (X3, Y3, H * Z1 * Z2 % p)
+
+    '''
+    k * P in Jacobian coordinates (double and add), P should be affine so every addition is a mixed addition
+    '''
+    def jmultiply(self, k: int, P):
+        k %= self.n
+        R = None
+        for bit in bin(k)[2:]:
+            R = self.jdouble(R)
+            if bit == "1":
+                R = self.jadd(R, P)
+        return R
+
+    '''
+    converts Jacobian points to affine tuples with one inversion for all of them (Montgomery's trick)
+    '''
+    def normalize_many(self, points: list) -> list:
+        p = self.p
+        todo = [i for (i, P) in enumerate(points) if P is not None and len(P) == 3]
+        result = list(points)
+        for (i, Zinv) in zip(todo, self.batch_inverse([points[i][2] for i in todo])):
+            P = points[i]
+            ZZinv = Zinv * Zinv % p
+            result[i] = (P[0] * ZZinv % p, P[1] * ZZinv * Zinv % p)
+        return result
+
+    '''
+    inverses of all values mod p with a single inversion (Montgomery's trick), the values must not be 0
+    '''
+    def batch_inverse(self, values: list) -> list:
+        if len(values) == 0:
+            return []
+        p = self.p
+        # prefix products of the values
+        prefix = []
+        acc = 1
+        for v in values:
+            prefix.append(acc)
+            acc = acc * v % p
+        inv = pow(acc, -1, p)
+        result = [0] * len(values)
+        for i in range(len(values) - 1, -1, -1):
+            # inv is the inverse of values[0] * ... * values[i]
+            result[i] = inv * prefix[i] % p
+            inv = inv * values[i] % p
+        return result
+
+    '''
+    affine doubling of many points, the inversions are shared
+    '''
+    def batch_double(self, points: list) -> list:
+        p = self.p
+        todo = [i for (i, P) in enumerate(points) if P is not None and P[1] != 0]
+        result = [None] * len(points)
+        for (i, inv) in zip(todo, self.batch_inverse([2 * points[i][1] for i in todo])):
+            (x, y) = points[i]
+            l = (3 * x * x + self.a) * inv % p
+            x3 = (l * l - 2 * x) % p
+            result[i] = (x3, (l * (x - x3) - y) % p)
+        return result
+
+    '''
+    affine addition P[i] + Q[i] of many pairs, the inversions are shared
+    '''
+    def batch_add(self, Ps: list, Qs: list) -> list:
+        p = self.p
+        result = [None] * len(Ps)
+        todo = []
+        for (i, (P, Q)) in enumerate(zip(Ps, Qs)):
+            if P is None or Q is None or P[0] == Q[0]:
+                # infinity, doubling or P = -Q are rare, they are handled one by one
+                result[i] = self.add(P, Q)
+            else:
+                todo.append(i)
+        for (i, inv) in zip(todo, self.batch_inverse([Qs[i][0] - Ps[i][0] for i in todo])):
+            (x1, y1) = Ps[i]
+            (x2, y2) = Qs[i]
+            l = (y2 - y1) * inv % p
+            x3 = (l * l - x1 - x2) % p
+            result[i] = (x3, (l * (x1 - x3) - y1) % p)
+        return result
+
+    '''
+    scalars[i] * points[i] for many affine points at once (double and add in lockstep)
+    every step needs one inversion for all points, so with many points the cost per point is a few multiplications
+    '''
+    def batch_multiply(self, scalars: list, points: list) -> list:
+        scalars = [k % self.n for k in scalars]
+        R = [None] * len(points)
+        for b in range(max([k.bit_length() for k in scalars], default=0) - 1, -1, -1):
+            R = self.batch_double(R)
+            adding = [i for (i, k) in enumerate(scalars) if (k >> b) & 1]
+            for (i, S) in zip(adding, self.batch_add([R[i] for i in adding], [points[i] for i in adding])):
+                R[i] = S
+        return R
+
+
+'''
+Precomputed multiples of a fixed base point: table[j][d - 1] = d * 2^(window * j) * base
+k * base is then the sum of one table entry per window of k, no doublings are needed
+With window 8, a 161 bit scalar takes 21 additions instead of ~160 doublings and ~80 additions
+'''
+class FixedBaseTable:
+
+    def __init__(self, math: ECMath, base: tuple, window: int = 8, table: list = None):
+        self.math = math
+        self.base = tuple(base)
+        self.window = window
+        self.table = table if table is not None else self.build()
+
+    def build(self) -> list:
+        math = self.math
+        table = []
+        B = self.base
+        for j in range(-(-math.n.bit_length() // self.window)):
+            row = [B]
+            for d in range(2, 1 << self.window):
+                row.append(math.add(row[-1], B))
+            table.append(row)
+            # base of the next window: 2^window * B
+            B = math.add(row[-1], B)
+        return table
+
+    def multiply(self, k: int):
+        k %= self.math.n
+        mask = (1 << self.window) - 1
+        R = None
+        j = 0
+        while k:
+            d = k & mask
+            if d:
+                R = self.math.add(R, self.table[j][d - 1])
+            k >>= self.window
+            j += 1
+        return R
+
+    '''
+    same as multiply, but the result stays in Jacobian coordinates (mixed additions, no inversion)
+    '''
+    def multiply_jacobian(self, k: int):
+        k %= self.math.n
+        mask = (1 << self.window) - 1
+        R = None
+        j = 0
+        while k:
+            d = k & mask
+            if d:
+                R = self.math.jadd(R, self.table[j][d - 1])
+            k >>= self.window
+            j += 1
+        return R
+
+    def to_json(self) -> dict:
+        return {"x": self.base[0], "y": self.base[1], "window": self.window, "table": self.table}
+
+    @staticmethod
+    def from_json(math: ECMath, data: dict) -> "FixedBaseTable":
+        table = [[tuple(point) for point in row] for row in data["table"]]
+        return FixedBaseTable(math, (data["x"], data["y"]), data["window"], table)
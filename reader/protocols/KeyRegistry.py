@@ -0,0 +1,128 @@
+import json
+
+from concurrent.futures import Executor
+from Crypto.PublicKey import ECC
+from Crypto.Signature import DSS
+
+'''
+Parses the key material of a keyfile once and keeps the parsed keys for later calls
+The protocols receive the keyfile as a dict, a keyfile loaded with KeyRegistry.load carries its registry
+This way every call with the same keyfile shares the parsed keys, signers and verifiers, and the registry
+(with its worker pools) is freed together with the keyfile
+'''
+class KeyRegistry:
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.cache = {}
+
+    '''
+    reads a keyfile, the returned dict keeps its registry
+    '''
+    @staticmethod
+    def load(path: str) -> "Keyfile":
+        with open(path) as f:
+            return Keyfile(json.load(f))
+
+    '''
+    returns the registry of a keyfile, creates it on first use
+    a plain dict (not a Keyfile) has nowhere to keep it, it gets a new registry on every call
+    '''
+    @staticmethod
+    def of(data: dict) -> "KeyRegistry":
+        registry = getattr(data, "registry", None)
+        if registry is None:
+            registry = KeyRegistry(data)
+            if isinstance(data, Keyfile):
+                data.registry = registry
+        return registry
+
+    '''
+    forgets the registry of a keyfile (e.g. a long-running process that is done with a keyfile)
+    the worker pools in its cache are shut down
+    '''
+    @staticmethod
+    def release(data: dict):
+        registry = getattr(data, "registry", None)
+        if registry is not None:
+            del data.registry
+            registry.close()
+
+    '''
+    shuts down the cached values that own worker processes (executors)
+    '''
+    def close(self):
+        for (name, value) in list(self.cache.items()):
+            if isinstance(value, Executor):
+                value.shutdown(wait=True, cancel_futures=True)
+                del self.cache[name]
+
+    '''
+    parsed keys are not sent to other processes, they are parsed again on first use
+    '''
+    def __getstate__(self):
+        return {"data": self.data, "cache": {}}
+
+    '''
+    returns the cached value for name, computes it with factory on first use
+    '''
+    def memo(self, name, factory):
+        if name not in self.cache:
+            self.cache[name] = factory()
+        return self.cache[name]
+
+    '''
+    raw bytes of a hex encoded shared (AES) key, e.g. "key" for Baseline and "k" for RF-Chain
+    '''
+    def shared_key(self, name: str = "key") -> bytes:
+        return self.memo(("shared", name), lambda: bytes.fromhex(self.data[name]))
+
+    '''
+    ECC key pair of a reader (RF-Chain), imported from its DER encoding
+    '''
+    def reader_key(self, reader: int):
+        return self.memo(("reader", reader), lambda: ECC.import_key(bytes.fromhex(self.data["readers"][reader]["private-DER"])))
+
+    '''
+    reusable ECDSA signer of a reader
+    '''
+    def signer(self, reader: int):
+        return self.memo(("signer", reader), lambda: DSS.new(self.reader_key(reader), 'fips-186-3'))
+
+    '''
+    reusable ECDSA verifier of a reader, only uses the public key
+    '''
+    def verifier(self, reader: int):
+        return self.memo(("verifier", reader), lambda: DSS.new(self.reader_key(reader).public_key(), 'fips-186-3'))
+
+    '''
+    ECC key pair of the issuer (StepAuth)
+    '''
+    def issuer_key(self):
+        return self.memo("issuer", lambda: ECC.import_key(bytes.fromhex(self.data["master"]["private"])))
+
+    def issuer_signer(self):
+        return self.memo("issuer signer", lambda: DSS.new(self.issuer_key(), 'fips-186-3'))
+
+    def issuer_verifier(self):
+        return self.memo("issuer verifier", lambda: DSS.new(self.issuer_key().public_key(), 'fips-186-3'))
+
+    '''
+    raw ECIES keys of a reader (StepAuth)
+    '''
+    def ecies_private(self, reader: int) -> bytes:
+        return self.memo(("ecies private", reader), lambda: bytes.fromhex(self.data["readers"][reader]["private"]))
+
+    def ecies_public(self, reader: int) -> bytes:
+        return self.memo(("ecies public", reader), lambda: bytes.fromhex(self.data["readers"][reader]["public"]))
+
+
+'''
+a keyfile dict with its key registry, json.dump writes it like any other dict
+the registry is not pickled, a worker process that receives the keyfile builds its own
+'''
+class Keyfile(dict):
+    __slots__ = ("registry",)
+
+    def __reduce__(self):
+        return (Keyfile, (dict(self),))
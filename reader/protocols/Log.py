@@ -0,0 +1,51 @@
+import logging
+import sys
+
+'''
+Logging of the protocols, every protocol module logs to its own logger (log = logging.getLogger(__name__))
+ * debug  : tag contents and intermediate values, off unless a CLI is started with -v
+ * info   : the outcome of a step (tag verified, path found)
+ * warning: a tag could not be verified
+Keys and values they are derived from (shared keys, HMAC keys, h and k of RF-Chain) are never logged
+
+Arguments are only formatted when a message is emitted: pass Log.hex(value) instead of value.hex(),
+messages that need extra computation are guarded with log.isEnabledFor(logging.DEBUG)
+'''
+class Log:
+
+    '''
+    bytes, an integer or a point (x, y) as hex string, converted when the message is formatted
+    size is the number of bytes of an integer or coordinate
+    '''
+    class Hex:
+        __slots__ = ("value", "size")
+
+        def __init__(self, value, size: int = None):
+            self.value = value
+            self.size = size
+
+        def __str__(self) -> str:
+            if isinstance(self.value, (bytes, bytearray)):
+                return self.value.hex()
+            if isinstance(self.value, int):
+                return self.value.to_bytes(self.size, "big").hex() if self.size else "%x" % self.value
+            return "".join(str(Log.Hex(coordinate, self.size)) for coordinate in self.value)
+
+    @staticmethod
+    def hex(value, size: int = None) -> "Log.Hex":
+        return Log.Hex(value, size)
+
+    '''
+    sets the level of all protocol loggers for a CLI: verbosity 0 shows the outcomes, 1 (-v) also the debug output
+    a negative verbosity only shows errors (e.g. for services that report the results themselves)
+    '''
+    @staticmethod
+    def configure(verbosity: int = 0):
+        if verbosity < 0:
+            level = logging.ERROR
+        else:
+            level = logging.DEBUG if verbosity > 0 else logging.INFO
+        if len(logging.getLogger().handlers) == 0:
+            # the protocols used to print, keep the output on stdout and unchanged
+            logging.basicConfig(stream=sys.stdout, format="%(message)s")
+        logging.getLogger("protocols").setLevel(level)
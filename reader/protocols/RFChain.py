@@ -1,10 +1,12 @@
 import secrets
+import contextlib
+import fcntl
 import json
+import logging
 import struct
-import pickle
 import os
-import mysql.connector
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from Crypto.PublicKey import ECC
 from Crypto.Signature import DSS
 from Crypto.Hash import SHA256
@@ -13,6 +15,12 @@ from Crypto.Hash import MD5
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.StorageBackend import StorageBackend
+from protocols.Log import Log
+
+log = logging.getLogger(__name__)
 
 '''
 Implements all the details for the RF-Chain protocol
@@ -20,19 +28,28 @@ RF-Chain has an online and offline secret
 '''
 class RFChain:
 
-    # mysql settings
-    _host="192.168.0.100" #"10.229.105.235"
-    _user="user"
-    _pass="password"  #"pass"
+    # chains with fewer hops are checked in the calling process, starting the pool costs more
+    _parallel_hops=16
+    # keyfile of a worker process, see init_worker
+    _worker_data=None
+
+    '''
+    returns the online storage backend of the keyfile, it is created once per keyfile dict
+    '''
+    @staticmethod
+    def storage(data: dict) -> StorageBackend:
+        return KeyRegistry.of(data).memo("storage", lambda: StorageBackend.from_config(data))
 
     '''
     All the readers have a shared key k and a key pair 
     We use the ECDSA signature algorithm with the p256 curve
     k is a 32 byte random key
     Currently, we use SHA1 as a hashing algorithm (considered insecure) because the authors of RF-Chain use this as well
+    storage selects the online storage backend (see StorageBackend), the mysql server is used if None
+    online secrets that are already stored are only removed if clear is set, otherwise no keys are generated
     '''
     @staticmethod
-    def generate_reader_configs(nr_readers: int, valid_paths: list, dir: str):
+    def generate_reader_configs(nr_readers: int, valid_paths: list, dir: str, storage: dict = None, clear: bool = False):
         # generate keys
         key = ECC.generate(curve="p256")
         sk_bytes = key.export_key(format="DER")
@@ -50,6 +67,10 @@ class RFChain:
                 "hashBytes": hashBytes,
                 "readers": []
             }
+        if storage is not None:
+            data["storage"] = storage
+        # create the (empty) online storage first, new keys would make the stored secrets useless
+        RFChain.storage(data).reset(clear)
 
         # generate keys for the readers, make sure to use the same curve
         for i in range(nr_readers):
@@ -110,28 +131,6 @@ class RFChain:
             with open("%s/reader_%d/scheme_settings.h" % (dir, i), "w") as f:
                 f.write(c_string_data)
 
-            # create new database
-            mydb = mysql.connector.connect(
-                host=RFChain._host,
-                user=RFChain._user,
-                password=RFChain._pass,
-            )
-            cursor = mydb.cursor()
-            create_table = ("CREATE TABLE IF NOT EXISTS RFChain.TagDB ("
-                            "`id` int(10) NOT NULL AUTO_INCREMENT,"
-                            "`tagID` VARCHAR(64) NOT NULL,"  
-                            "`b` VARCHAR(256) NOT NULL,"
-                            "`reader` int(10) NOT NULL,"
-                            "`timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,"
-                            "CONSTRAINT UC_TagDB UNIQUE (id, tagID)"
-                            ")")
-            cursor.execute(create_table)
-            query = "DELETE FROM RFChain.TagDB"
-            cursor.execute(query)
-            mydb.commit()
-            cursor.close()
-            mydb.close()
-
     '''
     Generates a tag secret
     Format: ID || Enc_k(h_1, m, S) || a_1
@@ -139,11 +138,24 @@ class RFChain:
     '''
     @staticmethod
     def generate_tag_secret(reader: int, tag: int, data: dict):
+        (tagObj, online, verified) = RFChain.create_tag_secret(reader, tag, data)
+        TagStore.of(data).put(tagObj)
+
+        # write to the online storage
+        RFChain.storage(data).insert(*online)
+        RFChain.checkpoint(data, *verified)
+
+    '''
+    same as generate_tag_secret, but nothing is stored (bulk issuance)
+    returns the tag object, the online secret (ID1, b1, reader) and the verified state (h1, index, a1) of the chain
+    '''
+    @staticmethod
+    def create_tag_secret(reader: int, tag: int, data: dict) -> (Tag, tuple, tuple):
 
         # load data
-        key = bytes.fromhex(data["k"])
-        privkey = ECC.import_key(bytes.fromhex(data["readers"][reader]["private-DER"]))
-        signer = DSS.new(privkey, 'fips-186-3')
+        registry = KeyRegistry.of(data)
+        key = registry.shared_key("k")
+        signer = registry.signer(reader)
 
         # generate random values
         pwd = secrets.token_bytes(8)
@@ -163,48 +175,30 @@ class RFChain:
         reader_msg = struct.pack(">%ds%ds%ds" % (len(h1), len(m), len(S)), h1, m, S)
         cipher = AES.new(key, AES.MODE_GCM)
         c, ctag = cipher.encrypt_and_digest(reader_msg)
-        print("Generating a message for:\nh: %s\nm: %s\n" % (h1.hex(), m.hex()))
+        log.debug("Generating a message for:\nm: %s\n", Log.hex(m))
 
         # create offline secret
         # double hash is needed later on
-        signer = DSS.new(privkey, 'fips-186-3')
         a0 = SHA256.new(ID + f + pwd + r).digest()
         a1 = signer.sign(SHA256.new(a0))
         k1 = SHA256.new(h1).digest()
 
         # pack into tag secret
-        print("Offline secret:\nID: %s\nNonce:%s\nTag: %s\nShared msg: %s(%d)\na value: %s" % (ID.hex(), cipher.nonce.hex(), ctag.hex(), c.hex(), len(c), a1.hex()))
+        log.debug("Offline secret:\nID: %s\nNonce:%s\nTag: %s\nShared msg: %s(%d)\na value: %s", Log.hex(ID), Log.hex(cipher.nonce), Log.hex(ctag), Log.hex(c), len(c), Log.hex(a1))
         offline_tag_secret = struct.pack(">4s%ds%ds%ds%ds" % (len(cipher.nonce), len(ctag), len(c), len(a1)), ID, cipher.nonce, ctag, c, a1)
-        print("Complete message(%d): %s\n" % (len(offline_tag_secret), offline_tag_secret.hex()))
+        log.debug("Complete message(%d): %s\n", len(offline_tag_secret), Log.hex(offline_tag_secret))
 
         # create online secret
-        b1 = hex(int.from_bytes(a0, "big") ^ int.from_bytes(k1, "big"))[2:]
-        print("Online secret:\nk: %s\na0: %s" % (hex(int.from_bytes(k1, "big")), int.from_bytes(a0, "big")))
+        b1 = (int.from_bytes(a0, "big") ^ int.from_bytes(k1, "big")).to_bytes(len(a0), "big")
+        log.debug("Online secret:\nb: %s", Log.hex(b1))
         cipher = AES.new(k1, AES.MODE_ECB)
         ID1 = cipher.encrypt(pad(ID, 16))
-        online_tag_secret = {"b": b1}
+        online_tag_secret = {"b": b1.hex()}
 
         # write to the tag
         tagObj = Tag(tag, offline_tag_secret, "rfchain")
         tagObj.updateOnlineStorage(reader, ID1.hex(), online_tag_secret)
-        with open("%s/%d.tag" % (data["dir"], tag), "wb") as f:
-            pickle.dump(tagObj, f)
-
-        # write to mysql
-        mydb = mysql.connector.connect(
-            host=RFChain._host,
-            user=RFChain._user,
-            password=RFChain._pass,
-        )
-        cursor = mydb.cursor()
-        add_online_secret = ("INSERT INTO RFChain.TagDB "
-                            "(tagID, b, reader) "
-                            "VALUES (%s, %s, %s)")
-        data_online_secret = (ID1.hex(), b1, reader)
-        cursor.execute(add_online_secret, data_online_secret)
-        mydb.commit()
-        cursor.close()
-        mydb.close()
+        return (tagObj, (ID1, b1, reader), (h1, index, a1))
                
 
 
@@ -222,57 +216,256 @@ class RFChain:
         (success, x) = RFChain.verify_tag(tag, data)
         if success:        
             (ID, hi, m, S, ai) = x
-            # load private key and sign new  ai+1
-            privkey = ECC.import_key(bytes.fromhex(data["readers"][reader]["private-DER"]))
-            signer = DSS.new(privkey, 'fips-186-3')
-            ai_1 = signer.sign(SHA256.new(ai))
-            print("new ai_1: %s" % (ai_1.hex()))
+            # sign new  ai+1
+            registry = KeyRegistry.of(data)
+            ai_1 = registry.signer(reader).sign(SHA256.new(ai))
+            log.debug("new ai_1: %s", Log.hex(ai_1))
 
             # create a new hi with index increased by 1
             index = int.from_bytes(hi[-2:], "big")
             index += 1
             hi_1 = struct.pack(">%ds2s" % (len(hi[:-2])), hi[:-2], index.to_bytes(2, "big"))
-            print("hi: %s" % (hi_1.hex()))
+            log.debug("index: %d", index)
             # create a new k and b
             ki_1 = SHA256.new(hi_1).digest() 
-            print("new key: %s" % (ki_1.hex()))
-            bi_1 = hex(int.from_bytes(ai, "big") ^ int.from_bytes(ki_1, "big"))[2:]
-            print("new bi_1: %s" % (bi_1))
+            bi_1 = (int.from_bytes(ai, "big") ^ int.from_bytes(ki_1, "big")).to_bytes(len(ai), "big")
+            log.debug("new bi_1: %s", Log.hex(bi_1))
             cipher = AES.new(ki_1, AES.MODE_ECB)
             IDi_1 = cipher.encrypt(pad(ID, 16))
 
             # prepare new secrets
             reader_msg = struct.pack(">%ds%ds%ds" % (len(hi_1), len(m), len(S)), hi_1, m, S)
-            key = bytes.fromhex(data["k"])
+            key = registry.shared_key("k")
             cipher = AES.new(key, AES.MODE_GCM)
             c, ctag = cipher.encrypt_and_digest(reader_msg)          
             offline_tag_secret = struct.pack(">4s%ds%ds%ds%ds" % (len(cipher.nonce), len(ctag), len(c), len(ai_1)), ID, cipher.nonce, ctag, c, ai_1)
-            online_tag_secret = {"b": bi_1}  
+            online_tag_secret = {"b": bi_1.hex()}
 
             # write secrets
             tag.updateOnlineStorage(reader, IDi_1.hex(), online_tag_secret)
             tag.updateTagContent(reader, offline_tag_secret)
-            with open("%s/%d.tag" % (data["dir"], tag.id), "wb") as f:
-                pickle.dump(tag, f)
-
-            # write to mysql
-            mydb = mysql.connector.connect(
-                host=RFChain._host,
-                user=RFChain._user,
-                password=RFChain._pass,
-            )
-            cursor = mydb.cursor()
-            add_online_secret = ("INSERT INTO RFChain.TagDB "
-                                "(tagID, b, reader) "
-                                "VALUES (%s, %s, %s)")
-            data_online_secret = (IDi_1.hex(), bi_1, reader)
-            cursor.execute(add_online_secret, data_online_secret)
-            mydb.commit()
-            cursor.close()
-            mydb.close()
+            TagStore.of(data).put(tag)
+
+            # write to the online storage
+            RFChain.storage(data).insert(IDi_1, bi_1, reader)
+            # the new state extends a verified chain, the next verification only checks the new hop
+            RFChain.checkpoint(data, hi_1, index, ai_1)
         else:
-            print("Could not verify tag!")
+            log.warning("Could not verify tag %d!", tag.id)
+
+
+    '''
+    derives hi, ki and IDi of the hops with the given indices, they only depend on h
+    '''
+    @staticmethod
+    def derive_hops(ID: bytes, h: bytes, indices) -> list:
+        hops = []
+        for i in indices:
+            # set hi
+            hi = struct.pack(">%ds2s" % (len(h[:-2])), h[:-2], i.to_bytes(2, "big"))
+
+            # calculate new ki and IDi
+            ki = SHA256.new(hi).digest()
+            cipher = AES.new(ki, AES.MODE_ECB)
+            IDi = cipher.encrypt(pad(ID, 16))
+            hops.append((i, hi, ki, IDi))
+        return hops
+
+    '''
+    verifies the hops (highest index first) starting from ai
+    every online secret b links ai to the value it signs, for the first hop that is the hash a0
+    the links only need the online secrets, so they are resolved first and the signatures are checked afterwards
+    with workers > 1, long chains are checked by a pool of worker processes
+    returns the a value before the last hop or None if a hop could not be verified
+    raises ValueError if a signature is invalid
+    '''
+    @staticmethod
+    def verify_hops(hops: list, ai: bytes, a0: bytes, data: dict, workers: int = 1) -> bytes:
+        # read the online secrets of all hops in one round trip
+        online_secrets = RFChain.storage(data).lookup_many([IDi for (_, _, _, IDi) in hops])
+
+        # signature checks (index, reader, a-1, a)
+        checks = []
+        for (i, hi, ki, IDi) in hops:
+            if IDi not in online_secrets:
+                log.warning("Could not find online secret!")
+                return None
+            bi_entry = online_secrets[IDi]
+            reader = bi_entry[0]
+            bi = int.from_bytes(bi_entry[1], "big")
+
+            ai_1 = bi ^ int.from_bytes(ki, "big")
+            log.debug("Verifying:\nindex: %d\na: %s\na-1: %s\nb: %s\n", i, Log.hex(ai), Log.hex(ai_1, 64), Log.hex(bi_entry[1]))
+            # if 1, the previous a was a hash (32 bytes)
+            if i == 1:
+                ai_1_bytes = ai_1.to_bytes(32, "big")
+                hash = SHA256.new(a0)
+                if ai_1_bytes.hex() != hash.hexdigest():
+                    log.warning("could not verify hash of a0!")
+                    return None
+            # else it was a signature (64 bytes)
+            else:
+                ai_1_bytes = ai_1.to_bytes(64, "big")
+            checks.append((i, reader, ai_1_bytes, ai))
+            # set ai to the next value
+            ai = ai_1_bytes
+
+        if workers > 1 and len(checks) >= RFChain._parallel_hops:
+            failed = RFChain.verify_signatures_parallel(checks, data, workers)
+        else:
+            failed = RFChain.verify_signatures(checks, data)
+        if failed is not None:
+            raise ValueError("a%d is not a valid signature of reader %d" % (failed[0], failed[1]))
+        return ai
+
+    '''
+    checks the signatures of the hops, stops at the first invalid one
+    returns (index, reader) of the invalid hop or None if all signatures are valid
+    in a worker process, data is the keyfile the pool was started with
+    '''
+    @staticmethod
+    def verify_signatures(checks: list, data: dict = None):
+        registry = KeyRegistry.of(data if data is not None else RFChain._worker_data)
+        for (i, reader, ai_1, ai) in checks:
+            try:
+                registry.verifier(reader).verify(SHA256.new(ai_1), ai)
+            except ValueError:
+                return (i, reader)
+        return None
+
+    @staticmethod
+    def init_worker(data: dict):
+        RFChain._worker_data = data
+
+    '''
+    returns the pool of worker processes that check signatures, started once per keyfile dict
+    a call with another number of workers shuts the old pool down and starts a new one
+    the key registry owns the pool: close_pool or KeyRegistry.release stop the workers
+    '''
+    @staticmethod
+    def signature_pool(data: dict, workers: int) -> ProcessPoolExecutor:
+        registry = KeyRegistry.of(data)
+        if registry.cache.get("pool workers") != workers:
+            RFChain.close_pool(data)
+            registry.cache["pool"] = ProcessPoolExecutor(max_workers=workers, initializer=RFChain.init_worker, initargs=(data,))
+            registry.cache["pool workers"] = workers
+        return registry.cache["pool"]
 
+    '''
+    stops the worker processes of the signature pool of a keyfile (long-running callers that are done verifying)
+    '''
+    @staticmethod
+    def close_pool(data: dict):
+        registry = KeyRegistry.of(data)
+        registry.cache.pop("pool workers", None)
+        pool = registry.cache.pop("pool", None)
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    '''
+    spreads the signature checks over a pool of worker processes (see signature_pool)
+    once a chunk contains an invalid signature, the chunks that did not start yet are cancelled
+    '''
+    @staticmethod
+    def verify_signatures_parallel(checks: list, data: dict, workers: int):
+        pool = RFChain.signature_pool(data, workers)
+        # a few chunks per worker, so the work is balanced and a failure stops the remaining chunks early
+        size = -(-len(checks) // (4 * workers))
+        futures = [pool.submit(RFChain.verify_signatures, checks[i:i + size]) for i in range(0, len(checks), size)]
+        for future in as_completed(futures):
+            failed = future.result()
+            if failed is not None:
+                for other in futures:
+                    other.cancel()
+                return failed
+        return None
+
+    '''
+    cache of verified chain states: SHA256(h without index) -> (index, a)
+    once a state is verified, the hops up to it do not have to be checked again
+    the cache is appended to <dir>/rfchain_verified.log so all scripts using the keyfile share it
+    '''
+    @staticmethod
+    def verified(data: dict) -> dict:
+        return KeyRegistry.of(data).memo("verified", lambda: RFChain.load_verified(data))
+
+    @staticmethod
+    def load_verified(data: dict) -> dict:
+        path = "%s/rfchain_verified.log" % data["dir"]
+        (verified, lines) = RFChain.read_verified(path)
+        # drop the superseded states once they make up most of the file
+        if lines > 2 * len(verified) + 1000:
+            with RFChain.verified_lock(data):
+                # other processes may have appended (or compacted) since the file was read
+                (verified, lines) = RFChain.read_verified(path)
+                if lines > 2 * len(verified) + 1000:
+                    tmp = "%s.%d.tmp" % (path, os.getpid())
+                    with open(tmp, "w") as f:
+                        for (chain, (index, a)) in verified.items():
+                            f.write("%s %d %s\n" % (chain, index, a.hex()))
+                    os.replace(tmp, path)
+        return verified
+
+    '''
+    reads the verified states of a log file, returns them and the number of lines
+    '''
+    @staticmethod
+    def read_verified(path: str) -> (dict, int):
+        verified = {}
+        lines = 0
+        try:
+            with open(path) as f:
+                for line in f:
+                    try:
+                        (chain, index, a) = line.split()
+                        if chain not in verified or int(index) >= verified[chain][0]:
+                            verified[chain] = (int(index), bytes.fromhex(a))
+                        lines += 1
+                    except ValueError:
+                        # incomplete line of an interrupted write
+                        None
+        except FileNotFoundError:
+            None
+        return (verified, lines)
+
+    '''
+    lock of <dir>/rfchain_verified.lock, every process holds it while it writes the log (append or compaction)
+    the log is only opened while the lock is held, so no append goes to a log file that was replaced
+    '''
+    @staticmethod
+    @contextlib.contextmanager
+    def verified_lock(data: dict):
+        with open("%s/rfchain_verified.lock" % data["dir"], "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    '''
+    remembers that the chain of h is valid up to (index, a)
+    '''
+    @staticmethod
+    def checkpoint(data: dict, h: bytes, index: int, a: bytes):
+        RFChain.checkpoint_many(data, [(h, index, a)])
+
+    '''
+    records the verified states (h, index, a) of many chains with a single write
+    '''
+    @staticmethod
+    def checkpoint_many(data: dict, states: list):
+        verified = RFChain.verified(data)
+        lines = []
+        for (h, index, a) in states:
+            chain = SHA256.new(h[:-2]).hexdigest()
+            if verified.get(chain) == (index, a):
+                continue
+            verified[chain] = (index, bytes(a))
+            lines.append("%s %d %s\n" % (chain, index, a.hex()))
+        if len(lines) > 0 and os.path.isdir(data["dir"]):
+            with RFChain.verified_lock(data):
+                with open("%s/rfchain_verified.log" % data["dir"], "a") as f:
+                    f.write("".join(lines))
 
     '''
     verifies the tag by checking the following:
@@ -281,11 +474,15 @@ class RFChain:
     3. ai+1 is a signature of ai
     4. optionally, check for all values of i
     5. optionally, check if a0 is equal to H(ID, f, pwd, r)
+    depth limits the check to the last depth hops (0: all hops)
+    hops up to a previously verified state of the chain are skipped, unless audit is set
+    workers > 1 checks the signatures of long chains in parallel (see verify_hops)
     '''
     @staticmethod
-    def verify_tag(tag: Tag, data: dict, depth=0) -> (bool, bytearray):
+    def verify_tag(tag: Tag, data: dict, depth=0, audit=False, workers=1) -> (bool, bytearray):
         # get info from data
-        key = bytes.fromhex(data["k"])
+        registry = KeyRegistry.of(data)
+        key = registry.shared_key("k")
         curvesize = data["curvebytes"]
 
         # load info from tag content
@@ -298,7 +495,7 @@ class RFChain:
 
         # verify if the share message (h, m, S) is authentic
         try:
-            print("Verifying ctag: %s" % ctag.hex())
+            log.debug("Verifying ctag: %s", Log.hex(ctag))
             cipher.verify(ctag)
             # get values from plaintext
             h = plaintext[:22]
@@ -308,83 +505,48 @@ class RFChain:
             m = plaintext[22:32]
             S = plaintext[32:96]
             index = int.from_bytes(h[-2:], "big")
+            a0 = struct.pack(">4s4s8s4s", ID, f, pwd, r)
 
             try:
                 # get offline and online secret
                 a = tag.content[132:196]
-                ai = a
-                print("Found tag with the following content:\nindex: %d\nh: %s\nm: %s\nS: %s\na: %s\n" % (index, h.hex(), m.hex(), S.hex(), a.hex()))
+                log.debug("Found tag with the following content:\nindex: %d\nm: %s\nS: %s\na: %s\n", index, Log.hex(m), Log.hex(S), Log.hex(a))
 
                 # check how many checks we need to do
-                for i in range(1, index + 1)[-depth:][::-1]:
-                    # set hi
-                    hi = struct.pack(">%ds2s" % (len(h[:-2])), h[:-2], i.to_bytes(2, "big"))
-
-                    # calculate new ki and IDi
-                    ki = SHA256.new(hi).digest()
-                    cipher = AES.new(ki, AES.MODE_ECB)
-                    IDi = cipher.encrypt(pad(ID, 16))
-                    IDi = IDi.hex()
-
-                    # get the online secret from tag or DB
-                    '''
-                    bi_entry = tag.getOnlineStorageMsg(IDi)
-                    if bi_entry == None:
-                        print("Could not find online secret!")
-                        return (False, None)
-                    reader = bi_entry["reader"]
-                    bi = int(bi_entry["b"], 16)
-                    '''
-                    # read from mysql
-                    mydb = mysql.connector.connect(
-                        host=RFChain._host,
-                        user=RFChain._user,
-                        password=RFChain._pass,
-                    )
-                    cursor = mydb.cursor(buffered=True)
-                    query = ("SELECT reader, b FROM RFChain.TagDB WHERE tagID = %s LIMIT 1")
-                    cursor.execute(query, (IDi, ))
-                    if cursor.rowcount != 1:
-                        print("Could not find online secret!")
-                        return (False, None)
-                    bi_entry = cursor.fetchone()
-                    reader = bi_entry[0]
-                    bi = int(bi_entry[1], 16)
-                    cursor.close()
-                    mydb.close()
-
-                    privkey = ECC.import_key(bytes.fromhex(data["readers"][reader]["private-DER"]))
-                    ai_1 = bi ^ int.from_bytes(ki, "big")
-                    print("Verifying:\nindex: %d\nh: %s\nk: %s\na: %s\na-1: %s\nb: %s\n" % (i, hi.hex(), ki.hex(), ai.hex(), ai_1.to_bytes(64, "big").hex(), bi_entry))
-                    verifier = DSS.new(privkey, "fips-186-3")
-                    # if 1, the previous a was a hash (32 bytes)
-                    if i == 1:
-                        ai_1_bytes = ai_1.to_bytes(32, "big")
-                        verifier.verify(SHA256.new(ai_1_bytes), ai)
-                        a0 = struct.pack(">4s4s8s4s", ID, f, pwd, r)
-                        hash = SHA256.new(a0)
-                        if ai_1_bytes.hex() != hash.hexdigest():
-                            print("could not verify hash of a0!")
-                            return (False, None)
-                    # else it was a signature (64 bytes)
+                lowest = max(index - depth, 0) if depth > 0 else 0
+                stop = lowest
+                checkpoint = None
+                if not audit:
+                    checkpoint = RFChain.verified(data).get(SHA256.new(h[:-2]).hexdigest())
+                    # a checkpoint after the current index means the tag holds an older state, check it completely
+                    if checkpoint is not None and lowest <= checkpoint[0] <= index:
+                        stop = checkpoint[0]
+                ai = RFChain.verify_hops(RFChain.derive_hops(ID, h, range(index, stop, -1)), a, a0, data, workers)
+                if ai is None:
+                    return (False, None)
+                complete = lowest == 0
+                if stop > lowest:
+                    if ai == checkpoint[1]:
+                        log.info("Hops up to index %d were verified before", stop)
+                        complete = True
                     else:
-                        ai_1_bytes = ai_1.to_bytes(64, "big")
-                        verifier.verify(SHA256.new(ai_1_bytes), ai)
-                        # set ai to the next value
-                        ai = ai_1_bytes
+                        log.info("Tag does not match the verified state at index %d, verifying the remaining hops", stop)
+                        ai = RFChain.verify_hops(RFChain.derive_hops(ID, h, range(stop, lowest, -1)), ai, a0, data, workers)
+                        if ai is None:
+                            return (False, None)
 
                 # verify the message
                 try:
                     producer = int.from_bytes(m[:2], "big")
-                    privkey = ECC.import_key(bytes.fromhex(data["readers"][producer]["private-DER"]))
-                    verifier = DSS.new(privkey, "fips-186-3")
-                    verifier.verify(SHA256.new(m), S)
-                    print("Successful verification!")
+                    registry.verifier(producer).verify(SHA256.new(m), S)
+                    log.info("Successful verification!")
+                    if complete:
+                        RFChain.checkpoint(data, h, index, a)
                     return (True, (ID, h, m, S, a))
                 except ValueError as e:
-                    print("S is an invalid signature: %s" % (e))
+                    log.warning("S is an invalid signature: %s", e)
             except ValueError as e:
-                print("Tag content contains invalid signature: %s" % (e))
+                log.warning("Tag content contains invalid signature: %s", e)
         except ValueError as e:
-            print("The shared message is not authentic! Error: %s" % (e))
+            log.warning("The shared message is not authentic! Error: %s", e)
         return (False, None)
\ No newline at end of file
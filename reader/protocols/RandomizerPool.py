@@ -0,0 +1,132 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+
+from collections import deque
+
+'''
+Pool of precomputed randomizers, e.g. the (r * P, r * public) pairs that Tracker uses to re-encrypt a tag
+A randomizer does not depend on the tag, so they can be computed before they are needed: long-running callers
+start a background thread that keeps the pool filled, one-shot callers compute the missing ones when they take them
+generate(count) returns a list of count new randomizers (lists and tuples, stored as JSON)
+
+With a directory the pool survives the process: unused randomizers are written to it on exit and the next
+process loads them. Every randomizer is used once:
+ * a batch file is claimed with an atomic rename before it is read, only one process can claim it
+ * the claimed file is removed right after loading, a randomizer that was handed out is never written again
+A crash loses the randomizers of the process, it never reuses them
+'''
+class RandomizerPool:
+
+    # randomizers that are computed at once (they share one inversion)
+    _batch=16
+
+    def __init__(self, generate, size: int = 64, dir: str = None, meta: dict = None):
+        self.generate = generate
+        self.size = size
+        self.dir = dir
+        # identifies the key material, stored batches of other keys are discarded
+        self.meta = meta if meta is not None else {}
+        self.queue = deque()
+        self.lock = threading.Condition()
+        self.stopped = False
+        if self.dir is not None:
+            os.makedirs(self.dir, exist_ok=True)
+            self.load()
+            atexit.register(self.close)
+        self.thread = None
+
+    '''
+    starts fill_loop in a background thread, for long-running callers
+    '''
+    def start(self):
+        with self.lock:
+            if self.thread is not None or self.size <= 0 or self.stopped:
+                return
+            self.thread = threading.Thread(target=self.fill_loop, daemon=True)
+            self.thread.start()
+
+    '''
+    background thread: keeps the pool at size randomizers
+    '''
+    def fill_loop(self):
+        while True:
+            with self.lock:
+                while not self.stopped and len(self.queue) >= self.size:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                count = min(RandomizerPool._batch, self.size - len(self.queue))
+            randomizers = self.generate(count)
+            with self.lock:
+                self.queue.extend(randomizers)
+
+    '''
+    returns count randomizers, the ones the pool does not have yet are computed right away
+    '''
+    def take(self, count: int) -> list:
+        with self.lock:
+            randomizers = [self.queue.popleft() for _ in range(min(count, len(self.queue)))]
+            self.lock.notify()
+        if len(randomizers) < count:
+            randomizers += self.generate(count - len(randomizers))
+        return randomizers
+
+    '''
+    computes randomizers in the calling thread until the pool has count of them (e.g. before the pool is saved)
+    '''
+    def fill(self, count: int):
+        while True:
+            with self.lock:
+                missing = count - len(self.queue)
+            if missing <= 0:
+                return
+            randomizers = self.generate(min(RandomizerPool._batch, missing))
+            with self.lock:
+                self.queue.extend(randomizers)
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    '''
+    claims and loads the stored batches, until the pool has size randomizers
+    '''
+    def load(self):
+        for path in sorted(glob.glob("%s/*.json" % self.dir)):
+            if len(self.queue) >= self.size:
+                return
+            claimed = "%s.claimed%d" % (path, os.getpid())
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                # claimed by another process
+                continue
+            try:
+                with open(claimed) as f:
+                    batch = json.load(f)
+            except ValueError:
+                batch = None
+            os.remove(claimed)
+            if batch is not None and batch["meta"] == self.meta:
+                self.queue.extend([[tuple(part) for part in randomizer] for randomizer in batch["randomizers"]])
+
+    '''
+    stops the background thread and stores the unused randomizers as a new batch file
+    '''
+    def close(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify_all()
+            randomizers = list(self.queue)
+            self.queue.clear()
+        if self.dir is None or len(randomizers) == 0:
+            return
+        # names sort by age, the oldest batches are loaded first
+        path = "%s/%d-%d.json" % (self.dir, time.time_ns(), os.getpid())
+        with open(path + ".tmp", "w") as f:
+            json.dump({"meta": self.meta, "randomizers": randomizers}, f)
+        # only complete batches get the .json extension
+        os.replace(path + ".tmp", path)
@@ -1,8 +1,7 @@
 import json
+import logging
 import os
 import struct
-import pickle
-import traceback
 
 from Crypto.Util.Padding import pad, unpad
 from Crypto.Hash import SHA256, HMAC
@@ -13,6 +12,11 @@ from ecies import ECIES_CONFIG
 from ecies import encrypt, decrypt
 from ecies import hex2sk, hex2pk
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
+
+log = logging.getLogger(__name__)
 
 '''
 Implements all logic for the StepAuth protocol.
@@ -109,9 +113,17 @@ class StepAuth:
     '''
     @staticmethod
     def generate_tag_secret(tag: int, path: list, data: dict):
-        # import key and sizes from settings
-        issuer_sk = ECC.import_key(bytes.fromhex(data["master"]["private"]))
-        issuer_pk = issuer_sk.public_key()
+        tagObj = StepAuth.create_tag_secret(tag, path, data)
+        TagStore.of(data).put(tagObj)
+
+    '''
+    same as generate_tag_secret, but returns the tag object instead of storing it (bulk issuance)
+    '''
+    @staticmethod
+    def create_tag_secret(tag: int, path: list, data: dict) -> Tag:
+        # get the parsed keys and sizes from settings
+        registry = KeyRegistry.of(data)
+        signer = registry.issuer_signer()
         reader_ID_size = data["reader_id_size"]
         tag_ID_size = data["tag_id_size"]
 
@@ -129,30 +141,26 @@ class StepAuth:
                             reader.to_bytes(reader_ID_size, 'big'), path[i + 1].to_bytes(reader_ID_size, 'big'), cryptogram), 16)
             
             # obtain keys
-            privKey = data["readers"][reader]["private"];
-            pubKey = data["readers"][reader]["public"];
+            pubKey = registry.ecies_public(reader)
 
             # encrypt, sign, and combine the message (remove trailing 0x4)
             c = encrypt(pubKey, message)[1:]
             h = SHA256.new(c)
-            signer = DSS.new(issuer_sk, 'fips-186-3')
             signature = signer.sign(h)
             #print("hash length: %d\nhash: %s" % (len(h.digest()), h.hexdigest()))
             #print("signature length: %d\nsignature: %s" % (len(signature), signature.hex()))
             cryptogram = b"".join([c, signature])
         cryptogram = len(cryptogram).to_bytes(2, 'big') + cryptogram
-        print("tag content length: %d\ntag content: %s" % (len(cryptogram), cryptogram.hex()))
-        tagObj = Tag(tag, cryptogram, "stepauth")
-        with open("%s/%d.tag" % (data["dir"], tag), "wb") as f:
-            pickle.dump(tagObj, f)
+        log.debug("tag content length: %d\ntag content: %s", len(cryptogram), Log.hex(cryptogram))
+        return Tag(tag, cryptogram, "stepauth")
 
     '''
 
     '''
     @staticmethod
     def decrypt_tag(tag: Tag, path: list):
-        print("Size of tag secret for path length %d: %d" % (len(path), len(cryptogram)))
-        print("DECRYPTING")
+        log.debug("Size of tag secret for path length %d: %d", len(path), len(cryptogram))
+        log.debug("DECRYPTING")
         for i in range(len(path)):
             reader = path[i]
             privKey = data["readers"][reader]["private"];
@@ -161,12 +169,12 @@ class StepAuth:
             verifier = DSS.new(issuer_pk, "fips-186-3")
             try:
                 verifier.verify(h, cryptogram[-64:])
-                print("The message is authentic.")
+                log.debug("The message is authentic.")
             except ValueError:
-                print("The message is not authentic.")
+                log.warning("The message is not authentic.")
             m = unpad(decrypt(privKey, cryptogram[64:]), 16)
             cryptogram = m[2:]
-            print(m)
+            log.debug("%s", Log.hex(m))
 
     '''
     reader only updates if it is the step in the path
@@ -185,15 +193,14 @@ class StepAuth:
             nextReaderID = m[reader_ID_size:2*reader_ID_size]
             # check if it is the last message
             if readerID == nextReaderID:
-                print("Tag has finished!")
+                log.info("Tag has finished!")
             cryptogram = m[2*reader_ID_size:]
             cryptogram = len(cryptogram).to_bytes(2, 'big') + cryptogram
-            print("tag content length: %d\ntag content: %s" % (len(cryptogram), cryptogram.hex()))
+            log.debug("tag content length: %d\ntag content: %s", len(cryptogram), Log.hex(cryptogram))
             tag.updateTagContent(reader, cryptogram)
-            with open("%s/%d.tag" % (data["dir"], tag.id), "wb") as f:
-                pickle.dump(tag, f)
+            TagStore.of(data).put(tag)
         else:
-            print("Verification was not successful!")
+            log.warning("Verification was not successful!")
 
     '''
     verifies if reader is the next step in the path by:
@@ -204,10 +211,8 @@ class StepAuth:
     @staticmethod
     def verify_tag(reader: int, tag: Tag, data: dict) -> (bool, bytearray):
         # load keys and other data
-        issuer_sk = ECC.import_key(bytes.fromhex(data["master"]["private"]))
-        issuer_pk = issuer_sk.public_key()
-        privKey =  data["readers"][reader]["private"]
-        pubKey = data["readers"][reader]["public"];
+        registry = KeyRegistry.of(data)
+        privKey = registry.ecies_private(reader)
         reader_ID_size = data["reader_id_size"]
         tag_ID_size = data["tag_id_size"]
 
@@ -216,27 +221,24 @@ class StepAuth:
         content = cryptogram[:-64]
         signature = cryptogram[-64:] # last 64 bytes
         h = SHA256.new(content)
-        print("Digest: %s\nPublic key: %s\nSignature: %s" % (h.hexdigest(), issuer_pk.export_key(format="raw").hex(), signature.hex()))
-        verifier = DSS.new(issuer_pk, 'fips-186-3')
+        log.debug("Digest: %s\nSignature: %s", Log.hex(h.digest()), Log.hex(signature))
+        verifier = registry.issuer_verifier()
         content = b'\x04' + content # add the 0x04 prefix again
         try:
             verifier.verify(h, signature)
             m = decrypt(privKey, content)
-            print(m.hex())
             try:
                 m = unpad(m, 16)
             except:
                 None
-            print(m.hex())
+            log.debug("%s", Log.hex(m))
             readerID = m[:reader_ID_size]
-            print(readerID)
             nextReaderID = m[reader_ID_size:2*reader_ID_size]
             if int.from_bytes(readerID, "big") == reader:
-                print("Tag %d has been verified by reader %d" % (tag.id, reader))
+                log.info("Tag %d has been verified by reader %d", tag.id, reader)
                 return (True, m)
             else:
-                print("Could not decrypt message. Make sure you use the right reader!")
+                log.warning("Could not decrypt message. Make sure you use the right reader!")
         except ValueError as e:
-            print("Message is not authentic: %s" % (e))
-            traceback.print_exc()
+            log.warning("Message is not authentic: %s", e, exc_info=log.isEnabledFor(logging.DEBUG))
         return (False, None)
\ No newline at end of file
@@ -0,0 +1,257 @@
+import os
+import sqlite3
+import threading
+
+'''
+Online storage of RF-Chain: maps the 16 byte IDi of every hop to the reader that wrote it and b
+The backend is selected in the keyfile, e.g.:
+    "storage": {"engine": "sqlite", "path": "tagdb.sqlite"}
+ * mysql : shared TagDB table on a MySQL server (default, used by the reader firmware)
+ * sqlite: local database file (WAL mode), relative paths are relative to the keyfile directory
+ * memory: dict in the current process, nothing is persisted (benchmarks, scripts that run all steps in one process)
+Every backend implements reset, insert, lookup_many and close (insert_many if it can do better than one insert per row)
+'''
+class StorageBackend:
+
+    '''
+    creates the backend described by the "storage" entry of a keyfile
+    keyfiles without this entry use the mysql server of the testbed
+    '''
+    @staticmethod
+    def from_config(data: dict) -> "StorageBackend":
+        config = data.get("storage", {"engine": "mysql"})
+        engine = config.get("engine", "mysql")
+        if engine == "mysql":
+            return MySQLBackend(config)
+        elif engine == "sqlite":
+            path = config.get("path", "tagdb.sqlite")
+            if not os.path.isabs(path) and "dir" in data:
+                path = os.path.join(data["dir"], path)
+            return SQLiteBackend(path)
+        elif engine == "memory":
+            return MemoryBackend(config.get("name", "default"))
+        raise ValueError("Unknown storage engine: %s" % engine)
+
+    '''
+    creates the storage if it does not exist yet
+    online secrets that are already stored are only removed if clear is set, otherwise reset raises a ValueError
+    '''
+    def reset(self, clear: bool = False):
+        raise NotImplementedError
+
+    '''
+    stores the online secret b of IDi, written by reader
+    an ID can only be stored once
+    '''
+    def insert(self, ID: bytes, b: bytes, reader: int):
+        raise NotImplementedError
+
+    '''
+    fetches the online secrets of all IDs in a single round trip
+    returns a dict ID -> (reader, b) with an entry for every ID that was found
+    '''
+    def lookup_many(self, IDs: list) -> dict:
+        raise NotImplementedError
+
+    '''
+    stores many online secrets (ID, b, reader) at once, e.g. when a batch of tags is issued
+    '''
+    def insert_many(self, rows: list):
+        for (ID, b, reader) in rows:
+            self.insert(ID, b, reader)
+
+    def close(self):
+        None
+
+
+'''
+MySQL backend, connections come from a pool that is shared by all backends with the same settings
+'''
+class MySQLBackend(StorageBackend):
+
+    # default settings of the testbed
+    _host="192.168.0.100" #"10.229.105.235"
+    _user="user"
+    _pass="password"  #"pass"
+    _pool_size=4
+    _pools={}
+
+    # online storage schema (version 2): binary IDs and b values with a unique index on tagID
+    # tagID is the 16 byte IDi, b is 32 (first hop) or 64 bytes
+    # use migrate_tagdb.py to convert a version 1 table (hex VARCHAR columns)
+    _create_table = ("CREATE TABLE IF NOT EXISTS RFChain.TagDB ("
+                     "`id` int(10) NOT NULL AUTO_INCREMENT,"
+                     "`tagID` BINARY(16) NOT NULL,"
+                     "`b` VARBINARY(64) NOT NULL,"
+                     "`reader` int(10) NOT NULL,"
+                     "`timestamp` DATETIME DEFAULT CURRENT_TIMESTAMP,"
+                     "PRIMARY KEY (`id`),"
+                     "UNIQUE KEY `UC_TagDB_tagID` (`tagID`)"
+                     ")")
+
+    def __init__(self, config: dict = {}):
+        self.host = config.get("host", MySQLBackend._host)
+        self.user = config.get("user", MySQLBackend._user)
+        self.password = config.get("password", MySQLBackend._pass)
+        self.pool_size = config.get("pool_size", MySQLBackend._pool_size)
+
+    '''
+    returns a connection from the connection pool, the pool is created on first use
+    closing the connection hands it back to the pool
+    '''
+    def connect(self):
+        # only imported when used, the other backends do not need a mysql connector
+        import mysql.connector.pooling
+        settings = (self.host, self.user, self.password)
+        if settings not in MySQLBackend._pools:
+            MySQLBackend._pools[settings] = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="rfchain%d" % len(MySQLBackend._pools),
+                pool_size=self.pool_size,
+                host=self.host,
+                user=self.user,
+                password=self.password,
+            )
+        return MySQLBackend._pools[settings].get_connection()
+
+    def reset(self, clear: bool = False):
+        mydb = self.connect()
+        cursor = mydb.cursor()
+        cursor.execute(MySQLBackend._create_table)
+        # an existing table of schema version 1 is not replaced, that needs the migration
+        cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS "
+                       "WHERE TABLE_SCHEMA = 'RFChain' AND TABLE_NAME = 'TagDB' AND COLUMN_NAME = 'tagID'")
+        row = cursor.fetchone()
+        if row is not None and row[0].lower() != "binary":
+            cursor.close()
+            mydb.close()
+            raise ValueError("RFChain.TagDB uses schema version 1, run migrate_tagdb.py first")
+        if not clear:
+            cursor.execute("SELECT COUNT(*) FROM RFChain.TagDB")
+            count = cursor.fetchone()[0]
+            if count > 0:
+                cursor.close()
+                mydb.close()
+                raise ValueError("RFChain.TagDB holds %d online secrets, they are only removed with clear" % count)
+        cursor.execute("DELETE FROM RFChain.TagDB")
+        mydb.commit()
+        cursor.close()
+        mydb.close()
+
+    def insert(self, ID: bytes, b: bytes, reader: int):
+        mydb = self.connect()
+        cursor = mydb.cursor()
+        add_online_secret = ("INSERT INTO RFChain.TagDB "
+                            "(tagID, b, reader) "
+                            "VALUES (%s, %s, %s)")
+        cursor.execute(add_online_secret, (ID, b, reader))
+        mydb.commit()
+        cursor.close()
+        mydb.close()
+
+    def insert_many(self, rows: list):
+        if len(rows) == 0:
+            return
+        mydb = self.connect()
+        cursor = mydb.cursor()
+        add_online_secret = ("INSERT INTO RFChain.TagDB "
+                            "(tagID, b, reader) "
+                            "VALUES (%s, %s, %s)")
+        # the connector turns this into multi-row INSERT statements
+        cursor.executemany(add_online_secret, [(bytes(ID), bytes(b), reader) for (ID, b, reader) in rows])
+        mydb.commit()
+        cursor.close()
+        mydb.close()
+
+    def lookup_many(self, IDs: list) -> dict:
+        if len(IDs) == 0:
+            return {}
+        mydb = self.connect()
+        cursor = mydb.cursor()
+        query = ("SELECT tagID, reader, b FROM RFChain.TagDB WHERE tagID IN (%s)" % ", ".join(["%s"] * len(IDs)))
+        cursor.execute(query, tuple(IDs))
+        secrets = {}
+        for (IDi, reader, b) in cursor.fetchall():
+            secrets[bytes(IDi)] = (reader, bytes(b))
+        cursor.close()
+        mydb.close()
+        return secrets
+
+
+'''
+SQLite backend, the scheme runs on a single machine without a database server
+WAL mode lets the verification service read while update_tag.py writes
+'''
+class SQLiteBackend(StorageBackend):
+
+    _create_table = ("CREATE TABLE IF NOT EXISTS TagDB ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                     "tagID BLOB NOT NULL UNIQUE,"
+                     "b BLOB NOT NULL,"
+                     "reader INTEGER NOT NULL,"
+                     "timestamp DATETIME DEFAULT CURRENT_TIMESTAMP"
+                     ")")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # WAL is consistent after a crash with synchronous=NORMAL, only the last transactions may be lost
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SQLiteBackend._create_table)
+        self.db.commit()
+
+    def reset(self, clear: bool = False):
+        self.db.execute(SQLiteBackend._create_table)
+        if not clear:
+            count = self.db.execute("SELECT COUNT(*) FROM TagDB").fetchone()[0]
+            if count > 0:
+                raise ValueError("%s holds %d online secrets, they are only removed with clear" % (self.path, count))
+        with self.db:
+            self.db.execute("DELETE FROM TagDB")
+
+    def insert(self, ID: bytes, b: bytes, reader: int):
+        with self.db:
+            self.db.execute("INSERT INTO TagDB (tagID, b, reader) VALUES (?, ?, ?)", (bytes(ID), bytes(b), reader))
+
+    def insert_many(self, rows: list):
+        with self.db:
+            self.db.executemany("INSERT INTO TagDB (tagID, b, reader) VALUES (?, ?, ?)", [(bytes(ID), bytes(b), reader) for (ID, b, reader) in rows])
+
+    def lookup_many(self, IDs: list) -> dict:
+        if len(IDs) == 0:
+            return {}
+        query = "SELECT tagID, reader, b FROM TagDB WHERE tagID IN (%s)" % ", ".join(["?"] * len(IDs))
+        secrets = {}
+        for (IDi, reader, b) in self.db.execute(query, [bytes(ID) for ID in IDs]):
+            secrets[bytes(IDi)] = (reader, bytes(b))
+        return secrets
+
+    def close(self):
+        self.db.close()
+
+
+'''
+In-process backend, all backends with the same name share one dict
+'''
+class MemoryBackend(StorageBackend):
+
+    _stores={}
+    _lock=threading.Lock()
+
+    def __init__(self, name: str = "default"):
+        self.store = MemoryBackend._stores.setdefault(name, {})
+
+    def reset(self, clear: bool = False):
+        with MemoryBackend._lock:
+            if not clear and len(self.store) > 0:
+                raise ValueError("The memory storage holds %d online secrets, they are only removed with clear" % len(self.store))
+            self.store.clear()
+
+    def insert(self, ID: bytes, b: bytes, reader: int):
+        with MemoryBackend._lock:
+            if bytes(ID) in self.store:
+                raise ValueError("Online secret %s already exists" % bytes(ID).hex())
+            self.store[bytes(ID)] = (reader, bytes(b))
+
+    def lookup_many(self, IDs: list) -> dict:
+        return {bytes(ID): self.store[bytes(ID)] for ID in IDs if bytes(ID) in self.store}
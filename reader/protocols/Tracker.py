@@ -1,20 +1,44 @@
 import secrets
 import random
 import json
+import logging
 import os
-import pickle
+import shutil
+import sqlite3
+
+from concurrent.futures import ProcessPoolExecutor
 
 from Crypto.Hash import SHA256, HMAC
 from ecc.curve import Curve25519, ShortWeierstrassCurve, Point
 from ecc.key import gen_keypair
 from ecc.cipher import ElGamal
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.ECMath import ECMath, FixedBaseTable
+from protocols.RandomizerPool import RandomizerPool
+from protocols.Log import Log
+
+log = logging.getLogger(__name__)
 
 '''
 implements all logic for the tracker protocol
 '''
 class Tracker:
 
+    # window of the fixed base tables (table size per base: ceil(161 / window) * (2^window - 1) points)
+    _window=8
+    # the manager header only gets the compiled graph paths if there are at most this many
+    _header_paths=1024
+    # path evaluations that are converted to points together by the graph compiler
+    _compile_chunk=1024
+    # state of a graph compiler worker process, see init_compiler
+    _compiler=None
+    # evaluation points of the valid paths that are looked up in the path index with one query
+    _path_query=500
+    # re-encryption randomizers that are kept ready for update_tag
+    _randomizers=64
+
     '''
     Tracker generates the following:
       1) the key pair used for elgamal encryption
@@ -25,9 +49,11 @@ class Tracker:
     Tracker uses the secp160r1 Curve
     each reader receives its coeficient and the point of evaluation x0
     manager receives all coeficients, x0, key k, valid paths, and private key
+    graph optionally describes more valid paths as a reader graph (see compile_paths): (edges, min_len, max_len, workers)
+    encoding selects how the tag content is written (see encoding)
     '''
     @staticmethod
-    def generate_reader_configs(nr_readers: int, valid_paths: list, dir: str):
+    def generate_reader_configs(nr_readers: int, valid_paths: list, dir: str, graph: tuple = None, encoding: str = "raw"):
         # define secp160r1
         secp160r1 = ShortWeierstrassCurve(
             name="secp160r1",
@@ -86,7 +112,9 @@ class Tracker:
                     "y": P.y
                 }, 
                 "readers": [],
-                "valid_paths": []}
+                "valid_paths": [],
+                "randomizers": {"size": Tracker._randomizers, "dir": "randomizers"},
+                "encoding": encoding}
 
         # generate values for a
         for i in range(nr_readers):
@@ -94,7 +122,7 @@ class Tracker:
 
         # calculate valid paths
         valid_paths_evaluations = []
-        print("Generating evaluations for %d paths: %s" % (len(valid_paths), valid_paths))
+        log.info("Generating evaluations for %d paths: %s", len(valid_paths), valid_paths)
         for path in valid_paths:
             path_len = len(path)
             eval = (a0 * x0**path_len) % n
@@ -103,9 +131,30 @@ class Tracker:
             eval_ec = P * eval
             valid_paths_evaluations.append(eval_ec)
             data["valid_paths"].append({"label": str(path),"x": eval_ec.x, "y": eval_ec.y})
+
+        # the verifiers look the paths up in the index instead of reading them all
+        data["path_index"] = "valid_paths.sqlite"
+        index = Tracker.open_path_index(data)
+        Tracker.write_path_index(index, data, data["valid_paths"])
+
+        # compile the paths of the reader graph, they are too many for the keyfile
+        header_paths = data["valid_paths"]
+        if graph is not None:
+            (edges, min_len, max_len, workers) = graph
+            data["valid_paths_file"] = "valid_paths.jsonl"
+            count = Tracker.compile_paths(data, edges, min_len, max_len, "%s/%s" % (dir, data["valid_paths_file"]), workers, index)
+            log.info("Compiled %d paths of the reader graph", count)
+            if count <= Tracker._header_paths:
+                header_paths = list(Tracker.valid_paths(data))
+            else:
+                log.info("The manager header only contains the %d paths of the path file", len(data["valid_paths"]))
+        index.close()
+
         # write to json file
         with open("%s/keyfile.json" % (dir), "w") as f:
             json.dump(data, f, indent=4)
+        # precompute the fixed base tables once, they are stored next to the keyfile
+        Tracker.load_tables(data)
 
         # generate reader settings file for readers that need to do the update
         for i in range(nr_readers):
@@ -161,7 +210,7 @@ class Tracker:
         # write reader ID and curve size in bytes
         c_string_data += "const uint16_t curveSizeBytes = %d;\n" % curveSizeBytes 
         c_string_data += "const uint16_t nrPointsSizeBytes = %d;\n" % nSize
-        c_string_data += "const uint16_t nrPaths = %d;\n" % len(data["valid_paths"])
+        c_string_data += "const uint16_t nrPaths = %d;\n" % len(header_paths)
         c_string_data += "const uint16_t nrReaders = %d;\n" % nr_readers
         c_string_data += "const uint32_t readerId = %d;\n" % nr_readers
 
@@ -212,8 +261,8 @@ class Tracker:
         c_string_data += "};\n"   
 
         # write path evaluations, store as a 2D array the point gets encoded as a 2 x curveSizeBytes array (x, y)
-        c_string_data += "const uint8_t valid_paths[%d][%d] = {" % (len(data["valid_paths"]), 2 * curveSizeBytes)
-        for valid_path in data["valid_paths"]:
+        c_string_data += "const uint8_t valid_paths[%d][%d] = {" % (len(header_paths), 2 * curveSizeBytes)
+        for valid_path in header_paths:
             c_string_data += "{"
             for _byte in valid_path["x"].to_bytes(curveSizeBytes, 'big'):
                 c_string_data += "%d, " % _byte
@@ -226,7 +275,7 @@ class Tracker:
 
         # add path labels
         c_string_data += "const char *valid_path_labels[] = {";
-        for valid_path in data["valid_paths"]:
+        for valid_path in header_paths:
             c_string_data += "\"%s\", " % (valid_path["label"])
         c_string_data = c_string_data[:-2] # remove ", "
         c_string_data += "};\n"
@@ -257,9 +306,14 @@ class Tracker:
 
     '''
     loads all the data from the config file
+    the parsed values are kept in the key registry of the config
     '''
     @staticmethod
     def load_config(config):
+        return KeyRegistry.of(config).memo("tracker", lambda: Tracker.parse_config(config))
+
+    @staticmethod
+    def parse_config(config):
         # load secp160r1
         (secp160r1, curveSizeBytes) = Tracker.load_curve(config)
 
@@ -272,13 +326,455 @@ class Tracker:
         P = Point(config["P"]["x"], config["P"]["y"], secp160r1)
         return (secp160r1, curveSizeBytes, pub_key, pri_key, k, n, a0, P)
 
+    '''
+    curve arithmetic and the fixed base tables of P, G and the public key
+    the tables only depend on the keyfile, they are built once and stored in <dir>/tracker_tables.json
+    '''
+    @staticmethod
+    def load_tables(config):
+        return KeyRegistry.of(config).memo("tracker tables", lambda: Tracker.parse_tables(config))
+
+    @staticmethod
+    def parse_tables(config):
+        math = ECMath(config["curve"]["a"], config["curve"]["p"], config["curve"]["n"], config["curve"]["b"])
+        bases = {"P": (config["P"]["x"], config["P"]["y"]),
+                 "G": (config["curve"]["Gx"], config["curve"]["Gy"]),
+                 "public": (config["public"]["x"], config["public"]["y"])}
+        path = "%s/tracker_tables.json" % config["dir"]
+        stored = {}
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except (FileNotFoundError, ValueError):
+            None
+        tables = {}
+        unique = {}
+        built = False
+        for (name, base) in bases.items():
+            # P is usually G, both share one table
+            same = [table for table in unique.values() if table.base == base]
+            if len(same) > 0:
+                tables[name] = same[0]
+                continue
+            entry = stored.get(name)
+            if entry is not None and (entry["x"], entry["y"]) == base and entry["window"] == Tracker._window:
+                tables[name] = FixedBaseTable.from_json(math, entry)
+            else:
+                tables[name] = FixedBaseTable(math, base, Tracker._window)
+                built = True
+            unique[name] = tables[name]
+        if built and os.path.isdir(config["dir"]):
+            with open(path + ".tmp", "w") as f:
+                json.dump({name: table.to_json() for (name, table) in unique.items()}, f)
+            os.replace(path + ".tmp", path)
+        return (math, tables)
+
+    '''
+    conversion between Point objects of the ecc package and the (x, y) tuples of ECMath
+    '''
+    @staticmethod
+    def to_tuple(point: Point):
+        if point.x is None:
+            return None
+        return (point.x, point.y)
+
+    @staticmethod
+    def to_point(point, curve: ShortWeierstrassCurve) -> Point:
+        if point is None:
+            return Point(None, None, curve)
+        return Point(point[0], point[1], curve)
+
+    '''
+    k * base for one of the fixed bases ("P", "G" or "public")
+    '''
+    @staticmethod
+    def fixed_multiply(config, name: str, k: int) -> Point:
+        (math, tables) = Tracker.load_tables(config)
+        return Tracker.to_point(tables[name].multiply(k), Tracker.load_config(config)[0])
+
+    '''
+    ElGamal encryption of the point M: (r * G, M + r * public)
+    '''
+    @staticmethod
+    def encrypt_point(config, M: Point) -> (Point, Point):
+        (math, tables) = Tracker.load_tables(config)
+        curve = Tracker.load_config(config)[0]
+        r = 1 + secrets.randbelow(curve.n - 1)
+        C1 = tables["G"].multiply(r)
+        C2 = math.add(Tracker.to_tuple(M), tables["public"].multiply(r))
+        return (Tracker.to_point(C1, curve), Tracker.to_point(C2, curve))
+
+    '''
+    ElGamal re-encryption of (C1, C2) with a randomizer (r * P, r * public): (C1 + r * P, C2 + r * public)
+    '''
+    @staticmethod
+    def reencrypt(config, C1: Point, C2: Point, randomizer: tuple) -> (Point, Point):
+        (math, tables) = Tracker.load_tables(config)
+        curve = Tracker.load_config(config)[0]
+        (rP, rPublic) = randomizer
+        new_C1 = math.add(rP, Tracker.to_tuple(C1))
+        new_C2 = math.add(rPublic, Tracker.to_tuple(C2))
+        return (Tracker.to_point(new_C1, curve), Tracker.to_point(new_C2, curve))
+
+    '''
+    count new re-encryption randomizers (r * P, r * public) as affine tuples, converted with one inversion
+    '''
+    @staticmethod
+    def generate_randomizers(config, count: int) -> list:
+        (math, tables) = Tracker.load_tables(config)
+        n = config["curve"]["n"]
+        points = []
+        for _ in range(count):
+            r = 1 + secrets.randbelow(n - 1)
+            points += [tables["P"].multiply_jacobian(r), tables["public"].multiply_jacobian(r)]
+        points = math.normalize_many(points)
+        return [(points[i], points[i + 1]) for i in range(0, len(points), 2)]
+
+    '''
+    pool of re-encryption randomizers, set with "randomizers" in the keyfile:
+        "randomizers": {"size": 64, "dir": "randomizers"}
+    with "dir" (relative to the keyfile directory) the unused randomizers are kept for the next process
+    background starts a thread that keeps the pool filled (long-running callers), without it the randomizers that
+    are not in the pool are computed when update_tag needs them
+    the stored randomizers undo the re-encryption of a tag, they need the same protection as the keyfile
+    '''
+    @staticmethod
+    def randomizers(config, background: bool = False) -> RandomizerPool:
+        pool = KeyRegistry.of(config).memo("tracker randomizers", lambda: Tracker.create_randomizers(config))
+        if background:
+            pool.start()
+        return pool
+
+    @staticmethod
+    def create_randomizers(config) -> RandomizerPool:
+        settings = config.get("randomizers", {})
+        dir = settings.get("dir")
+        if dir is not None and not os.path.isabs(dir):
+            dir = os.path.join(config["dir"], dir)
+        meta = {"P": config["P"], "public": config["public"]}
+        return RandomizerPool(lambda count: Tracker.generate_randomizers(config, count), settings.get("size", Tracker._randomizers), dir, meta)
+
+    '''
+    curve backend of generate_tag_secret, update_tag and verify_tag, set with "backend" in the keyfile:
+     * ecc     : Point objects of the ecc package (default)
+     * jacobian: integer tuples in Jacobian coordinates (see ECMath), converted to affine once per tag
+    both backends produce the same tag content for the same random values
+    '''
+    @staticmethod
+    def backend(config) -> str:
+        backend = config.get("backend", "ecc")
+        if backend not in ["ecc", "jacobian"]:
+            raise ValueError("Unknown curve backend: %s" % backend)
+        return backend
+
+    '''
+    format of the tag content that is written, set with "encoding" in the keyfile:
+     * raw       : x || y of every point, 12 * curveSize bytes (default, the only format of the firmware)
+     * compressed: 02/03 || x of every point (parity of y), 6 * (curveSize + 1) bytes
+    both formats are read, the format of a tag is determined by its length
+    '''
+    @staticmethod
+    def encoding(config) -> str:
+        encoding = config.get("encoding", "raw")
+        if encoding not in ["raw", "compressed"]:
+            raise ValueError("Unknown tag encoding: %s" % encoding)
+        return encoding
+
+    '''
+    length of the tag secret at the start of a user bank, independent of the encoding of the keyfile (like content_to_tuples)
+    compressed content has a 02/03 prefix every curveSize + 1 bytes, raw content only by chance (2^-42)
+    '''
+    @staticmethod
+    def content_length(config, content: bytes) -> int:
+        curveSizeBytes = config["curve"]["size"]
+        size = curveSizeBytes + 1
+        if len(content) >= 6 * size and all([content[i * size] in [2, 3] for i in range(6)]):
+            return 6 * size
+        return 12 * curveSizeBytes
+
+    '''
+    converts the tag content into affine tuples (jacobian backend), raw and compressed content is accepted
+    throws an error if the tag content is not 12 * curveSize or 6 * (curveSize + 1) (in bytes) or a point is not on the curve
+    '''
+    @staticmethod
+    def content_to_tuples(content: bytes, math: ECMath, curveSizeBytes: int) -> list:
+        if len(content) == 6 * (curveSizeBytes + 1):
+            return Tracker.decompress_content(content, math, curveSizeBytes)
+        if len(content) != 12 * curveSizeBytes:
+            raise Exception("tag content should be equal to 6 * %d = %d (or %d compressed), but it is %d" % (2 * curveSizeBytes, 12 * curveSizeBytes, 6 * (curveSizeBytes + 1), len(content)))
+        points = []
+        for i in range(0, 12, 2):
+            point = (int.from_bytes(content[i * curveSizeBytes : (i + 1) * curveSizeBytes], 'big'),
+                     int.from_bytes(content[(i + 1) * curveSizeBytes : (i + 2) * curveSizeBytes], 'big'))
+            if not math.on_curve(point):
+                raise ValueError("tag content contains a point that is not on the curve")
+            points.append(point)
+        return points
+
+    '''
+    compressed tag content to affine tuples, every y is one square root
+    '''
+    @staticmethod
+    def decompress_content(content: bytes, math: ECMath, curveSizeBytes: int) -> list:
+        size = curveSizeBytes + 1
+        points = []
+        for i in range(6):
+            if content[i * size] not in [2, 3]:
+                raise ValueError("tag content contains a point with an invalid prefix")
+            points.append(math.decompress(int.from_bytes(content[i * size + 1 : (i + 1) * size], 'big'), content[i * size] & 1))
+        return points
+
+    '''
+    affine tuples to tag content in the given encoding
+    '''
+    @staticmethod
+    def tuples_to_content(points: list, curveSizeBytes: int, encoding: str = "raw") -> bytes:
+        message = b""
+        for point in points:
+            if encoding == "compressed":
+                message += Tracker.compress_point(point, curveSizeBytes)
+            else:
+                message += point[0].to_bytes(curveSizeBytes, 'big') + point[1].to_bytes(curveSizeBytes, 'big')
+        return message
+
+    '''
+    tag points in the representation of the backend
+    '''
+    @staticmethod
+    def read_points(config, tag: Tag) -> list:
+        (secp160r1, curveSizeBytes) = Tracker.load_config(config)[:2]
+        if Tracker.backend(config) == "jacobian":
+            return Tracker.content_to_tuples(tag.content, Tracker.load_tables(config)[0], curveSizeBytes)
+        return Tracker.tag_content_to_points(tag, secp160r1, curveSizeBytes)
+
+    '''
+    ElGamal decryption C2 - private * C1 with the backend, returns an affine tuple
+    '''
+    @staticmethod
+    def decrypt(config, C1, C2) -> tuple:
+        (secp160r1, _, _, pri_key) = Tracker.load_config(config)[:4]
+        if Tracker.backend(config) == "jacobian":
+            math = Tracker.load_tables(config)[0]
+            return math.normalize_many([math.jadd(C2, math.jneg(math.jmultiply(pri_key, C1)))])[0]
+        return Tracker.to_tuple(ElGamal(secp160r1).decrypt_point(pri_key, C1, C2))
+
+    '''
+    k * point (affine tuple) with the backend, returns an affine tuple
+    '''
+    @staticmethod
+    def multiply(config, k: int, point: tuple) -> tuple:
+        if Tracker.backend(config) == "jacobian":
+            math = Tracker.load_tables(config)[0]
+            return math.normalize_many([math.jmultiply(k, point)])[0]
+        return Tracker.to_tuple(k * Tracker.to_point(point, Tracker.load_config(config)[0]))
+
+    '''
+    k * base for one of the fixed bases with the backend, returns an affine tuple
+    '''
+    @staticmethod
+    def base_multiply(config, name: str, k: int) -> tuple:
+        (math, tables) = Tracker.load_tables(config)
+        if Tracker.backend(config) == "jacobian":
+            return math.normalize_many([tables[name].multiply_jacobian(k)])[0]
+        return tables[name].multiply(k)
+
+    '''
+    Tracker tag secret in Jacobian coordinates, same steps and random values as generate_tag_secret
+    all six ciphertext points are converted to affine with one inversion
+    '''
+    @staticmethod
+    def generate_tag_content_jacobian(data: dict) -> bytes:
+        (secp160r1, curveSizeBytes, pub_key, pri_key, k, n, a0, P) = Tracker.load_config(data)
+        (math, tables) = Tracker.load_tables(data)
+
+        # generate a random ID (public key is a random point)
+        ID = math.normalize_many([tables["G"].multiply_jacobian(1 + secrets.randbelow(n - 1))])[0]
+
+        # Generate HMAC(k, ID)
+        hash = HMAC.new(str(k).encode(), digestmod=SHA256)
+        hash.update(ID[0].to_bytes(curveSizeBytes, 'big'))
+        hash.update(ID[1].to_bytes(curveSizeBytes, 'big'))
+        digest = int(hash.hexdigest(), 16)
+
+        # encrypt ID, digest * P and polynomial * P: (r * G, M + r * public)
+        points = []
+        for M in [ID, tables["P"].multiply_jacobian(digest), tables["P"].multiply_jacobian((digest * a0) % n)]:
+            r = 1 + secrets.randbelow(n - 1)
+            points += [tables["G"].multiply_jacobian(r), math.jadd(tables["public"].multiply_jacobian(r), M)]
+        return Tracker.tuples_to_content(math.normalize_many(points), curveSizeBytes, Tracker.encoding(data))
+
+    '''
+    Tracker update in Jacobian coordinates, same steps and random values as update_tag
+    all six ciphertext points are converted to affine with one inversion
+    '''
+    @staticmethod
+    def update_tag_content_jacobian(data: dict, content: bytes, x0: int, ai: int) -> bytes:
+        (secp160r1, curveSizeBytes) = Tracker.load_config(data)[:2]
+        (math, tables) = Tracker.load_tables(data)
+        C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2 = Tracker.content_to_tuples(content, math, curveSizeBytes)
+
+        # calculate new ciphertexts
+        new_C_poly_1 = math.jadd(math.jmultiply(x0, C_polynomial_1), math.jmultiply(ai, C_hash_1))
+        new_C_poly_2 = math.jadd(math.jmultiply(x0, C_polynomial_2), math.jmultiply(ai, C_hash_2))
+
+        # reencrypt to prevent linking attacks: (C1 + r * P, C2 + r * public), the randomizers are precomputed
+        new_points = []
+        randomizers = Tracker.randomizers(data).take(3)
+        for ((C1, C2), (rP, rPublic)) in zip([(C_ID_1, C_ID_2), (C_hash_1, C_hash_2), (new_C_poly_1, new_C_poly_2)], randomizers):
+            new_points += [math.jadd(C1, rP), math.jadd(C2, rPublic)]
+        return Tracker.tuples_to_content(math.normalize_many(new_points), curveSizeBytes, Tracker.encoding(data))
+
+    '''
+    index of the valid paths in memory: (x, y) of the path evaluation -> label
+    only the paths of the keyfile if it has a path index file, keyfiles without one get all valid paths
+    '''
+    @staticmethod
+    def path_index(config) -> dict:
+        paths = config["valid_paths"] if "path_index" in config else Tracker.valid_paths(config)
+        return KeyRegistry.of(config).memo("tracker paths", lambda: {(path["x"], path["y"]): str(path["label"]) for path in paths})
+
+    '''
+    the path index file ("path_index" in the keyfile): a SQLite table of all valid paths, keyed by x and y of
+    the path evaluation, written once by generate_reader_configs, the verifiers only query it
+    '''
+    @staticmethod
+    def open_path_index(config) -> sqlite3.Connection:
+        db = sqlite3.connect("%s/%s" % (config["dir"], config["path_index"]))
+        db.execute("CREATE TABLE IF NOT EXISTS paths (x BLOB, y BLOB, label TEXT, PRIMARY KEY (x, y)) WITHOUT ROWID")
+        return db
+
+    @staticmethod
+    def write_path_index(db: sqlite3.Connection, config, paths):
+        size = config["curve"]["size"]
+        with db:
+            db.executemany("INSERT OR REPLACE INTO paths (x, y, label) VALUES (?, ?, ?)",
+                           ((path["x"].to_bytes(size, 'big'), path["y"].to_bytes(size, 'big'), str(path["label"])) for path in paths))
+
+    @staticmethod
+    def path_db(config) -> sqlite3.Connection:
+        return KeyRegistry.of(config).memo("tracker path index", lambda: sqlite3.connect("file:%s/%s?mode=ro" % (config["dir"], config["path_index"]), uri=True))
+
+    '''
+    returns the labels of the valid paths with the evaluation points (x, y), None for a point that is no valid path
+    the paths of the keyfile are found in memory, the other points are looked up in the path index file
+    '''
+    @staticmethod
+    def lookup_paths(config, points: list) -> list:
+        index = Tracker.path_index(config)
+        labels = [index.get(point) for point in points]
+        missing = [i for (i, label) in enumerate(labels) if label is None and points[i] is not None]
+        if "path_index" not in config or len(missing) == 0:
+            return labels
+        size = config["curve"]["size"]
+        db = Tracker.path_db(config)
+        for first in range(0, len(missing), Tracker._path_query):
+            batch = missing[first : first + Tracker._path_query]
+            query = "SELECT x, y, label FROM paths WHERE x IN (%s)" % ", ".join(["?"] * len(batch))
+            found = {(int.from_bytes(x, 'big'), int.from_bytes(y, 'big')): label for (x, y, label) in db.execute(query, [points[i][0].to_bytes(size, 'big') for i in batch])}
+            for i in batch:
+                labels[i] = found.get(points[i])
+        return labels
+
+    '''
+    all valid paths of a config: the ones in the keyfile followed by the compiled paths of the reader graph
+    '''
+    @staticmethod
+    def valid_paths(config):
+        for path in config["valid_paths"]:
+            yield path
+        if "valid_paths_file" in config:
+            with open("%s/%s" % (config["dir"], config["valid_paths_file"])) as f:
+                for line in f:
+                    yield json.loads(line)
+
+    '''
+    path graph compiler
+    edges maps a reader to the readers that can follow it, every walk of min_len..max_len readers is a valid path
+    the evaluation of a path is a Horner scheme mod n: e = a0, then e = e * x0 + a_reader for every reader
+    paths with the same prefix share its steps, the walks are enumerated depth first (a prefix trie)
+    the walks are split by their first two readers over a pool of worker processes, every worker writes its paths
+    to a part file, the parts are appended to output (JSON lines: label, x, y) in order and to the path index db if given
+    returns the number of paths
+    '''
+    @staticmethod
+    def compile_paths(config, edges: dict, min_len: int, max_len: int, output: str, workers: int = None, index: sqlite3.Connection = None) -> int:
+        compiler = {"curve": config["curve"], "P": config["P"], "x0": config["x0"], "a0": config["a0"],
+                    "a": [reader["a"] for reader in config["readers"]],
+                    "edges": edges, "min_len": min_len, "max_len": max_len}
+        # (prefix, extend): the paths of one reader are a task of their own, longer ones are split by their first edge
+        tasks = []
+        for reader in range(len(compiler["a"])):
+            if min_len <= 1 <= max_len:
+                tasks.append(([reader], False))
+            if max_len >= 2:
+                for next_reader in edges.get(reader, []):
+                    tasks.append(([reader, next_reader], True))
+        count = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=Tracker.init_compiler, initargs=(compiler,)) as pool, open(output, "wb") as f:
+            futures = [pool.submit(Tracker.compile_prefix, prefix, extend, "%s.%d" % (output, i)) for (i, (prefix, extend)) in enumerate(tasks)]
+            for (i, future) in enumerate(futures):
+                count += future.result()
+                part = "%s.%d" % (output, i)
+                with open(part, "rb") as partfile:
+                    shutil.copyfileobj(partfile, f)
+                if index is not None:
+                    with open(part) as partfile:
+                        Tracker.write_path_index(index, config, (json.loads(line) for line in partfile))
+                os.remove(part)
+        return count
+
+    @staticmethod
+    def init_compiler(compiler: dict):
+        curve = compiler["curve"]
+        math = ECMath(curve["a"], curve["p"], curve["n"], curve["b"])
+        compiler["math"] = math
+        compiler["table"] = FixedBaseTable(math, (compiler["P"]["x"], compiler["P"]["y"]), Tracker._window)
+        Tracker._compiler = compiler
+
+    '''
+    writes the paths that start with prefix (only prefix itself if extend is not set) to output, runs in a worker
+    '''
+    @staticmethod
+    def compile_prefix(prefix: list, extend: bool, output: str) -> int:
+        compiler = Tracker._compiler
+        (math, table, edges, a) = (compiler["math"], compiler["table"], compiler["edges"], compiler["a"])
+        (n, x0, min_len, max_len) = (compiler["curve"]["n"], compiler["x0"], compiler["min_len"], compiler["max_len"])
+        count = 0
+        chunk = []
+
+        def write_chunk():
+            points = math.normalize_many([table.multiply_jacobian(e) for (_, e) in chunk])
+            for ((path, _), point) in zip(chunk, points):
+                if point is not None:
+                    f.write(json.dumps({"label": str(path), "x": point[0], "y": point[1]}) + "\n")
+            chunk.clear()
+
+        e = compiler["a0"]
+        for reader in prefix:
+            e = (e * x0 + a[reader]) % n
+        with open(output, "w") as f:
+            stack = [(prefix, e)]
+            while len(stack) > 0:
+                (path, e) = stack.pop()
+                if min_len <= len(path) <= max_len:
+                    chunk.append((path, e))
+                    count += 1
+                    if len(chunk) >= Tracker._compile_chunk:
+                        write_chunk()
+                if extend and len(path) < max_len:
+                    # reversed, so the paths come out in lexicographic order
+                    for next_reader in reversed(edges.get(path[-1], [])):
+                        stack.append((path + [next_reader], (e * x0 + a[next_reader]) % n))
+            write_chunk()
+        return count
+
     '''
     point compression function, needed if we want so save space
     '''
     @staticmethod
-    def compress_point(point: Point, curveSizeBytes: int) -> int:
-        _bytes = point.x.to_bytes(curveSizeBytes, 'big')
-        if point.y % 2 == 0:
+    def compress_point(point: tuple, curveSizeBytes: int) -> bytes:
+        _bytes = point[0].to_bytes(curveSizeBytes, 'big')
+        if point[1] % 2 == 0:
             return b'\x02' + _bytes
         return b'\x03' + _bytes
         
@@ -296,10 +792,36 @@ class Tracker:
     '''
     @staticmethod
     def generate_tag_secret(tag: int, data: dict):
+        tagObj = Tracker.create_tag_secret(tag, data)
+        TagStore.of(data).put(tagObj)
+
+        # the decryption is only a debug check, it costs three scalar multiplications
+        if Tracker.backend(data) == "jacobian" or not log.isEnabledFor(logging.DEBUG):
+            return
+
+        # Decrypt
+        (secp160r1, curveSizeBytes, pub_key, pri_key) = Tracker.load_config(data)[:4]
+        C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2 = Tracker.tag_content_to_points(tagObj, secp160r1, curveSizeBytes)
+        cipher = ElGamal(secp160r1)
+        P_ID = cipher.decrypt_point(pri_key, C_ID_1, C_ID_2)
+        P_hash = cipher.decrypt_point(pri_key, C_hash_1, C_hash_2)
+        P_polynomial = cipher.decrypt_point(pri_key, C_polynomial_1, C_polynomial_2)
+        log.debug("PLAINTEXT(DEC):\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n", P_ID.x, P_ID.y, P_hash.x, P_hash.y, P_polynomial.x, P_polynomial.y)
+
+    '''
+    same as generate_tag_secret, but returns the tag object instead of storing it (bulk issuance)
+    '''
+    @staticmethod
+    def create_tag_secret(tag: int, data: dict) -> Tag:
         (secp160r1, curveSizeBytes, pub_key, pri_key, k, n, a0, P) = Tracker.load_config(data)
 
+        if Tracker.backend(data) == "jacobian":
+            message = Tracker.generate_tag_content_jacobian(data)
+            log.debug("tag content length: %d\ntag content: %s", len(message), Log.hex(message))
+            return Tag(tag, message, "tracker")
+
         # generate a random ID (public key is a random point) 
-        _, ID = gen_keypair(secp160r1)
+        ID = Tracker.fixed_multiply(data, "G", 1 + secrets.randbelow(n - 1))
 
         # Generate HMAC(k, ID)
         hash = HMAC.new(str(k).encode(), digestmod=SHA256)
@@ -307,46 +829,34 @@ class Tracker:
         hash.update(ID.y.to_bytes(curveSizeBytes, 'big'))
         digest = int(hash.hexdigest(), 16)
         # values need to be stored as points
-        digest_point = digest * P
-        polynomial_point = ((digest * a0) % n) * P
+        digest_point = Tracker.fixed_multiply(data, "P", digest)
+        polynomial_point = Tracker.fixed_multiply(data, "P", (digest * a0) % n)
 
         # encryption is done over points because we have a custom mapping
-        cipher = ElGamal(secp160r1)
-        print("PLAINTEXT:\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n" % (ID.x, ID.y, digest_point.x, digest_point.y, polynomial_point.x, polynomial_point.y))
-        C_ID_1, C_ID_2 = cipher.encrypt_point(ID, pub_key, None)
-        C_hash_1, C_hash_2 = cipher.encrypt_point(digest_point, pub_key, None)    
-        C_polynomial_1, C_polynomial_2 = cipher.encrypt_point(polynomial_point, pub_key, None)
+        log.debug("PLAINTEXT:\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n", ID.x, ID.y, digest_point.x, digest_point.y, polynomial_point.x, polynomial_point.y)
+        C_ID_1, C_ID_2 = Tracker.encrypt_point(data, ID)
+        C_hash_1, C_hash_2 = Tracker.encrypt_point(data, digest_point)
+        C_polynomial_1, C_polynomial_2 = Tracker.encrypt_point(data, polynomial_point)
 
 
         # write to output to a file
-        print("""CIPHERTEXT:
+        log.debug("""CIPHERTEXT:
 ID: (%d, %d)
 ID 2: (%d, %d)
 HMAC(ID):(%d, %d)
 HMAC(ID) 2:(%d, %d)
 Polynomial: (%d, %d)
 Polynomial 2: (%d, %d)
-""" % (C_ID_1.x, C_ID_1.y, 
+""", C_ID_1.x, C_ID_1.y, 
         C_ID_2.x, C_ID_2.y,
         C_hash_1.x, C_hash_1.y,
         C_hash_2.x, C_hash_2.y,  
         C_polynomial_1.x, C_polynomial_1.y,
-        C_polynomial_2.x, C_polynomial_2.y))
+        C_polynomial_2.x, C_polynomial_2.y)
 
-        message = b""
-        for point in [C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2]:
-            message += point.x.to_bytes(curveSizeBytes, 'big') + point.y.to_bytes(curveSizeBytes, 'big') 
-        print("tag content length: %d\ntag content: %s" % (len(message), message.hex()))
-        tagObj = Tag(tag, message, "tracker")
-        with open("%s/%d.tag" % (data["dir"], tag), "wb") as f:
-            pickle.dump(tagObj, f)
-
-
-        # Decrypt
-        P_ID = cipher.decrypt_point(pri_key, C_ID_1, C_ID_2)
-        P_hash = cipher.decrypt_point(pri_key, C_hash_1, C_hash_2)
-        P_polynomial = cipher.decrypt_point(pri_key, C_polynomial_1, C_polynomial_2)
-        print("PLAINTEXT(DEC):\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n" % (P_ID.x, P_ID.y, P_hash.x, P_hash.y, P_polynomial.x, P_polynomial.y))
+        message = Tracker.tuples_to_content([Tracker.to_tuple(point) for point in [C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2]], curveSizeBytes, Tracker.encoding(data))
+        log.debug("tag content length: %d\ntag content: %s", len(message), Log.hex(message))
+        return Tag(tag, message, "tracker")
 
 
     @staticmethod
@@ -355,10 +865,13 @@ Polynomial 2: (%d, %d)
 
     '''
     converts the tag content into points
-    throws an error if the tag content is not 12 * curveSize (in bytes)
+    throws an error if the tag content is not 12 * curveSize or 6 * (curveSize + 1) (in bytes)
     '''
     @staticmethod
     def tag_content_to_points(tag: Tag, secp160r1: ShortWeierstrassCurve, curveSizeBytes: int):
+        if len(tag.content) == 6 * (curveSizeBytes + 1):
+            math = ECMath(secp160r1.a, secp160r1.p, secp160r1.n, secp160r1.b)
+            return [Point(x, y, secp160r1) for (x, y) in Tracker.decompress_content(tag.content, math, curveSizeBytes)]
         if len(tag.content) != 12 * curveSizeBytes:
             raise Exception("tag content should be equal to 6 * %d = %d, but it is %d" % (curveSizeBytes, 6 * curveSizeBytes, len(tag.content)))
         points = []
@@ -378,54 +891,54 @@ Polynomial 2: (%d, %d)
     @staticmethod
     def update_tag(reader: int, tag: Tag, data: dict):
         # load config values
-        (secp160r1, curveSizeBytes) = Tracker.load_curve(data)
+        (secp160r1, curveSizeBytes, pub_key, _, _, _, _, P) = Tracker.load_config(data)
         x0 = data["x0"]
         ai = data["readers"][reader]["a"]
-        pub_key = Point(data["public"]["x"], data["public"]["y"], secp160r1)
-        P = Point(data["P"]["x"], data["P"]["y"], secp160r1)
+
+        if Tracker.backend(data) == "jacobian":
+            message = Tracker.update_tag_content_jacobian(data, tag.content, x0, ai)
+            tag.updateTagContent(reader, message)
+            TagStore.of(data).put(tag)
+            log.debug("tag content length: %d\ntag content: %s", len(message), Log.hex(message))
+            return
 
         # get the tag points
         C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2  = Tracker.tag_content_to_points(tag, secp160r1, curveSizeBytes)
 
         # print the ciphertext for debugging
-        print("""CIPHERTEXT:
+        log.debug("""CIPHERTEXT:
     ID: (%d, %d)
     ID 2: (%d, %d)
     HMAC(ID):(%d, %d)
     HMAC(ID) 2:(%d, %d)
     Polynomial: (%d, %d)
     Polynomial 2: (%d, %d)
-    """ % (C_ID_1.x, C_ID_1.y, 
+    """, C_ID_1.x, C_ID_1.y, 
         C_ID_2.x, C_ID_2.y,
         C_hash_1.x, C_hash_1.y,
         C_hash_2.x, C_hash_2.y,  
         C_polynomial_1.x, C_polynomial_1.y,
-        C_polynomial_2.x, C_polynomial_2.y))
+        C_polynomial_2.x, C_polynomial_2.y)
 
         # calculate new ciphertexts
         new_C_poly_1 = x0 * C_polynomial_1 + ai * C_hash_1
         new_C_poly_2 = x0 * C_polynomial_2 + ai * C_hash_2
 
-        # reencrypt to prevent linking attacks
-        r_ID = random.randrange(secp160r1.n)
-        new_C_ID_1, new_C_ID_2 = (r_ID * P + C_ID_1, r_ID * pub_key + C_ID_2)
-        r_hash = random.randrange(secp160r1.n)
-        new_C_hash_1, new_C_hash_2 = (r_hash * P + C_hash_1, r_hash * pub_key + C_hash_2)
-        r_poly = random.randrange(secp160r1.n)
-        new_C_poly_1, new_C_poly_2 = (r_poly * P + new_C_poly_1, r_poly * pub_key + new_C_poly_2)
+        # reencrypt to prevent linking attacks, the randomizers are precomputed
+        (r_ID, r_hash, r_poly) = Tracker.randomizers(data).take(3)
+        new_C_ID_1, new_C_ID_2 = Tracker.reencrypt(data, C_ID_1, C_ID_2, r_ID)
+        new_C_hash_1, new_C_hash_2 = Tracker.reencrypt(data, C_hash_1, C_hash_2, r_hash)
+        new_C_poly_1, new_C_poly_2 = Tracker.reencrypt(data, new_C_poly_1, new_C_poly_2, r_poly)
 
         # new points array
         new_points = [new_C_ID_1, new_C_ID_2, new_C_hash_1, new_C_hash_2, new_C_poly_1, new_C_poly_2]
 
         # print new ciphertext
-        print("NEW CIPHERTEXT:\nPolynomial: (%d, %d)\nPolynomial 2: (%d, %d)\n" % (new_C_poly_1.x, new_C_poly_1.y, new_C_poly_2.x, new_C_poly_2.y))   
-        message = b""
-        for new_point in new_points:
-            message += new_point.x.to_bytes(curveSizeBytes, 'big') + new_point.y.to_bytes(curveSizeBytes, 'big') 
+        log.debug("NEW CIPHERTEXT:\nPolynomial: (%d, %d)\nPolynomial 2: (%d, %d)\n", new_C_poly_1.x, new_C_poly_1.y, new_C_poly_2.x, new_C_poly_2.y)
+        message = Tracker.tuples_to_content([Tracker.to_tuple(new_point) for new_point in new_points], curveSizeBytes, Tracker.encoding(data))
         tag.updateTagContent(reader, message)
-        with open("%s/%d.tag" % (data["dir"], tag.id), "wb") as f:
-            pickle.dump(tag, f)
-        print("tag content length: %d\ntag content: %s" % (len(message), message.hex()))
+        TagStore.of(data).put(tag)
+        log.debug("tag content length: %d\ntag content: %s", len(message), Log.hex(message))
 
     '''
     tag content should be: (C_ID.x, C_ID.y), (C_HMAC.x, C_HMAC.y), (C_poly.x, C_poly.y)
@@ -433,47 +946,103 @@ Polynomial 2: (%d, %d)
       1) decrypting and checking ID (Not Supported Yet)
       2) decrypting and checking the HMAC
       3) decrypting the polynomial and check with known evaluations
+    returns (True, path label) if the tag followed a valid path, (False, None) otherwise
     '''
     @staticmethod
-    def verify_tag(tag: Tag, data: dict):
+    def verify_tag(tag: Tag, data: dict) -> (bool, str):
         (secp160r1, curveSizeBytes, pub_key, pri_key, k, q, a0, P) = Tracker.load_config(data)
 
         # get the tag points
-        C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2  = Tracker.tag_content_to_points(tag, secp160r1, curveSizeBytes)
+        C_ID_1, C_ID_2, C_hash_1, C_hash_2, C_polynomial_1, C_polynomial_2  = Tracker.read_points(data, tag)
 
-        # decrypt
-        cipher = ElGamal(secp160r1)
-        P_ID = cipher.decrypt_point(pri_key, C_ID_1, C_ID_2)
-        print("P_ID: %s%s" % (P_ID.x.to_bytes(curveSizeBytes, 'big').hex(), P_ID.y.to_bytes(curveSizeBytes, 'big').hex()))
+        # decrypt, the plaintexts are (x, y) tuples
+        P_ID = Tracker.decrypt(data, C_ID_1, C_ID_2)
+        log.debug("P_ID: %s", Log.hex(P_ID, curveSizeBytes))
         if True: # placeholder for DB check
-            P_hash = cipher.decrypt_point(pri_key, C_hash_1, C_hash_2)
-            print("P_hash: %s%s" % (P_hash.x.to_bytes(curveSizeBytes, 'big').hex(), P_hash.y.to_bytes(curveSizeBytes, 'big').hex()))
-            # Generate HMAC(k, ID)
-            print("k: %s" % (str(k).encode()))
+            P_hash = Tracker.decrypt(data, C_hash_1, C_hash_2)
+            log.debug("P_hash: %s", Log.hex(P_hash, curveSizeBytes))
+            # Generate HMAC(k, ID), k is never logged
             hash = HMAC.new(str(k).encode(), digestmod=SHA256)
-            print("k digest: %s" % (hash.hexdigest()))
-            hash.update(P_ID.x.to_bytes(curveSizeBytes, 'big'))
-            hash.update(P_ID.y.to_bytes(curveSizeBytes, 'big'))
+            hash.update(P_ID[0].to_bytes(curveSizeBytes, 'big'))
+            hash.update(P_ID[1].to_bytes(curveSizeBytes, 'big'))
             digest = int(hash.hexdigest(), 16)
-            print("digest: %s" % (hash.hexdigest()))
+            log.debug("digest: %s", Log.hex(digest, 32))
             # values need to be stored as points
-            digest_point = digest * P
-            print("digest_point: %s%s" % (digest_point.x.to_bytes(curveSizeBytes, 'big').hex(), digest_point.y.to_bytes(curveSizeBytes, 'big').hex()))
+            digest_point = Tracker.base_multiply(data, "P", digest)
+            log.debug("digest_point: %s", Log.hex(digest_point, curveSizeBytes))
             if P_hash == digest_point:
-                P_polynomial = cipher.decrypt_point(pri_key, C_polynomial_1, C_polynomial_2)
-                print("P_polynomial: %s%s" % (P_polynomial.x.to_bytes(curveSizeBytes, 'big').hex(), P_polynomial.y.to_bytes(curveSizeBytes, 'big').hex()))
-                print("PLAINTEXT: (%d, %d)" % (P_polynomial.x, P_polynomial.y))
-                for path in data["valid_paths"]:
-                    eval = Point(path["x"], path["y"], secp160r1)
-                    tmp = eval * digest
-                    print("tmp: %s%s" % (tmp.x.to_bytes(curveSizeBytes, 'big').hex(), tmp.y.to_bytes(curveSizeBytes, 'big').hex()))
-                    print("Testing path: (%d, %d)" % (eval.x, eval.y))
-                    if eval * digest == P_polynomial:
-                        print("Match found: tag followed path %s" % (str(path["label"])))
-                        print("PLAINTEXT(DEC):\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n" % (P_ID.x, P_ID.y, P_hash.x, P_hash.y, P_polynomial.x, P_polynomial.y))
-                        exit(0)
-                print("No match found!")
+                P_polynomial = Tracker.decrypt(data, C_polynomial_1, C_polynomial_2)
+                log.debug("P_polynomial: %s", Log.hex(P_polynomial, curveSizeBytes))
+                log.debug("PLAINTEXT: (%d, %d)", P_polynomial[0], P_polynomial[1])
+                # P_polynomial = digest * eval, so one multiplication with the inverse of the digest gives the path point
+                eval = Tracker.multiply(data, pow(digest % q, -1, q), P_polynomial)
+                log.debug("Testing path: (%d, %d)", eval[0], eval[1])
+                label = Tracker.lookup_paths(data, [eval])[0]
+                if label is not None:
+                    log.info("Match found: tag followed path %s", label)
+                    log.debug("PLAINTEXT(DEC):\nID: (%d, %d)\nHMAC(ID): (%d, %d)\nPoynomial: (%d, %d)\n", P_ID[0], P_ID[1], P_hash[0], P_hash[1], P_polynomial[0], P_polynomial[1])
+                    return (True, label)
+                log.warning("No match found!")
+                return (False, None)
             else:
                 raise(ValueError("HMAC could not be verified!"))
         else:
-            raise(ValueError("ID has already been processed!"))
\ No newline at end of file
+            raise(ValueError("ID has already been processed!"))
+
+    '''
+    verifies many tags at once (e.g. a pallet at the manager reader), same checks as verify_tag
+    all ciphertexts are decrypted together: the private key is the same for every C1, so the multiplications
+    run in lockstep and every step shares one inversion between all points (ECMath.batch_multiply)
+    the path points are recovered the same way, the digest points come from the fixed base table
+    returns a list with (valid, path label) per tag, a tag with invalid content is not valid
+    '''
+    @staticmethod
+    def verify_many(tags: list, data: dict) -> list:
+        (secp160r1, curveSizeBytes, pub_key, pri_key, k, q, a0, P) = Tracker.load_config(data)
+        (math, tables) = Tracker.load_tables(data)
+        results = [(False, None)] * len(tags)
+
+        # get the tag points
+        parsed = []
+        for (i, tag) in enumerate(tags):
+            try:
+                parsed.append((i, Tracker.content_to_tuples(tag.content, math, curveSizeBytes)))
+            except Exception as e:
+                log.warning("Tag %d: %s", tag.id, e)
+
+        # decrypt: M = C2 - private * C1 for the ID, hash and polynomial of every tag
+        C1s = [points[j] for (_, points) in parsed for j in (0, 2, 4)]
+        C2s = [points[j] for (_, points) in parsed for j in (1, 3, 5)]
+        shared = math.batch_multiply([pri_key] * len(C1s), C1s)
+        plaintexts = math.batch_add(C2s, [math.neg(S) for S in shared])
+
+        # check HMAC(k, ID) of every tag
+        hmac = HMAC.new(str(k).encode(), digestmod=SHA256)
+        checked = []
+        for (t, (i, _)) in enumerate(parsed):
+            (P_ID, P_hash, P_polynomial) = plaintexts[3 * t : 3 * t + 3]
+            if P_ID is None or P_hash is None or P_polynomial is None:
+                log.warning("Tag %d: could not be decrypted", tags[i].id)
+                continue
+            hash = hmac.copy()
+            hash.update(P_ID[0].to_bytes(curveSizeBytes, 'big'))
+            hash.update(P_ID[1].to_bytes(curveSizeBytes, 'big'))
+            checked.append((i, int(hash.hexdigest(), 16), P_hash, P_polynomial))
+        digest_points = math.normalize_many([tables["P"].multiply_jacobian(digest) for (_, digest, _, _) in checked])
+        valid = []
+        for ((i, digest, P_hash, P_polynomial), digest_point) in zip(checked, digest_points):
+            if P_hash == digest_point:
+                valid.append((i, digest, P_polynomial))
+            else:
+                log.warning("Tag %d: HMAC could not be verified!", tags[i].id)
+
+        # P_polynomial = digest * eval, one multiplication with the inverse of the digest gives the path point
+        evals = math.batch_multiply([pow(digest % q, -1, q) for (_, digest, _) in valid], [P_polynomial for (_, _, P_polynomial) in valid])
+        labels = Tracker.lookup_paths(data, evals)
+        for ((i, _, _), label) in zip(valid, labels):
+            if label is not None:
+                log.info("Tag %d: followed path %s", tags[i].id, label)
+                results[i] = (True, label)
+            else:
+                log.warning("Tag %d: no match found!", tags[i].id)
+        return results
@@ -1,83 +1,521 @@
 '''
-Usage : python3 rfid2mqtt.py [MQTT broker] [topic]
+Usage : python3 rfid2mqtt.py [-h] [-q QOS] [-k KEEPALIVE] [-w INFLIGHT] [-Q QUEUE] [-b] [-e] [-l LATENCY]
+                             [-t TTL] [-r RSSI] [-c CACHE] [-s STATS] [-D DEVICE] [-R DEVICE=READER] broker topic
 
-Finds all connected boards using arduino-cli
-Spawns a new process for each board
+Finds all connected boards using arduino-cli (or uses the devices given with -D)
+Spawns a worker thread for each board
+Workers share a shutdown event and restart themselves after serial errors
+All workers publish through a single long-lived MQTT connection
+By default the serial port is polled with readlines(), which waits for the line to go quiet for 0.5 seconds
+With -e records are published as soon as they are framed, batches (-b) are sent after at most -l milliseconds
+A tag that stays in the field is only republished when it moves (rssi), its content changes, or every -t seconds
+With -R the records of a device carry its reader ID ("reader"), StepAuth needs it to verify a read
+With -s the throughput, publish latency and cpu time per record are printed periodically
+(use serial_replay.py to benchmark without readers)
 '''
 
-import sys
+import argparse
 import serial 
-import re
+import binascii
 import threading
+import signal
 import json
 import time
+import queue
 import subprocess
-import paho.mqtt.publish as publish
+import traceback
+import paho.mqtt.client as mqtt
 
+from collections import namedtuple, OrderedDict
 from os.path import exists
 
+# seconds to wait before reopening a device after a serial error (doubles up to the max)
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 30
+
+# framer of every device, used for the statistics
+framers = {}
+
+'''
+A single tag sighting as printed by the reader firmware:
+    rssi[-61] freq[915250] time[1234] epc[E2 00 ... ]
+    Size of msg: 4            (optional, followed by the user memory)
+    AA BB CC DD
+    Bad CRC                   (optional)
+epc and payload are bytes, payload is None if the reader did not send user memory
+'''
+Record = namedtuple("Record", ["rssi", "freq", "time", "epc", "payload", "crc_ok"])
+
+'''
+converts a record into the JSON object that gets published
+reader is the ID of the reader that saw the record (if known)
+'''
+def record_to_json(record, reader=None):
+	msg = {"EPC": record.epc.hex().upper(), "rssi": record.rssi, "freq": record.freq, "time": record.time}
+	if reader is not None:
+		msg["reader"] = reader
+	if record.payload is not None:
+		msg["size"] = len(record.payload)
+		msg["content"] = record.payload.hex().upper()
+	return msg
+
+'''
+Incremental framer for the raw serial byte stream
+feed() takes whatever bytes are available and returns the records that are complete
+A record is complete once the next line shows it has no (more) optional lines, or on flush()
+Lines are never decoded to str, fields are sliced from the raw bytes
+'''
+class RecordFramer:
+
+	# stages of the record that is being built
+	HEADER = 1
+	SIZE = 2
+	CONTENT = 3
+
+	# drop garbage if no newline shows up for this many bytes
+	MAX_LINE = 4096
+
+	def __init__(self):
+		self.buffer = bytearray()
+		self.pending = None
+		self.stage = None
+		self.size = 0
+		self.records = 0
+		self.corrupted = 0
+		self.bad_crc = 0
+
+	'''
+	returns the bytes between "name[" and the next "]"
+	'''
+	@staticmethod
+	def field(line, name):
+		start = line.index(name) + len(name)
+		return line[start:line.index(b"]", start)]
+
+	def feed(self, data):
+		records = []
+		self.buffer += data
+		start = 0
+		end = self.buffer.find(b"\n")
+		while end != -1:
+			self.line(bytes(self.buffer[start:end]).rstrip(b"\r"), records)
+			start = end + 1
+			end = self.buffer.find(b"\n", start)
+		del self.buffer[:start]
+		if len(self.buffer) > RecordFramer.MAX_LINE:
+			self.corrupted += 1
+			self.buffer.clear()
+		return records
+
+	'''
+	emits the pending record if it is complete
+	a record that still waits for its content is kept
+	'''
+	def flush(self, records=None):
+		if records is None:
+			records = []
+		if self.stage == RecordFramer.SIZE:
+			return records
+		if self.pending is not None:
+			records.append(self.pending)
+			self.records += 1
+		self.pending = None
+		self.stage = None
+		return records
+
+	def line(self, line, records):
+		if line.startswith(b"rssi["):
+			if self.stage == RecordFramer.SIZE:
+				# content never arrived
+				self.corrupted += 1
+				self.pending = None
+				self.stage = None
+			self.flush(records)
+			try:
+				self.pending = Record(int(self.field(line, b"rssi[")), int(self.field(line, b"freq[")), int(self.field(line, b"time[")),
+										binascii.unhexlify(self.field(line, b"epc[").replace(b" ", b"")), None, True)
+				self.stage = RecordFramer.HEADER
+			except (ValueError, binascii.Error):
+				self.corrupted += 1
+		elif self.stage == RecordFramer.HEADER and line.startswith(b"Size of msg: "):
+			try:
+				self.size = int(line[13:])
+				self.stage = RecordFramer.SIZE
+			except ValueError:
+				self.corrupted += 1
+				self.pending = None
+				self.stage = None
+		elif self.stage == RecordFramer.SIZE:
+			try:
+				payload = binascii.unhexlify(line.replace(b" ", b""))
+				if len(payload) != self.size:
+					raise ValueError("data and length mismatch")
+				self.pending = self.pending._replace(payload=payload)
+				self.stage = RecordFramer.CONTENT
+			except (ValueError, binascii.Error):
+				self.corrupted += 1
+				self.pending = None
+				self.stage = None
+		elif self.pending is not None and line == b"Bad CRC":
+			self.pending = self.pending._replace(crc_ok=False)
+			self.bad_crc += 1
+			self.flush(records)
+		else:
+			# anything else ends the record
+			self.flush(records)
+
+'''
+Suppresses repeated sightings of the same EPC across polling cycles
+A record is published on first sight, when its content changes, when its rssi moved by rssi_delta
+or when the ttl of the last publication expired; other sightings are counted as suppressed
+At ttl expiry the strongest sample of the window is published
+The cache holds at most max_size EPCs, the least recently seen are evicted first
+'''
+class EPCDeduplicator:
+
+	def __init__(self, ttl=5.0, rssi_delta=10, max_size=10000):
+		self.ttl = ttl
+		self.rssi_delta = rssi_delta
+		self.max_size = max_size
+		# epc -> [time of publication, published record, best record since publication]
+		self.cache = OrderedDict()
+		self.published = 0
+		self.suppressed = 0
+		self.evicted = 0
+
+	'''
+	returns the record that should be published, or None if the sighting is suppressed
+	'''
+	def offer(self, record, now=None):
+		if now is None:
+			now = time.monotonic()
+		entry = self.cache.get(record.epc)
+		if entry is None:
+			publish = record
+		else:
+			self.cache.move_to_end(record.epc)
+			(published_at, published, best) = entry
+			if best is None or record.rssi > best.rssi:
+				best = record
+				entry[2] = record
+			if record.payload is not None and record.payload != published.payload:
+				publish = record
+			elif abs(record.rssi - published.rssi) >= self.rssi_delta:
+				publish = record
+			elif now - published_at >= self.ttl:
+				publish = best
+			else:
+				self.suppressed += 1
+				return None
+		self.cache[record.epc] = [now, publish, None]
+		if len(self.cache) > self.max_size:
+			self.cache.popitem(last=False)
+			self.evicted += 1
+		self.published += 1
+		return publish
+
+	def stats(self):
+		return {"published": self.published, "suppressed": self.suppressed, "evicted": self.evicted, "cached": len(self.cache)}
+
+'''
+Long-lived MQTT connection shared by all reader workers
+Messages go through a local queue first, so broker outages only fill the queue
+When the queue is full the oldest message is dropped
+'''
+class MQTTPublisher:
+
+	def __init__(self, hostname, port=1883, qos=0, keepalive=60, max_inflight=20, queue_size=10000):
+		self.qos = qos
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.connected = threading.Event()
+		self.stopped = False
+		self.published = 0
+		self.dropped = 0
+		# seconds between framing and handing the message to the client, summed over all messages
+		self.latency = 0.0
+
+		# paho 2.x requires the callback api version, 1.x does not know it
+		try:
+			self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+		except AttributeError:
+			self.client = mqtt.Client()
+		self.client.on_connect = self.on_connect
+		self.client.on_disconnect = self.on_disconnect
+		self.client.max_inflight_messages_set(max_inflight)
+		self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+		self.client.connect_async(hostname, port, keepalive)
+		self.client.loop_start()
+		self.sender = threading.Thread(target=self.send, name="mqtt sender")
+		self.sender.daemon = True
+		self.sender.start()
+
+	def on_connect(self, client, userdata, flags, rc, properties=None):
+		if rc == 0:
+			print("Connected to MQTT broker")
+			self.connected.set()
+		else:
+			print("MQTT broker refused the connection: %s" % rc)
+
+	# paho 1.x passes (rc), paho 2.x passes (flags, reason code, properties)
+	def on_disconnect(self, client, userdata, *args):
+		rc = args[0] if len(args) == 1 else args[1]
+		self.connected.clear()
+		if rc != 0:
+			print("Lost connection to MQTT broker, queueing messages")
+
+	'''
+	queues a message, never blocks the reader workers
+	created is the time.monotonic() at which the (oldest) record in the message was framed
+	'''
+	def publish(self, topic, payload, created=None):
+		if created is None:
+			created = time.monotonic()
+		while True:
+			try:
+				self.queue.put_nowait((topic, payload, created))
+				return
+			except queue.Full:
+				try:
+					self.queue.get_nowait()
+					self.dropped += 1
+				except queue.Empty:
+					None
+
+	'''
+	drains the local queue while the broker is connected
+	'''
+	def send(self):
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			(topic, payload, created) = item
+			while not self.stopped:
+				self.connected.wait(1)
+				if self.connected.is_set() and self.client.publish(topic, payload, qos=self.qos).rc == mqtt.MQTT_ERR_SUCCESS:
+					self.published += 1
+					self.latency += time.monotonic() - created
+					break
+
+	'''
+	sends what is queued (if connected) and closes the connection
+	'''
+	def stop(self, timeout=5):
+		try:
+			self.queue.put_nowait(None)
+			self.sender.join(timeout)
+		except queue.Full:
+			None
+		self.stopped = True
+		self.client.disconnect()
+		self.client.loop_stop()
+		print("MQTT publisher stopped: %d published, %d dropped" % (self.published, self.dropped))
+
+'''
+adds the valid records to the batch, keeping the strongest sample of every EPC
+'''
+def collect_records(device, records, EPC):
+	for record in records:
+		if not record.crc_ok:
+			print("%s: bad crc: ignored" % device)
+		elif record.epc not in EPC or record.rssi > EPC[record.epc].rssi:
+			EPC[record.epc] = record
+
+'''
+publishes the records of one batch that pass the deduplicator, either as a list or one by one
+'''
+def publish_records(publisher, topic, batch, EPC, dedup, created, reader=None):
+	records = EPC.values()
+	if dedup is not None:
+		records = [record for record in map(dedup.offer, records) if record is not None]
+	if batch:
+		if len(records) > 0:
+			publisher.publish(topic, json.dumps([record_to_json(record, reader) for record in records]), created)
+	else:
+		for record in records:
+			publisher.publish(topic, json.dumps(record_to_json(record, reader)), created)
+
+'''
+event-driven alternative for the readlines() loop
+reads whatever is waiting (or blocks for at most max_latency seconds for the next byte)
+and publishes records as soon as they are framed
+batches are sent when the serial line goes quiet or when the oldest record is max_latency seconds old
+'''
+def stream_RFID_reader(ser, framer, reader, publisher, topic, batch, max_latency, dedup, shutdown):
+	ser.timeout = max_latency
+	EPC = {}
+	oldest = None
+	while not shutdown.is_set():
+		data = ser.read(max(1, ser.in_waiting))
+		# no data within max_latency: the last record is complete
+		records = framer.feed(data) if data else framer.flush()
+		collect_records(ser.port, records, EPC)
+		if len(EPC) > 0 and oldest is None:
+			oldest = time.monotonic()
+		if len(EPC) > 0 and (not batch or not data or time.monotonic() - oldest >= max_latency):
+			publish_records(publisher, topic, batch, EPC, dedup, oldest, reader)
+			EPC = {}
+			oldest = None
+
 '''
-will keep polling the device and log output to a file
+will keep polling the device until shutdown is set
 '''
-def poll_RFID_reader(device, hostname, topic):
+def poll_RFID_reader(device, reader, publisher, topic, batch, max_latency, dedup, shutdown):
 	with serial.Serial(device, 115200, timeout=0.5) as ser:
 		ser.flushInput()
 		ser.flushOutput()
-		time.sleep(3)
-		print(ser.readline())
+		shutdown.wait(3)
+		print("%s: %s" % (device, ser.readline()))
 		# input a first character to start reading		
 		ser.write(b'y')		
-		time.sleep(0.5)
-		while True:
-			# efficient and fast but not needed (https://stackoverflow.com/questions/676172/full-examples-of-using-pyserial-package)
-			#bytesToRead = ser.inWaiting()
-			#data = ser.read(bytesToRead).decode('UTF-8').strip()
-			#if data != "":
-			#	print("%s, %d" % (data, bytesToRead))
-
+		shutdown.wait(0.5)
+		framer = RecordFramer()
+		# a restarted worker replaces its framer, the record count goes on
+		if device in framers:
+			framer.records = framers[device].records
+		framers[device] = framer
+		if max_latency is not None:
+			stream_RFID_reader(ser, framer, reader, publisher, topic, batch, max_latency, dedup, shutdown)
+		while not shutdown.is_set():
 			# depends on timeout
 			EPC = {}
 			lines = ser.readlines()
-			print("reading %d lines" % len(lines))
-			for line in lines:
-				line = line.decode('UTF-8')
-				#matches = re.findall("rssi\[(\-\d*)\] freq\[(\d*)\] time\[(\d*)\] epc\[((?:[A-F0-9]{2} )*)\]\r\nSize of msg: (\d*)\r\n((?:[A-F0-9]{2} )*)\r\n(Bad CRC\r\n)?" , data)
-				matches = re.findall("rssi\[(\-\d*)\] freq\[(\d*)\] time\[(\d*)\] epc\[((?:[A-F0-9]{2} )*)\]?" , line)
-				for match in matches:
-					if len(match) == 4 and match[3] not in EPC:
-						EPC[match[3]] = {"EPC": match[3], "rssi": match[0], "freq": match[1], "time": match[2]}
-					if len(match) < 6:
-						print("not enough groups: corrupted data")
-					elif len(match[5].replace(" ", "")) != int(match[4]) * 2:
-						print("data and length mismatch: ignored")
-					elif len(match) == 7 and match[6] == "Bad CRC\r\n":
-						print("bad crc: ignored") 
-					elif match[3] not in EPC:
-						EPC[match[3]] = {"EPC": match[3], "rssi": match[0], "freq": match[1], "time": match[2], "size": match[4], "content": match[5]}
-
-			print("found %d EPC's" % len(EPC))
-			for epc in EPC:
-				publish.single(topic, json.dumps(EPC[epc]), hostname=hostname)
-
-
-if len(sys.argv) != 3:
-	print("Usage : python3 rfid2mqtt.py [MQTT broker] [topic]")
+			print("%s: reading %d lines" % (device, len(lines)))
+			framed = time.monotonic()
+			records = framer.feed(b"".join(lines))
+			# the line stream went quiet, so the last record has no more lines coming
+			framer.flush(records)
+			collect_records(device, records, EPC)
+			print("%s: found %d EPC's" % (device, len(EPC)))
+			publish_records(publisher, topic, batch, EPC, dedup, framed, reader)
+
+'''
+prints throughput, average publish latency and cpu time per record every interval seconds
+'''
+def report_stats(publisher, interval, shutdown):
+	last_records = 0
+	last_published = 0
+	last_latency = 0.0
+	last_cpu = time.process_time()
+	while not shutdown.wait(interval):
+		records = sum(framer.records for framer in list(framers.values()))
+		(published, latency, cpu) = (publisher.published, publisher.latency, time.process_time())
+		new_records = records - last_records
+		new_published = published - last_published
+		print("stats: %.1f records/s, %.1f messages/s, latency %.2f ms, cpu %.1f us/record, %d queued, %d dropped" % (
+				new_records / interval, new_published / interval,
+				1000 * (latency - last_latency) / max(new_published, 1),
+				1000000 * (cpu - last_cpu) / new_records if new_records > 0 else 0.0,
+				publisher.queue.qsize(), publisher.dropped))
+		(last_records, last_published, last_latency, last_cpu) = (records, published, latency, cpu)
+
+'''
+worker for a single device
+restarts polling after serial errors (e.g. board reset or unplugged) until shutdown is set
+'''
+def serve_RFID_reader(device, reader, publisher, topic, batch, max_latency, dedup, shutdown):
+	delay = RESTART_DELAY
+	while not shutdown.is_set():
+		started = time.monotonic()
+		try:
+			poll_RFID_reader(device, reader, publisher, topic, batch, max_latency, dedup, shutdown)
+		except (serial.SerialException, OSError) as e:
+			# a device that ran for a while gets a fresh backoff
+			if time.monotonic() - started > MAX_RESTART_DELAY:
+				delay = RESTART_DELAY
+			print("%s: serial error, restarting in %d seconds: %s" % (device, delay, e))
+			shutdown.wait(delay)
+			delay = min(2 * delay, MAX_RESTART_DELAY)
+		except Exception as e:
+			# any other error (e.g. in the framer or publisher) must not end the worker silently
+			if time.monotonic() - started > MAX_RESTART_DELAY:
+				delay = RESTART_DELAY
+			print("%s: unexpected error, restarting in %d seconds: %s" % (device, delay, e))
+			traceback.print_exc()
+			shutdown.wait(delay)
+			delay = min(2 * delay, MAX_RESTART_DELAY)
+	if dedup is not None:
+		print("%s: stopped, EPC's %s" % (device, dedup.stats()))
+	else:
+		print("%s: stopped" % device)
+
+
+parser = argparse.ArgumentParser(description='Publishes the tags seen by all connected RFID readers to MQTT')
+parser.add_argument('hostname', type=str,
+                    help='MQTT broker')
+parser.add_argument('topic', type=str,
+                    help='MQTT topic')
+parser.add_argument('-q', dest='qos', type=int, nargs=1, default=[0],
+                    help='MQTT quality of service', choices=[0, 1, 2], required=False)
+parser.add_argument('-k', dest='keepalive', type=int, nargs=1, default=[60],
+                    help='MQTT keep-alive interval in seconds', required=False)
+parser.add_argument('-w', dest='inflight', type=int, nargs=1, default=[20],
+                    help='Maximum number of QoS 1/2 messages in flight', required=False)
+parser.add_argument('-Q', dest='queue_size', type=int, nargs=1, default=[10000],
+                    help='Number of messages queued locally during broker outages', required=False)
+parser.add_argument('-b', dest='batch', action='store_true',
+                    help='Publish all EPCs of a polling cycle as one JSON list', required=False)
+parser.add_argument('-e', dest='event', action='store_true',
+                    help='Event-driven reads: publish records as soon as they are framed', required=False)
+parser.add_argument('-l', dest='latency', type=int, nargs=1, default=[20],
+                    help='Maximum batch latency in milliseconds for event-driven reads', required=False)
+parser.add_argument('-t', dest='ttl', type=float, nargs=1, default=[5.0],
+                    help='Seconds before an unchanged EPC is published again (0 disables deduplication)', required=False)
+parser.add_argument('-r', dest='rssi', type=int, nargs=1, default=[10],
+                    help='Rssi change that counts as a new sighting', required=False)
+parser.add_argument('-c', dest='cache_size', type=int, nargs=1, default=[10000],
+                    help='Maximum number of EPCs remembered per reader', required=False)
+parser.add_argument('-s', dest='stats', type=float, nargs=1,
+                    help='Print statistics every STATS seconds', required=False)
+parser.add_argument('-D', dest='devices', type=str, action='append',
+                    help='Serial device to read instead of the boards found by arduino-cli (repeatable)', required=False)
+parser.add_argument('-R', dest='readers', type=str, action='append',
+                    help='Reader ID of a device, e.g. /dev/ttyACM0=3 (repeatable)', required=False)
+
+args = parser.parse_args()
+hostname = args.hostname
+topic = args.topic
+max_latency = args.latency[0] / 1000 if args.event else None
+# reader ID per device
+readers = {}
+for mapping in args.readers or []:
+	(device, reader) = mapping.rsplit("=", 1)
+	readers[device] = int(reader)
+if args.devices:
+	devices = args.devices
 else:
-	hostname = sys.argv[1]
-	topic = sys.argv[2]
 	command_output = subprocess.run(["arduino-cli", "board", "list"], capture_output=True)
 	output_lines = command_output.stdout.decode('UTF-8').strip().split("\n")
-	if len(output_lines) > 1:
-		# assumes there are no spaces in the device name
-		devices = [output_lines[i].split(" ")[0] for i in range(1, len(output_lines))]
-		for device in devices:
-			if exists(device):
-				# spawn a new daemon thread
-				#t1 = threading.Thread(poll_RFID_reader, device, hostname, topic)
-				#t1.daemon = True
-				#t1.start()
-				poll_RFID_reader(device, hostname, topic)
-			else:
-				print("Not a valid device")
-	else:
+	# assumes there are no spaces in the device name
+	devices = [output_lines[i].split(" ")[0] for i in range(1, len(output_lines))]
+if len(devices) > 0:
+	publisher = MQTTPublisher(hostname, qos=args.qos[0], keepalive=args.keepalive[0], max_inflight=args.inflight[0], queue_size=args.queue_size[0])
+	shutdown = threading.Event()
+	workers = []
+	for device in devices:
+		if exists(device):
+			# one worker thread per reader
+			# every reader has its own cache, the same tag at another reader is a new sighting
+			dedup = EPCDeduplicator(args.ttl[0], args.rssi[0], args.cache_size[0]) if args.ttl[0] > 0 else None
+			worker = threading.Thread(target=serve_RFID_reader, args=(device, readers.get(device), publisher, topic, args.batch, max_latency, dedup, shutdown), name=device)
+			worker.daemon = True
+			worker.start()
+			workers.append(worker)
+		else:
+			print("Not a valid device: %s" % device)
+	if len(workers) == 0:
 		print("No RFID readers connected")
+	else:
+		# stop all workers on ctrl-c or kill
+		signal.signal(signal.SIGINT, lambda signum, frame: shutdown.set())
+		signal.signal(signal.SIGTERM, lambda signum, frame: shutdown.set())
+		if args.stats:
+			reporter = threading.Thread(target=report_stats, args=(publisher, args.stats[0], shutdown), name="stats")
+			reporter.daemon = True
+			reporter.start()
+		while any(worker.is_alive() for worker in workers):
+			for worker in workers:
+				worker.join(0.5)
+	publisher.stop()
+else:
+	print("No RFID readers connected")
@@ -0,0 +1,123 @@
+'''
+Usage : python3 serial_replay.py record [-h] [-s] [-d DURATION] device capture
+        python3 serial_replay.py replay [-h] [-x SPEED] [-n LOOPS] [-w] capture
+
+Captures the raw serial output of an RFID reader and replays it on a pseudo terminal,
+so rfid2mqtt.py can be benchmarked without a reader:
+	python3 serial_replay.py record /dev/ttyACM0 dock.cap -s -d 60
+	python3 serial_replay.py replay dock.cap -x 0 -w
+	python3 rfid2mqtt.py -e -s 5 -D /dev/pts/3 localhost RFID
+
+A capture is a sequence of chunks: timestamp (8 byte double, seconds since the start), length (4 bytes), raw bytes
+Replay speed 1 is real time, N is N times faster and 0 sends the chunks as fast as the reader side accepts them
+'''
+
+import argparse
+import os
+import serial
+import signal
+import struct
+import sys
+import time
+import tty
+
+CHUNK_HEADER = struct.Struct(">dI")
+
+'''
+writes everything the device sends to the capture file until ctrl-c or duration seconds passed
+'''
+def record(device, capture, start, duration):
+	stopped = []
+	signal.signal(signal.SIGINT, lambda signum, frame: stopped.append(signum))
+	with serial.Serial(device, 115200, timeout=0.1) as ser, open(capture, "wb") as f:
+		ser.flushInput()
+		if start:
+			# same start sequence as rfid2mqtt.py
+			time.sleep(3)
+			ser.readline()
+			ser.write(b'y')
+		started = time.monotonic()
+		chunks = 0
+		size = 0
+		while not stopped and (duration is None or time.monotonic() - started < duration):
+			data = ser.read(max(1, ser.in_waiting))
+			if data:
+				f.write(CHUNK_HEADER.pack(time.monotonic() - started, len(data)))
+				f.write(data)
+				chunks += 1
+				size += len(data)
+	print("Captured %d bytes in %d chunks" % (size, chunks))
+
+'''
+generator over the (timestamp, bytes) chunks of a capture file
+'''
+def read_capture(capture):
+	with open(capture, "rb") as f:
+		while True:
+			header = f.read(CHUNK_HEADER.size)
+			if len(header) < CHUNK_HEADER.size:
+				return
+			(timestamp, length) = CHUNK_HEADER.unpack(header)
+			yield (timestamp, f.read(length))
+
+'''
+replays the capture on a new pseudo terminal
+if wait is set, nothing is sent before the reader side writes the start character (like the firmware)
+'''
+def replay(capture, speed, loops, wait):
+	chunks = list(read_capture(capture))
+	if len(chunks) == 0:
+		print("Capture %s is empty" % capture)
+		return
+	(master, slave) = os.openpty()
+	# no echo and no newline translation, the bytes should arrive as captured
+	tty.setraw(slave)
+	print("Replaying %d chunks from %s on %s" % (len(chunks), capture, os.ttyname(slave)))
+	sys.stdout.flush()
+	if wait:
+		while os.read(master, 1) != b'y':
+			None
+	size = 0
+	started = time.monotonic()
+	for loop in range(loops):
+		offset = time.monotonic()
+		for (timestamp, data) in chunks:
+			if speed > 0:
+				delay = offset + timestamp / speed - time.monotonic()
+				if delay > 0:
+					time.sleep(delay)
+			os.write(master, data)
+			size += len(data)
+	elapsed = time.monotonic() - started
+	print("Replayed %d bytes in %.2f seconds (%.1f kB/s)" % (size, elapsed, size / 1000 / max(elapsed, 1e-9)))
+	# keep the terminal open until the reader side had a chance to read everything
+	input("Press enter to close %s" % os.ttyname(slave))
+	os.close(master)
+	os.close(slave)
+
+parser = argparse.ArgumentParser(description='Captures and replays the serial output of an RFID reader')
+subparsers = parser.add_subparsers(dest='command', required=True)
+record_parser = subparsers.add_parser('record', help='Capture a reader')
+record_parser.add_argument('device', type=str,
+                    help='Serial device of the reader')
+record_parser.add_argument('capture', type=str,
+                    help='Output file')
+record_parser.add_argument('-s', dest='start', action='store_true',
+                    help='Send the start character, like rfid2mqtt.py does', required=False)
+record_parser.add_argument('-d', dest='duration', type=float, nargs=1,
+                    help='Stop after DURATION seconds', required=False)
+replay_parser = subparsers.add_parser('replay', help='Replay a capture on a pseudo terminal')
+replay_parser.add_argument('capture', type=str,
+                    help='Capture file')
+replay_parser.add_argument('-x', dest='speed', type=float, nargs=1, default=[1.0],
+                    help='Replay speed: 1 is real time, 0 is as fast as possible', required=False)
+replay_parser.add_argument('-n', dest='loops', type=int, nargs=1, default=[1],
+                    help='Number of times the capture is replayed', required=False)
+replay_parser.add_argument('-w', dest='wait', action='store_true',
+                    help='Wait for the start character before replaying', required=False)
+
+args = parser.parse_args()
+if args.command == "record":
+	record(args.device, args.capture, args.start, args.duration[0] if args.duration else None)
+else:
+	replay(args.capture, args.speed[0], args.loops[0], args.wait)
@@ -13,6 +13,9 @@ import pickle
 import traceback
 
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
 from protocols.Tracker import Tracker
 from protocols.StepAuth import StepAuth
 from protocols.Baseline import Baseline
@@ -27,33 +30,42 @@ parser.add_argument('-r', dest='reader', type=int, nargs=1,
                     help='Specify a reader', required=True)
 parser.add_argument('-t', dest='tag', type=int, nargs=1,
                     help='Specify a tag', required=True)
+parser.add_argument('-p', dest='precompute', type=int, nargs=1, default=[0],
+                    help='Tracker: precompute randomizers for this many later updates before exiting', required=False)
+
+parser.add_argument('-v', dest='verbose', action='count', default=0,
+                    help='Print the debug output of the protocol (keys are never printed)', required=False)
 
 args = parser.parse_args()
+Log.configure(args.verbose)
 keyfile = args.keyfile[0]
 scheme = args.scheme[0]
 reader = args.reader[0]
 tag = args.tag[0]
 
 try:
-    data = json.load(open(keyfile))
+    data = KeyRegistry.load(keyfile)
     if scheme != "baseline" and (reader >= len(data["readers"]) or reader < 0):
         raise(ValueError('Readers can only use range 0..nr_readers'))
-    with open("%s/%d.tag" % (data["dir"], tag), 'rb+') as tagfile:
-        tag = pickle.load(tagfile)
-        # StepAuth
-        if scheme == "stepauth":
-            StepAuth.update_tag(reader, tag, data)
-        # AES encrypted tag secret baseline
-        elif scheme == "baseline":
-            Baseline.update_tag(reader, tag, data)
-        # Tracker
-        elif scheme == "tracker":
-            Tracker.update_tag(reader, tag, data)
-        # RF-chain
-        elif scheme == "rfchain":
-            RFChain.update_tag(reader, tag, data)
-        else:
-            raise(ValueError('Mode not supported!'))
+    tag = TagStore.of(data).get(tag)
+    # StepAuth
+    if scheme == "stepauth":
+        StepAuth.update_tag(reader, tag, data)
+    # AES encrypted tag secret baseline
+    elif scheme == "baseline":
+        Baseline.update_tag(reader, tag, data)
+    # Tracker
+    elif scheme == "tracker":
+        # precomputing for later updates: the pool is already filled in the background during this one
+        Tracker.randomizers(data, background=args.precompute[0] > 0)
+        Tracker.update_tag(reader, tag, data)
+        # the unused randomizers are stored in the keyfile directory on exit
+        Tracker.randomizers(data).fill(3 * args.precompute[0])
+    # RF-chain
+    elif scheme == "rfchain":
+        RFChain.update_tag(reader, tag, data)
+    else:
+        raise(ValueError('Mode not supported!'))
 except FileNotFoundError as e:
     print("File not found! Make sure that the parent directory exists: %s" % (e))
 except json.JSONDecodeError as e:
@@ -0,0 +1,267 @@
+'''
+python verify_service.py [-h] -f KEYFILE -s SCHEME [-b BROKER] [-t TOPIC] [-o OUTPUT] [-j WORKERS] [-q QOS] [-v]
+Long-running verification service:
+ 1. subscribes to the topic the reader firmware publishes to (RFID)
+ 2. collects the tag content of every read
+ 3. verifies it in a pool of worker processes that load the keyfile only once
+    (reads the pool can not keep up with wait in a bounded queue, when it is full they are dropped and counted)
+ 4. publishes a JSON verdict per read to the output topic (RFID/verdict)
+
+Two message formats are understood:
+ * firmware messages: {"reader id": "3", "msg": "Found Tag: <EPC>"} followed by {"reader id": "3", "msg": "User Bank: <content>"}
+ * rfid2mqtt.py records (or lists of records): {"EPC": <EPC>, "content": <content>, "reader": 3}
+   the bridge only adds "reader" for the devices it got a reader ID for (rfid2mqtt.py -R DEVICE=READER), StepAuth needs it
+'''
+
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+import paho.mqtt.client as mqtt
+
+from concurrent.futures import ProcessPoolExecutor
+from Tag import Tag
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
+
+# firmware messages that carry tag content
+CONTENT_PREFIXES = ["User Bank: ", "Raw Embedded Data(encrypted): ", "Succesfully updated tag content to: "]
+FOUND_PREFIX = "Found Tag: "
+# reads (per worker) that wait for the dispatcher, more are dropped
+BACKLOG = 1024
+
+# state of a worker process, set by init_worker
+worker = {}
+
+'''
+loads the keyfile and the protocol once per worker process
+'''
+def init_worker(keyfile: str, scheme: str, verbose: bool):
+    # workers should not die on ctrl-c, the service shuts them down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker["data"] = KeyRegistry.load(keyfile)
+    worker["scheme"] = scheme
+    worker["verbose"] = verbose
+    # the verdicts carry the results, the protocols only log their debug output if asked for
+    Log.configure(1 if verbose else -1)
+    if scheme == "baseline":
+        from protocols.Baseline import Baseline
+        worker["protocol"] = Baseline
+    elif scheme == "stepauth":
+        from protocols.StepAuth import StepAuth
+        worker["protocol"] = StepAuth
+    elif scheme == "tracker":
+        from protocols.Tracker import Tracker
+        worker["protocol"] = Tracker
+    elif scheme == "rfchain":
+        from protocols.RFChain import RFChain
+        worker["protocol"] = RFChain
+
+'''
+the reader returns its whole user bank, only keep the tag secret
+'''
+def trim_content(scheme: str, content: bytes, data: dict) -> bytes:
+    if scheme in ["baseline", "stepauth"] and len(content) >= 2:
+        return content[:2 + int.from_bytes(content[:2], "big")]
+    if scheme == "tracker":
+        # raw or compressed, see Tracker.encoding
+        return content[:worker["protocol"].content_length(data, content)]
+    if scheme == "rfchain":
+        return content[:196]
+    return content
+
+'''
+verifies a single read, runs in a worker process
+returns the verdict as a dict
+'''
+def verify(reader, epc: str, content: str, received: float) -> dict:
+    data = worker["data"]
+    scheme = worker["scheme"]
+    protocol = worker["protocol"]
+    verdict = {"EPC": epc, "reader": reader, "scheme": scheme, "valid": False, "result": None, "error": None}
+    try:
+        tag = Tag(int(epc, 16), trim_content(scheme, bytes.fromhex(content), data), scheme)
+        if scheme == "baseline":
+            (success, m) = protocol.verify_tag(tag, data)
+            verdict["result"] = m.hex() if success else None
+        elif scheme == "stepauth":
+            if reader is None:
+                raise ValueError("StepAuth needs the reader that read the tag (start rfid2mqtt.py with -R DEVICE=READER)")
+            (success, m) = protocol.verify_tag(reader, tag, data)
+            verdict["result"] = m.hex() if success else None
+        elif scheme == "rfchain":
+            (success, x) = protocol.verify_tag(tag, data)
+            verdict["result"] = int.from_bytes(x[1][-2:], "big") if success else None
+        elif scheme == "tracker":
+            (success, label) = protocol.verify_tag(tag, data)
+            verdict["result"] = label
+        verdict["valid"] = success
+    except Exception as e:
+        verdict["error"] = "%s: %s" % (type(e).__name__, e)
+        if worker["verbose"]:
+            traceback.print_exc()
+    verdict["latency"] = time.time() - received
+    return verdict
+
+'''
+subscribes to the reader topic and hands every read to the worker pool
+'''
+class VerificationService:
+
+    def __init__(self, keyfile: str, scheme: str, broker: str, topic: str, output: str, workers: int, qos: int, verbose: bool):
+        self.data = KeyRegistry.load(keyfile)
+        self.scheme = scheme
+        self.topic = topic
+        self.output = output
+        self.qos = qos
+        self.verbose = verbose
+        # last EPC seen per reader (firmware messages)
+        self.found = {}
+        self.received = 0
+        self.verified = 0
+        self.rejected = 0
+        # reads that were dropped because the pool could not keep up
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(keyfile, scheme, verbose))
+        # limit the reads that wait for a worker, only the dispatcher thread blocks on it
+        self.pending = threading.BoundedSemaphore(64 * (workers or os.cpu_count() or 1))
+        # reads handed from the mqtt loop to the dispatcher, the mqtt loop never blocks (keepalive)
+        self.backlog = queue.Queue(maxsize=BACKLOG * (workers or os.cpu_count() or 1))
+        self.dispatcher = threading.Thread(target=self.dispatch, name="dispatcher", daemon=True)
+
+        # paho 2.x requires the callback api version, 1.x does not know it
+        try:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.connect_async(broker)
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            print("Connected, verifying %s reads from topic %s" % (self.scheme, self.topic))
+            client.subscribe(self.topic, qos=self.qos)
+        else:
+            print("MQTT broker refused the connection: %s" % rc)
+
+    def on_message(self, client, userdata, message):
+        received = time.time()
+        try:
+            msg = json.loads(message.payload)
+        except ValueError:
+            return
+        for (reader, epc, content) in self.reads(msg):
+            try:
+                self.backlog.put_nowait((reader, epc, content, received))
+            except queue.Full:
+                with self.lock:
+                    self.dropped += 1
+
+    '''
+    extracts (reader, EPC, content) tuples from a firmware or bridge message
+    '''
+    def reads(self, msg):
+        if isinstance(msg, list):
+            return [read for m in msg for read in self.reads(m)]
+        if not isinstance(msg, dict):
+            return []
+        if "EPC" in msg:
+            if msg.get("content"):
+                return [(msg.get("reader"), msg["EPC"], msg["content"])]
+            return []
+        if "msg" in msg and "reader id" in msg:
+            reader = int(msg["reader id"])
+            text = msg["msg"]
+            if text.startswith(FOUND_PREFIX):
+                self.found[reader] = text[len(FOUND_PREFIX):].strip()
+                return []
+            for prefix in CONTENT_PREFIXES:
+                if text.startswith(prefix) and reader in self.found:
+                    return [(reader, self.found[reader], text[len(prefix):].strip())]
+        return []
+
+    '''
+    hands the queued reads to the worker pool, waits when the pool has enough pending reads
+    a None read stops the dispatcher
+    '''
+    def dispatch(self):
+        while True:
+            read = self.backlog.get()
+            if read is None:
+                return
+            self.submit(*read)
+
+    def submit(self, reader, epc, content, received):
+        self.pending.acquire()
+        with self.lock:
+            self.received += 1
+        future = self.pool.submit(verify, reader, epc, content, received)
+        future.add_done_callback(self.publish)
+
+    def publish(self, future):
+        self.pending.release()
+        try:
+            verdict = future.result()
+        except Exception as e:
+            print("Worker failed: %s" % e)
+            return
+        with self.lock:
+            if verdict["valid"]:
+                self.verified += 1
+            else:
+                self.rejected += 1
+        if self.verbose:
+            print(verdict)
+        self.client.publish(self.output, json.dumps(verdict), qos=self.qos)
+
+    def run(self, shutdown: threading.Event):
+        self.dispatcher.start()
+        self.client.loop_start()
+        shutdown.wait()
+        self.client.disconnect()
+        self.client.loop_stop()
+        # the reads that were queued before the disconnect are still verified
+        self.backlog.put(None)
+        self.dispatcher.join()
+        self.pool.shutdown(wait=True)
+        print("Stopped: %d reads, %d verified, %d rejected, %d dropped" % (self.received, self.verified, self.rejected, self.dropped))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Verifies the tags read by the readers')
+    parser.add_argument('-f', dest='keyfile', type=str, nargs=1,
+                        help='Keyfile', required=True)
+    parser.add_argument('-s', dest='scheme', type=str, nargs=1,
+                        help='Select scheme', choices=["tracker", "baseline", "stepauth", "rfchain"], required=True)
+    parser.add_argument('-b', dest='broker', type=str, nargs=1, default=["localhost"],
+                        help='MQTT broker', required=False)
+    parser.add_argument('-t', dest='topic', type=str, nargs=1, default=["RFID"],
+                        help='Topic the readers publish to', required=False)
+    parser.add_argument('-o', dest='output', type=str, nargs=1, default=["RFID/verdict"],
+                        help='Topic for the verdicts', required=False)
+    parser.add_argument('-j', dest='workers', type=int, nargs=1, default=[None],
+                        help='Number of worker processes (default: number of cores)', required=False)
+    parser.add_argument('-q', dest='qos', type=int, nargs=1, default=[0],
+                        help='MQTT quality of service', choices=[0, 1, 2], required=False)
+    parser.add_argument('-v', dest='verbose', action='store_true',
+                        help='Print the debug output of the protocols and every verdict', required=False)
+
+    args = parser.parse_args()
+    try:
+        service = VerificationService(args.keyfile[0], args.scheme[0], args.broker[0], args.topic[0], args.output[0],
+                                      args.workers[0], args.qos[0], args.verbose)
+        shutdown = threading.Event()
+        signal.signal(signal.SIGINT, lambda signum, frame: shutdown.set())
+        signal.signal(signal.SIGTERM, lambda signum, frame: shutdown.set())
+        service.run(shutdown)
+    except FileNotFoundError as e:
+        print("File not found! Make sure that the keyfile exists: %s" % (e))
+    except json.JSONDecodeError as e:
+        print("File is not in JSON format! Error: %s" % e)
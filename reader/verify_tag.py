@@ -9,6 +9,9 @@ import traceback
 import pickle
 
 from Tag import Tag
+from TagStore import TagStore
+from protocols.KeyRegistry import KeyRegistry
+from protocols.Log import Log
 from protocols.Tracker import Tracker
 from protocols.StepAuth import StepAuth
 from protocols.Baseline import Baseline
@@ -21,34 +24,47 @@ parser.add_argument('-s', dest='scheme', type=str, nargs=1,
                     help='Select scheme', choices=["tracker", "baseline", "stepauth", "rfchain"], required=True)
 parser.add_argument('-r', dest='reader', type=int, nargs=1,
                     help='Specify a reader', required=False)
-parser.add_argument('-t', dest='tag', type=int, nargs=1,
-                    help='Specify a tag', required=True)
+parser.add_argument('-t', dest='tag', type=int, nargs="+",
+                    help='Specify one or more tags', required=True)
+parser.add_argument('--audit', dest='audit', action='store_true',
+                    help='RF-Chain: verify every hop, also the ones that were verified before', required=False)
+parser.add_argument('-j', dest='workers', type=int, nargs=1, default=[1],
+                    help='RF-Chain: number of processes that check the signatures of long chains', required=False)
+
+parser.add_argument('-v', dest='verbose', action='count', default=0,
+                    help='Print the debug output of the protocol (keys are never printed)', required=False)
 
 args = parser.parse_args()
+Log.configure(args.verbose)
 keyfile = args.keyfile[0]
 scheme = args.scheme[0]
-tag = args.tag[0]
+tags = args.tag
 
 try:
-    data = json.load(open(keyfile))
-    with open("%s/%d.tag" % (data["dir"], tag), 'rb') as tagfile:    
-        tag = pickle.load(tagfile)
-        # StepAuth
-        if scheme == "stepauth":
-            reader = args.reader[0]
-            StepAuth.verify_tag(reader, tag, data)
-        # AES encrypted tag secret baseline
-        elif scheme == "baseline":
-            Baseline.verify_tag(tag, data)
-        # Tracker
-        elif scheme == "tracker":
-            Tracker.verify_tag(tag, data)
-        # RF-chain
-        elif scheme == "rfchain":
-            RFChain.verify_tag(tag, data)
-            None
-        else:
-            raise(ValueError('Mode not supported!'))
+    data = KeyRegistry.load(keyfile)
+    # Tracker verifies several tags in one batch
+    if scheme == "tracker" and len(tags) > 1:
+        tagObjs = [TagStore.of(data).get(tag) for tag in tags]
+        results = Tracker.verify_many(tagObjs, data)
+        print("%d of %d tags followed a valid path" % (len([valid for (valid, _) in results if valid]), len(results)))
+    else:
+        for tag in tags:
+            tag = TagStore.of(data).get(tag)
+            # StepAuth
+            if scheme == "stepauth":
+                reader = args.reader[0]
+                StepAuth.verify_tag(reader, tag, data)
+            # AES encrypted tag secret baseline
+            elif scheme == "baseline":
+                Baseline.verify_tag(tag, data)
+            # Tracker
+            elif scheme == "tracker":
+                Tracker.verify_tag(tag, data)
+            # RF-chain
+            elif scheme == "rfchain":
+                RFChain.verify_tag(tag, data, audit=args.audit, workers=args.workers[0])
+            else:
+                raise(ValueError('Mode not supported!'))
 except FileNotFoundError as e:
     print("File not found! Make sure that the parent directory exists: %s" % (e))
 except json.JSONDecodeError as e: